@@ -30,6 +30,24 @@ const local_settings = {
     } else {
       return false; // default
     }
+  }(),
+
+  RENDER_CACHE_SIZE: function(){
+    // Number of rendered pages to keep. 0 turns off the render cache.
+    if ('RENDER_CACHE_SIZE' in process.env) {
+      return parseInt(process.env.RENDER_CACHE_SIZE);
+    } else {
+      return 1000; // default
+    }
+  }(),
+
+  RENDER_CACHE_TTL: function(){
+    // Milliseconds a rendered page is kept
+    if ('RENDER_CACHE_TTL' in process.env) {
+      return parseInt(process.env.RENDER_CACHE_TTL);
+    } else {
+      return 5 * 60 * 1000; // default
+    }
   }()
 }
 
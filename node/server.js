@@ -48,33 +48,113 @@ var renderReaderApp = function(props, data, timer) {
   return html;
 };
 
+var renderCache = {
+  // Rendered HTML keyed by the hash of component and props sent by Django, and the version of data.js it was rendered with.
+  // Bounded by RENDER_CACHE_SIZE entries, least recently used evicted first, each kept at most RENDER_CACHE_TTL ms.
+  entries: new Map(),
+  hits: 0,
+  misses: 0,
+  get: function(key) {
+    var entry = this.entries.get(key);
+    if (!entry || entry.expires < Date.now()) {
+      if (entry) { this.entries.delete(key); }
+      this.misses++;
+      return null;
+    }
+    this.entries.delete(key);  // reinsert to mark as most recently used
+    this.entries.set(key, entry);
+    this.hits++;
+    return entry.html;
+  },
+  set: function(key, html) {
+    if (!settings.RENDER_CACHE_SIZE) { return; }
+    this.entries.delete(key);
+    this.entries.set(key, {html: html, expires: Date.now() + settings.RENDER_CACHE_TTL});
+    while (this.entries.size > settings.RENDER_CACHE_SIZE) {
+      this.entries.delete(this.entries.keys().next().value);
+    }
+  }
+};
+
+var dataCache = {
+  // The DJANGO_DATA_VARS of /data.js, fetched once per version token sent by Django.
+  version: null,
+  vars: null,
+  pending: null,  // callbacks waiting on a fetch in progress, so that concurrent renders share one fetch
+  get: function(version, callback) {
+    // Without a version token, always fetch
+    if (version !== null && this.vars && this.version === version) {
+      return callback(null, this.vars);
+    }
+    if (version !== null && this.pending && this.pending.version === version) {
+      this.pending.callbacks.push(callback);
+      return;
+    }
+    var self = this;
+    var pending = this.pending = {version: version, callbacks: [callback]};
+    var options = {
+      url: "http://".concat(settings.DJANGO_HOST, ":", settings.DJANGO_PORT, "/data.js"),
+      headers: {
+        "User-Agent": "sefaria-node"
+      }
+    };
+    request(options, function(error, response, body) {
+      var err = null;
+      if (!error && response.statusCode == 200) {
+        (0, eval)(body); // to understand why this is necessary, see: https://stackoverflow.com/questions/19357978/indirect-eval-call-in-strict-mode
+        self.version = version;
+        self.vars = DJANGO_DATA_VARS;
+        log("Loaded data.js version %s", version);
+      } else {
+        console.error("ERROR: %s %s", response && response.statusCode, error);
+        err = error || new Error("Status " + (response && response.statusCode));
+      }
+      if (self.pending === pending) { self.pending = null; }
+      pending.callbacks.forEach(function(cb) { cb(err, self.vars); });
+    });
+  }
+};
+
 server.post('/ReaderApp/:cachekey', function(req, res) {
   var timer = {
     start: new Date(),
     elapsed: function() { return (new Date() - this.start); }
   };
+  var dataVersion = req.body.dataVersion || null;
+  var cacheKey = req.params.cachekey + ":" + dataVersion;
+  var cached = dataVersion ? renderCache.get(cacheKey) : null;
+  if (cached !== null) {
+    res.set("X-Render-Cache", "hit");
+    res.set("X-Render-Time", timer.elapsed());
+    res.end(cached);
+    return;
+  }
   var props = JSON.parse(req.body.propsJSON);
-  // var cacheKey = req.params.cachekey
   log(props.initialRefs || props.initialMenu);
   log("Time to props: %dms", timer.elapsed());
-  var options = {
-    url: "http://".concat(settings.DJANGO_HOST, ":", settings.DJANGO_PORT, "/data.js"),
-    headers: {
-      "User-Agent": "sefaria-node"
-    }
-  };
-  request(options, function(error, response, body) {
-    if (!error && response.statusCode == 200) {
-      log("Time to get data.js: %dms", timer.elapsed());
-      (0, eval)(body); // to understand why this is necessary, see: https://stackoverflow.com/questions/19357978/indirect-eval-call-in-strict-mode
-      log("Time to eval data.js: %dms", timer.elapsed());
-      var html = renderReaderApp(props, DJANGO_DATA_VARS, timer);
-      res.end(html);
-      log("Time to complete: %dms", timer.elapsed());
-    } else {
-      console.error("ERROR: %s %s", response && response.statusCode, error);
-      res.end("There was an error accessing /data.js.");
+  dataCache.get(dataVersion, function(error, data) {
+    if (error) {
+      res.status(500).end("There was an error accessing /data.js.");
+      return;
     }
+    var dataTime = timer.elapsed();
+    log("Time to get data.js: %dms", dataTime);
+    var html = renderReaderApp(props, Object.assign({}, data), timer);
+    if (dataVersion) { renderCache.set(cacheKey, html); }
+    res.set("X-Render-Cache", "miss");
+    res.set("X-Data-Time", dataTime);
+    res.set("X-Render-Time", timer.elapsed());
+    res.end(html);
+    log("Time to complete: %dms", timer.elapsed());
+  });
+});
+
+server.get('/cache-stats', function(req, res) {
+  res.json({
+    renderCacheSize: renderCache.entries.size,
+    renderCacheHits: renderCache.hits,
+    renderCacheMisses: renderCache.misses,
+    dataVersion: dataCache.version
   });
 });
 
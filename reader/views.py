@@ -64,11 +64,7 @@ logger = logging.getLogger(__name__)
 #    #    #
 # Initialized cache library objects that depend on sefaria.model being completely loaded.
 logger.warn("Initializing library objects.")
-library.get_toc_tree()
-library.build_full_auto_completer()
-library.build_ref_auto_completer()
-library.build_lexicon_auto_completers()
-library.build_cross_lexicon_auto_completer()
+library.warm_up()
 if server_coordinator:
     server_coordinator.connect()
 #    #    #
@@ -116,6 +112,40 @@ def old_versions_redirect(request, tref, lang, version):
     return response
 
 
+_node_pool = None
+_data_js_version = (None, None)  # (toc json the version was computed from, version)
+
+
+def get_node_pool():
+    """
+    Pool of keep-alive connections to the Node server, shared by all renders in this process.
+    """
+    global _node_pool
+    if _node_pool is None:
+        import urllib3
+        from sefaria.settings import NODE_TIMEOUT
+        try:
+            from sefaria.settings import NODE_POOL_MAXSIZE
+        except ImportError:
+            NODE_POOL_MAXSIZE = 10
+        _node_pool = urllib3.PoolManager(maxsize=NODE_POOL_MAXSIZE, block=False, retries=False,
+                                         timeout=urllib3.Timeout(connect=min(1.0, NODE_TIMEOUT), read=NODE_TIMEOUT))
+    return _node_pool
+
+
+def get_data_js_version():
+    """
+    A token that changes whenever the content of /data.js does for anonymous users, so that Node knows to reload it:
+    when the TOC is rebuilt, and daily for the calendars.
+    """
+    global _data_js_version
+    toc_json = library.get_toc_json()
+    if _data_js_version[0] is not toc_json:
+        import hashlib
+        _data_js_version = (toc_json, hashlib.md5(toc_json.encode("utf-8")).hexdigest()[:12])
+    return "{}-{}".format(_data_js_version[1], datetime.now().strftime("%Y-%m-%d"))
+
+
 def render_react_component(component, props):
     """
     Asks the Node Server to render `component` with `props`.
@@ -125,23 +155,33 @@ def render_react_component(component, props):
     if not USE_NODE:
         return render_to_string("elements/loading.html", context={"SITE_SETTINGS": SITE_SETTINGS})
 
-    from sefaria.settings import NODE_TIMEOUT
+    import hashlib
+    import time
+    import urllib3
 
     propsJSON = json.dumps(props) if isinstance(props, dict) else props
-    cache_key = "todo" # zlib.compress(propsJSON)
+    cache_key = hashlib.sha1("{}\n{}".format(component, propsJSON).encode("utf-8")).hexdigest()
     url = NODE_HOST + "/" + component + "/" + cache_key
 
     encoded_args = urllib.parse.urlencode({
         "propsJSON": propsJSON,
+        "dataVersion": get_data_js_version(),
     }).encode("utf-8")
+    start = time.time()
     try:
-        req = urllib.request.Request(url)
-        response = urllib.request.urlopen(req, encoded_args, NODE_TIMEOUT)
-        html = response.read().decode("utf-8")
+        response = get_node_pool().request("POST", url, body=encoded_args,
+                                           headers={"Content-Type": "application/x-www-form-urlencoded"})
+        if response.status != 200:
+            raise Exception("Node returned status {}".format(response.status))
+        html = response.data.decode("utf-8")
+        total_ms = (time.time() - start) * 1000
+        render_ms = float(response.headers.get("X-Render-Time", 0))
+        logger.debug("Node render of {}: {:.0f}ms total, {:.0f}ms rendering, {:.0f}ms transport, cache {}".format(
+            component, total_ms, render_ms, total_ms - render_ms, response.headers.get("X-Render-Cache", "unknown")))
         return html
     except Exception as e:
         # Catch timeouts, however they may come.  Write to file NODE_TIMEOUT_MONITOR, which forever monitors to restart process
-        if isinstance(e, socket.timeout) or (hasattr(e, "reason") and isinstance(e.reason, socket.timeout)):
+        if isinstance(e, (socket.timeout, urllib3.exceptions.TimeoutError)) or (hasattr(e, "reason") and isinstance(e.reason, socket.timeout)):
             props = json.loads(props) if isinstance(props, str) else props
             logger.exception("Node timeout: {} / {} / {} / {}\n".format(
                     props.get("initialPath"),
@@ -1926,9 +1966,10 @@ def related_api(request, tref):
     elif request.GET.get("private", False) and not request.user.is_authenticated:
         response = {"error": "You must be logged in to access private content."}
     else:
+        sheets = get_sheets_for_ref(tref)
         response = {
-            "links": get_links(tref, with_text=False, with_sheet_links=request.GET.get("with_sheet_links", False)),
-            "sheets": get_sheets_for_ref(tref),
+            "links": get_links(tref, with_text=False, with_sheet_links=request.GET.get("with_sheet_links", False), public_sheets=sheets),
+            "sheets": sheets,
             "notes": [],  # get_notes(oref, public=True) # Hiding public notes for now
             "webpages": get_webpages_for_ref(tref),
         }
@@ -3254,11 +3295,13 @@ def profile_sync_api(request):
                     profile_updated = True
             elif field == "user_history":
                 # loop thru `field_data` reversed to apply `last_place` to the last item read in each book
+                hists = []
                 for hist in reversed(field_data):
                     if 'ref' not in hist:
                         logger.warning(f'Ref not in hist. Post data: {post[field]}. User ID: {request.user.id}')
                         continue
-                    uh = UserHistory.save_history_item(request.user.id, hist, now)
+                    hists.append(hist)
+                for uh in UserHistory.save_history_items(request.user.id, hists, now):
                     ret["created"] += [uh.contents(for_api=True)]
 
         if not no_return:
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+Stores full text checkpoints in the existing history of every text with enough history,
+so that sefaria.history.text_at_revision() can start from them.  Safe to re-run.
+Checkpoint frequency and storage overhead are set by HISTORY_CHECKPOINT_INTERVAL, HISTORY_CHECKPOINT_PATCH_BYTES
+and HISTORY_CHECKPOINT_MAX_OVERHEAD in local_settings.
+"""
+import django
+django.setup()
+
+from sefaria.history import backfill_checkpoints
+
+backfill_checkpoints(verbose=True)
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Builds the merged view of every text with more than one version in a language, so that TextChunk can read it.
+Safe to re-run.  Once complete, set USE_MERGED_VERSIONS = True in local_settings.
+"""
+import django
+django.setup()
+
+from sefaria.model import *
+from sefaria.model.merged_version import build_merged_version
+
+titles = VersionSet().distinct("title")
+for i, title in enumerate(titles):
+    for lang in ("he", "en"):
+        build_merged_version(title, lang)
+    if i % 100 == 0:
+        print("{}/{}".format(i, len(titles)))
+print("Done. {} merged views.".format(MergedVersionSet().count()))
@@ -7,5 +7,5 @@ import csv
 
 import sefaria.export as export
 
-export.export_all()
-
+# --full exports everything again, rather than only what changed since the last export
+export.export_all(full="--full" in sys.argv)
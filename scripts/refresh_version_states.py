@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Refreshes the VersionState of every Index, e.g. after a mass import, and rebuilds the TOC.
+Indexes whose versions haven't changed since their last refresh are skipped.
+
+    python scripts/refresh_version_states.py [--force] [--workers N] [--timeout SECONDS]
+
+--force counts every Index again, e.g. after versions were written around Version.save().
+Defaults for --workers and --timeout are VSTATE_REFRESH_WORKERS and VSTATE_REFRESH_TIMEOUT in local_settings.
+"""
+import argparse
+from pprint import pprint
+
+import django
+django.setup()
+
+from sefaria.model.version_state import refresh_all_states
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--force", action="store_true")
+parser.add_argument("--workers", type=int)
+parser.add_argument("--timeout", type=int)
+args = parser.parse_args()
+
+report = refresh_all_states(force=args.force, workers=args.workers, timeout=args.timeout)
+print("{} recomputed, {} unchanged, {} failed, in {} seconds".format(
+    len(report["recomputed"]), report["unchanged"], len(report["failed"]), report["seconds"]))
+pprint(report["failed"])
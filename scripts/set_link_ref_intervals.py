@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Sets `refIntervals` on every link, so that links can be looked up with LinkSet.by_interval().
+Safe to re-run.  Once complete, set USE_LINK_INTERVALS = True in local_settings.
+"""
+import django
+django.setup()
+
+from pymongo import UpdateOne
+from sefaria.model import *
+from sefaria.system.database import db
+from sefaria.system.exceptions import InputError
+
+BATCH_SIZE = 5000
+
+updates = []
+bad = 0
+for i, link in enumerate(db.links.find({}, {"refs": 1})):
+    try:
+        intervals = [Ref(tref).order_interval() for tref in link["refs"]]
+    except (InputError, KeyError, IndexError):
+        print("Bad link: {}".format(link.get("refs")))
+        bad += 1
+        continue
+    updates.append(UpdateOne({"_id": link["_id"]}, {"$set": {"refIntervals": intervals}}))
+    if len(updates) >= BATCH_SIZE:
+        db.links.bulk_write(updates, ordered=False)
+        updates = []
+        print("{} links".format(i + 1))
+
+if updates:
+    db.links.bulk_write(updates, ordered=False)
+
+db.links.create_index([("refIntervals.book", 1), ("refIntervals.start", 1), ("refIntervals.end", 1)])
+print("Done. {} bad links skipped.".format(bad))
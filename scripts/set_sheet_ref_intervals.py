@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Sets `includedRefIntervals` on every sheet, so that sheets can be looked up by range queries in get_sheets_for_ref().
+Safe to re-run.  Once complete, set USE_SHEET_INTERVALS = True in local_settings.
+"""
+import django
+django.setup()
+
+from pymongo import UpdateOne
+from sefaria.sheets import ref_intervals
+from sefaria.system.database import db
+
+BATCH_SIZE = 5000
+
+updates = []
+for i, sheet in enumerate(db.sheets.find({}, {"includedRefs": 1})):
+    updates.append(UpdateOne({"_id": sheet["_id"]}, {"$set": {"includedRefIntervals": ref_intervals(sheet.get("includedRefs", []))}}))
+    if len(updates) >= BATCH_SIZE:
+        db.sheets.bulk_write(updates, ordered=False)
+        updates = []
+        print("{} sheets".format(i + 1))
+
+if updates:
+    db.sheets.bulk_write(updates, ordered=False)
+
+db.sheets.create_index([("includedRefIntervals.book", 1), ("includedRefIntervals.start", 1), ("includedRefIntervals.end", 1)])
+print("Done.")
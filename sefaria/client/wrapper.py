@@ -168,11 +168,13 @@ def get_notes(oref, public=True, uid=None, context=1):
     return notes
 
 
-def get_links(tref, with_text=True, with_sheet_links=False):
+def get_links(tref, with_text=True, with_sheet_links=False, public_sheets=None):
     """
     Return a list of links tied to 'ref' in client format.
     If `with_text`, retrieve texts for each link.
     If `with_sheet_links` include sheet results for sheets in groups which are listed in the TOC.
+    `public_sheets` may be given the public sheets of `tref`, as returned by `get_sheets_for_ref`, if the caller has them,
+    to pick the sheet results from rather than looking them up again.
     """
     links = []
     oref = Ref(tref)
@@ -183,7 +185,7 @@ def get_links(tref, with_text=True, with_sheet_links=False):
     # for storing all the section level texts that need to be looked up
     texts = {}
 
-    linkset = LinkSet(oref)
+    linkset = oref.linkset()
     # For all links that mention ref (in any position)
     for link in linkset:
         # each link contains 2 refs in a list
@@ -312,7 +314,10 @@ def get_links(tref, with_text=True, with_sheet_links=False):
 
     groups = library.get_groups_in_library()
     if with_sheet_links and len(groups):
-        sheet_links = get_sheets_for_ref(tref, in_group=groups)
+        if public_sheets is None:
+            sheet_links = get_sheets_for_ref(tref, in_group=groups)
+        else:
+            sheet_links = [dict(sheet) for sheet in public_sheets if sheet["group"] in groups]
         formatted_sheet_links = [format_sheet_as_link(sheet) for sheet in sheet_links]
         links += formatted_sheet_links
 
@@ -0,0 +1,136 @@
+"""
+offset_table.py: prefix sums over the shape of a jagged array of counts, for numbering and navigating its segments without walking it
+
+"""
+
+import numpy as np
+
+
+class OffsetTable(object):
+    """
+    Flat form of a jagged array of counts of a fixed depth, such as a VersionState "availableTexts" array.
+
+    The elements of each level are numbered in document order.  For each level but the last, `_starts[d]` holds the
+    number of the first child of each element, and one past the last, so the children of element i are
+    `_starts[d][i]` up to `_starts[d][i + 1]`.  `_offsets[d]` holds the number of the first segment under each element,
+    the prefix sums of the segment counts.  Segments are the elements of the last level, and a segment's ordinal is its
+    number in that level.  `_available` lists, in order, the ordinals of the segments with a non-zero count.
+
+    Looking an element up by its indexes is one step per level.  Looking up the indexes of an ordinal, or the nearest
+    available segment, is one binary search per level.
+
+    Answers match those of :class:`JaggedArray` for well formed arrays.  Where the array is shallower than `depth`,
+    the missing levels count as empty.
+    """
+
+    def __init__(self, counts, depth):
+        """
+        :param counts: Nested lists of ints
+        :param depth: Depth of the array, e.g. the depth of its JaggedArrayNode
+        """
+        self.depth = depth
+        self._starts = []
+        level = counts if isinstance(counts, list) else []
+        self._top_length = len(level)
+        for _ in range(depth - 1):
+            lengths = np.fromiter((len(e) if isinstance(e, list) else 0 for e in level), dtype=np.int64, count=len(level))
+            self._starts.append(np.concatenate(([0], np.cumsum(lengths))))
+            level = [c for e in level if isinstance(e, list) for c in e]
+
+        self.segment_count = len(level)
+        self._available = np.flatnonzero(np.fromiter((bool(e) for e in level), dtype=bool, count=len(level)))
+
+        self._offsets = [None] * depth
+        self._offsets[-1] = np.arange(self.segment_count + 1)
+        for d in range(depth - 2, -1, -1):
+            self._offsets[d] = self._offsets[d + 1][self._starts[d]]
+
+    def __len__(self):
+        return self.segment_count
+
+    def available_count(self):
+        return len(self._available)
+
+    def _segment(self, indexes, clamp):
+        """
+        :param indexes: list of 0 based indexes, padded with 0s to the full depth
+        :param clamp: At the last level, count an index past the end of its array as the end of the array.
+            Otherwise, as :meth:`JaggedArray.distance` does, keep counting past the end of a non-empty array.
+        :return: ordinal of the segment at `indexes`.  For indexes past the end of an array above the last level,
+            the ordinal of the first segment after the array.
+        """
+        if len(indexes) > self.depth:
+            raise IndexError("{} indexes for an array of depth {}".format(len(indexes), self.depth))
+        lo, hi = 0, self._top_length
+        for d in range(self.depth):
+            i = max(indexes[d], 0) if d < len(indexes) else 0
+            if d == self.depth - 1:
+                return min(lo + i, hi) if clamp or hi == lo else lo + i
+            if lo + i >= hi:
+                return int(self._offsets[d][hi])
+            lo, hi = int(self._starts[d][lo + i]), int(self._starts[d][lo + i + 1])
+
+    def ordinal(self, indexes):
+        """
+        :param indexes: list of 0 based indexes, padded with 0s to the full depth
+        :return: the number of segments before the one at `indexes`
+        """
+        return self._segment(indexes, clamp=False)
+
+    def distance(self, indexes1, indexes2):
+        """
+        :return: the distance, measured in segments, between indexes1 and indexes2.  See :meth:`JaggedArray.distance`
+        """
+        return abs(self.ordinal(indexes1) - self.ordinal(indexes2))
+
+    def indexes(self, ordinal):
+        """
+        :return: the list of 0 based indexes of the segment with `ordinal`, or None if there isn't one
+        """
+        if not 0 <= ordinal < self.segment_count:
+            return None
+        result = [ordinal]
+        for d in range(self.depth - 2, -1, -1):
+            parent = int(np.searchsorted(self._starts[d], ordinal, side="right")) - 1
+            result[0] = ordinal - int(self._starts[d][parent])
+            result.insert(0, parent)
+            ordinal = parent
+        return result
+
+    def next_index(self, starting_points=None):
+        """
+        :param starting_points: list of 0 based indexes
+        :return: the indexes of the first available segment at or after `starting_points`, or None.
+            See :meth:`JaggedArray.next_index`
+        """
+        start = self._segment(starting_points or [], clamp=True)
+        pos = int(np.searchsorted(self._available, start, side="left"))
+        return self.indexes(int(self._available[pos])) if pos < len(self._available) else None
+
+    def prev_index(self, starting_points=None):
+        """
+        :param starting_points: list of 0 based indexes
+        :return: the indexes of the last available segment at or under `starting_points`, or None.
+            See :meth:`JaggedArray.prev_index`
+        """
+        if starting_points:
+            end = self._segment(starting_points[:-1] + [starting_points[-1] + 1], clamp=True)
+        else:
+            end = self.segment_count
+        pos = int(np.searchsorted(self._available, end, side="left")) - 1
+        return self.indexes(int(self._available[pos])) if pos >= 0 else None
+
+    def sub_array_length(self, indexes=None):
+        """
+        :param indexes: list of 0 based indexes
+        :return: The length of the array at `indexes`, 0 for a segment, or None if `indexes` are past the end of an array.
+            See :meth:`JaggedArray.sub_array_length`
+        """
+        lo, hi = 0, self._top_length
+        for d, i in enumerate(indexes or []):
+            if i < 0 or lo + i >= hi:
+                return None
+            if d >= self.depth - 1:
+                return 0
+            lo, hi = int(self._starts[d][lo + i]), int(self._starts[d][lo + i + 1])
+        return hi - lo
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import random
+
+from sefaria.datatype.jagged_array import JaggedIntArray
+from sefaria.datatype.offset_table import OffsetTable
+
+
+def random_counts(rand, depth):
+    if depth == 0:
+        return rand.choice([0, 0, 1, 2])
+    return [random_counts(rand, depth - 1) for _ in range(rand.randint(0, 4))]
+
+
+def all_indexes(counts, depth, past_end=True):
+    """
+    Every address in `counts`, and, if `past_end`, one past the end of each of its arrays
+    """
+    if depth == 0:
+        return [[]]
+    result = []
+    for i, c in enumerate(counts):
+        result += [[i] + rest for rest in all_indexes(c, depth - 1, past_end)]
+    return result + [[len(counts)] + [0] * (depth - 1)] if past_end else result
+
+
+class Test_Offset_Table(object):
+
+    def test_simple(self):
+        counts = [[1, 0, 1], [], [0, 0], [1, 1, 1, 1]]
+        t = OffsetTable(counts, 2)
+        assert len(t) == 9
+        assert t.available_count() == 6
+        assert t.ordinal([3, 2]) == 7
+        assert t.distance([0, 1], [3, 0]) == 4
+        assert t.indexes(7) == [3, 2]
+        assert t.indexes(9) is None
+        assert t.next_index([1]) == [3, 0]
+        assert t.prev_index([2]) == [0, 2]
+        assert t.prev_index([0, 1]) == [0, 0]
+        assert t.next_index([4]) is None
+        assert t.sub_array_length([2]) == 2
+        assert t.sub_array_length([0, 1]) == 0
+        assert t.sub_array_length([4]) is None
+
+    def test_matches_jagged_array(self):
+        rand = random.Random(613)
+        for _ in range(200):
+            depth = rand.randint(1, 4)
+            counts = random_counts(rand, depth)
+            ja = JaggedIntArray(counts)
+            if ja.get_depth() != depth:
+                continue
+            t = OffsetTable(counts, depth)
+            addresses = all_indexes(counts, depth)
+            segments = [a for a in all_indexes(counts, depth, past_end=False) if len(a) == depth]
+            for i in range(t.segment_count):
+                assert t.indexes(i) == segments[i]
+            for a in addresses:
+                assert t.ordinal(a) == len([s for s in segments if s < a])
+            if depth <= 2:
+                # Deeper, JaggedArray.distance() skips an array whose last descendant is empty
+                for a, b in itertools.combinations(all_indexes(counts, depth, past_end=False), 2):
+                    assert t.distance(a[:], b[:]) == ja.distance(a[:], b[:])
+            for a in addresses:
+                for n in range(len(a) + 1):
+                    assert t.next_index(a[:n]) == (ja.next_index(a[:n]) or None)
+                    assert t.sub_array_length(a[:n]) == ja.sub_array_length(a[:n])
+            # Past the end of an array, JaggedArray.prev_index() still limits the array's last element by the next index
+            for a in segments:
+                for n in range(1, len(a) + 1):
+                    for start in (a[:n], a[:n - 1] + [a[n - 1] - 1]):
+                        assert t.prev_index(start) == (ja.prev_index(start[:]) or None)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from sefaria.datatype.title_automaton import TitleAutomaton
+
+
+class Test_Title_Automaton(object):
+
+    def test_all_matches(self):
+        a = TitleAutomaton(["he", "she", "his", "hers"])
+        assert len(a) == 4
+        assert sorted(a.iter_matches("ushers")) == [(1, 4), (2, 4), (2, 6)]
+
+    def test_longest_leftmost(self):
+        a = TitleAutomaton(["Genesis", "Gen", "Rashi on Genesis", "Rashi"])
+        st = "See Rashi on Genesis 1:1 and Gen. 2:3"
+        assert [st[s:e] for s, e in a.find_all(st, ":., <")] == ["Rashi on Genesis", "Gen"]
+
+    def test_delimiters(self):
+        a = TitleAutomaton(["Job"])
+        assert a.find_all("Jobs 3", ":., <") == []
+        assert a.find_all("Job 3", ":., <") == [(0, 3)]
+        assert a.find_all("Job", ":., <") == [(0, 3)]
+
+    def test_hebrew(self):
+        a = TitleAutomaton(["שמות", "דברים"])
+        st = "תלמוד לומר (דברים טז, יח) שמות"
+        assert [st[s:e] for s, e in a.find_all(st, ":., <")] == ["דברים", "שמות"]
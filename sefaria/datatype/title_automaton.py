@@ -0,0 +1,122 @@
+"""
+title_automaton.py: an Aho-Corasick automaton for finding many fixed strings (e.g. every title in the library) in one pass over a text
+
+"""
+
+from array import array
+from collections import deque
+
+
+class TitleAutomaton(object):
+    """
+    Aho-Corasick automaton over a list of strings.
+
+    States are integers, 0 being the root.  Transitions are kept in a single dict keyed on state and character,
+    and the failure and output links in flat arrays, which is far smaller than a dict per state.
+    """
+    _CHAR_BITS = 21  # enough for any unicode code point
+
+    def __init__(self, strings):
+        self._goto = {}
+        self._fail = array('l', [0])
+        self._out_len = array('l', [0])   # length of the string that ends at a state, 0 if none does
+        self._out_link = array('l', [0])  # nearest state down the failure chain at which a string ends, 0 if none
+        self.size = 0
+
+        children = [[]]
+        for s in strings:
+            if not s:
+                continue
+            state = 0
+            for ch in s:
+                key = self._key(state, ch)
+                next_state = self._goto.get(key)
+                if next_state is None:
+                    next_state = len(self._fail)
+                    self._goto[key] = next_state
+                    self._fail.append(0)
+                    self._out_len.append(0)
+                    self._out_link.append(0)
+                    children[state].append((ord(ch), next_state))
+                    children.append([])
+                state = next_state
+            if not self._out_len[state]:
+                self.size += 1
+            self._out_len[state] = len(s)
+
+        self._build_links(children)
+
+    @classmethod
+    def _key(cls, state, ch):
+        return (state << cls._CHAR_BITS) | ord(ch)
+
+    def _build_links(self, children):
+        queue = deque()
+        for _, child in children[0]:
+            queue.append(child)
+        while queue:
+            state = queue.popleft()
+            for o, child in children[state]:
+                queue.append(child)
+                f = self._fail[state]
+                while f and ((f << self._CHAR_BITS) | o) not in self._goto:
+                    f = self._fail[f]
+                f = self._goto.get((f << self._CHAR_BITS) | o, 0)
+                self._fail[child] = f
+                self._out_link[child] = f if self._out_len[f] else self._out_link[f]
+
+    def __len__(self):
+        return self.size
+
+    def iter_matches(self, s):
+        """
+        Yields a (start, end) tuple for every occurrence in `s` of every string in the automaton,
+        overlapping ones included, in order of their end position.
+        """
+        goto = self._goto
+        fail = self._fail
+        out_len = self._out_len
+        out_link = self._out_link
+        bits = self._CHAR_BITS
+        state = 0
+        for i, ch in enumerate(s):
+            o = ord(ch)
+            while state and ((state << bits) | o) not in goto:
+                state = fail[state]
+            state = goto.get((state << bits) | o, 0)
+            t = state if out_len[state] else out_link[state]
+            while t:
+                yield i + 1 - out_len[t], i + 1
+                t = out_link[t]
+
+    def find_all(self, s, delimiters="", at_end=True):
+        """
+        Finds strings in `s` the way a regex alternation of all of them, longest first, would with `finditer`:
+        scanning left to right, take the longest string starting at the earliest position, then continue after it.
+        :param delimiters: If given, a string only counts if it is followed by one of these characters (or by the end of `s`, if `at_end`)
+            A run of these characters following a match is consumed along with it.
+        :return: list of (start, end) tuples of the strings found, not including the delimiters
+        """
+        candidates = []
+        length = len(s)
+        for start, end in self.iter_matches(s):
+            if delimiters:
+                if end == length:
+                    if not at_end:
+                        continue
+                elif s[end] not in delimiters:
+                    continue
+            candidates.append((start, -end))
+        candidates.sort()
+
+        results = []
+        pos = 0
+        for start, neg_end in candidates:
+            if start < pos:
+                continue
+            end = -neg_end
+            results.append((start, end))
+            pos = end
+            while pos < length and s[pos] in delimiters:
+                pos += 1
+        return results
@@ -6,6 +6,9 @@ Exports to the directory specified in SEFARIA_EXPORT_PATH.
 import sys
 import os
 import io
+import time
+import hashlib
+import multiprocessing
 import unicodecsv as csv
 import re
 import json
@@ -13,7 +16,8 @@ from shutil import rmtree
 from random import random
 from pprint import pprint
 from datetime import datetime
-from collections import Counter
+from collections import Counter, defaultdict
+from contextlib import contextmanager, ExitStack
 from copy import deepcopy
 import django
 django.setup()
@@ -24,7 +28,11 @@ from sefaria.utils.talmud import section_to_daf
 from sefaria.system.exceptions import InputError
 from .summaries import CATEGORY_ORDER
 from .local_settings import SEFARIA_EXPORT_PATH
-from sefaria.system.database import db
+from sefaria.system.database import db, reconnect
+try:
+    from .settings import EXPORT_WORKERS
+except ImportError:
+    EXPORT_WORKERS = 1
 
 
 lang_codes = {
@@ -46,6 +54,24 @@ def print_errors():
     for i, error in enumerate(log_error.all_errors):
         sys.stderr.write('{}. {}'.format(i, error))
 
+@contextmanager
+def atomic_open(path, mode="w"):
+    """
+    Opens a temporary file beside `path` for writing, and moves it to `path` once closed without error,
+    so that `path` never holds a partly written file.  Text is written as utf-8.
+    """
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def make_path(doc, format, extension=None):
     """
     Returns the full path and file name for exporting 'doc' in 'format'.
@@ -187,7 +213,7 @@ def make_cltk_full(doc):
 
     cltk_doc["meta"] = '-'.join(best_sec_names)
     cltk_doc["work"] = doc["title"]
-    return json.dumps(cltk_doc, indent=4, encoding='utf-8', ensure_ascii=False)
+    return json.dumps(cltk_doc, indent=4, ensure_ascii=False)
 
 
 def make_cltk_flat(doc):
@@ -248,7 +274,7 @@ def make_cltk_flat(doc):
 
     cltk_doc["meta"] = '-'.join(best_sec_names)
     cltk_doc["work"] = doc["title"]
-    return json.dumps(cltk_doc, indent=4, encoding='utf-8', ensure_ascii=False)
+    return json.dumps(cltk_doc, indent=4, ensure_ascii=False)
 """
 List of export formats, consisting of a name and function.
 The name is used as a top level directory and file suffix, unless there are three elements.
@@ -278,21 +304,23 @@ def clear_exports():
 def write_text_doc_to_disk(doc=None):
     """
     Writes document to disk according to all formats in export_formats
+    :return: list of the paths written
     """
     assert doc is not None
+    paths = []
     for format in export_formats:
         out = format[1](doc)
         if not out:
             print("Skipping %s - no content" % doc["title"])
-            return
+            return paths
         path = make_path(doc, format[0], extension=format[2] if len(format) == 3 else None)
-        if not os.path.exists(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path))
         try:
-            with open(path, "w") as f:
-                f.write(out.encode('utf-8'))
+            with atomic_open(path) as f:
+                f.write(out)
+            paths.append(path)
         except IOError as e:
             log_error('failed to write to disk: {}'.format(str(e)))
+    return paths
 
 def prepare_text_for_export(text):
     """
@@ -314,7 +342,7 @@ def prepare_text_for_export(text):
         return
 
     text["heTitle"] = index.nodes.primary_title("he")
-    text["categories"] = index.categories
+    text["categories"] = index.categories[:]  # make_path() may add to it
 
     text["text"] = text.get("text", None) or text.get("chapter", "")
 
@@ -377,10 +405,11 @@ def export_texts():
             write_text_doc_to_disk(prepped_text)
 
 
-def prepare_merged_text_for_export(title, lang=None):
+def prepare_merged_text_for_export(title, lang=None, text_docs=None):
     """
     Exports a "merged" version of title, including the maximal text we have available
     in a single document.
+    `text_docs` may be given the documents of the versions of title in lang, in priority order, if the caller has them.
     """
 
     assert lang is not None
@@ -391,9 +420,10 @@ def prepare_merged_text_for_export(title, lang=None):
         "versionTitle": "merged",
         "versionSource": "https://www.sefaria.org/%s" % title.replace(" ", "_"),
     }
-    text_docs = db.texts.find({"title": title, "language": lang}).sort([["priority", -1], ["_id", 1]])
+    if text_docs is None:
+        text_docs = list(db.texts.find({"title": title, "language": lang}).sort([["priority", -1], ["_id", 1]]))
 
-    print("%d versions in %s" % (text_docs.count(), lang))
+    print("%d versions in %s" % (len(text_docs), lang))
 
 
     # Exclude copyrighted docs from merging
@@ -458,16 +488,16 @@ def export_schemas():
     for i in library.all_index_records():
         title = i.title.replace(" ", "_")
 
-        with open(path + title + ".json", "w") as f:
-            try:
-                f.write(make_json(i.contents(v2=True)).encode('utf-8'))
+        try:
+            with atomic_open(path + title + ".json") as f:
+                f.write(make_json(i.contents(v2=True)))
 
-            except InputError as e:
-                print("InputError: %s" % e)
-                with open(SEFARIA_EXPORT_PATH + "/errors.log", "a") as error_log:
-                    error_log.write("%s - InputError: %s\n" % (datetime.now(), e))
-            except Exception as e:
-                log_error('schemas error on {}: {}'.format(title, str(e)))
+        except InputError as e:
+            print("InputError: %s" % e)
+            with open(SEFARIA_EXPORT_PATH + "/errors.log", "a") as error_log:
+                error_log.write("%s - InputError: %s\n" % (datetime.now(), e))
+        except Exception as e:
+            log_error('schemas error on {}: {}'.format(title, str(e)))
 
 
 def export_toc():
@@ -475,8 +505,14 @@ def export_toc():
     Exports the TOC to a JSON file.
     """
     toc = library.get_toc()
-    with open(SEFARIA_EXPORT_PATH + "/table_of_contents.json", "w") as f:
-        f.write(make_json(toc).encode('utf-8'))
+    with atomic_open(SEFARIA_EXPORT_PATH + "/table_of_contents.json") as f:
+        f.write(make_json(toc))
+
+
+# A ref that ends in a section address, e.g. "Rashi on Genesis 1:1:2", "Berakhot 2a:3-5".  Refs with the same node title
+# before the address are in the same book.
+section_address_regex = re.compile(r"^(.+) \d+[ab]?([:.]\d+[ab]?)*(-\d+[ab]?([:.]\d+[ab]?)*)?$")
+
 
 def export_links():
     """
@@ -486,57 +522,71 @@ def export_links():
     links_by_book = Counter()
     links_by_book_without_commentary = Counter()
 
-    links = db.links.find().sort([["refs.0", 1]])
     path = SEFARIA_EXPORT_PATH + "/links/"
     if not os.path.exists(os.path.dirname(path)):
         os.makedirs(os.path.dirname(path))
 
+    # node title -> (book, index title, category), so that each node's title is parsed once rather than every ref
+    book_memo = {}
+
+    def book_data(tref):
+        match = section_address_regex.match(tref)
+        if match and match.group(1) in book_memo:
+            return book_memo[match.group(1)]
+        oref = Ref(tref)
+        data = (oref.book, oref.index.title, oref.index.categories[0])
+        if match:
+            book_memo[match.group(1)] = data
+        return data
+
     link_file_number = 0
-    links = db.links.find().sort([["refs.0", 1]])
+    links = db.links.find({}, {"refs": 1, "type": 1, "_id": 0}).sort([["refs.0", 1]])
     new_links_file_size = 300000
-    for i, link in enumerate(links):
-        if i % new_links_file_size == 0:
-            filename = '{}links{}.csv'.format(path, link_file_number)
+    with ExitStack() as open_files:
+        for i, link in enumerate(links):
+            if i % new_links_file_size == 0:
+                open_files.close()
+                csvfile = open_files.enter_context(atomic_open('{}links{}.csv'.format(path, link_file_number), 'wb'))
+                writer = csv.writer(csvfile)
+                writer.writerow([
+                        "Citation 1",
+                        "Citation 2",
+                        "Conection Type",
+                        "Text 1",
+                        "Text 2",
+                        "Category 1",
+                        "Category 2",
+                ])
+                link_file_number += 1
+
             try:
-                csvfile.close()
-            except:
-                pass
-            csvfile = open(filename, 'wb')
-            writer = csv.writer(csvfile)
+                book1, title1, category1 = book_data(link["refs"][0])
+                book2, title2, category2 = book_data(link["refs"][1])
+            except InputError:
+                continue
+
             writer.writerow([
-                    "Citation 1",
-                    "Citation 2",
-                    "Conection Type",
-                    "Text 1",
-                    "Text 2",
-                    "Category 1",
-                    "Category 2",
+                link["refs"][0],
+                link["refs"][1],
+                link["type"],
+                book1,
+                book2,
+                category1,
+                category2,
             ])
-            link_file_number += 1
 
-        try:
-            oref1 = Ref(link["refs"][0])
-            oref2 = Ref(link["refs"][1])
-        except InputError:
-            continue
+            book_link = tuple(sorted([title1, title2]))
+            links_by_book[book_link] += 1
+            if link["type"] not in ("commentary", "Commentary", "targum", "Targum"):
+                links_by_book_without_commentary[book_link] += 1
 
-        writer.writerow([
-            link["refs"][0],
-            link["refs"][1],
-            link["type"],
-            oref1.book,
-            oref2.book,
-            oref1.index.categories[0],
-            oref2.index.categories[0],
-        ])
-
-        book_link = tuple(sorted([oref1.index.title, oref2.index.title]))
-        links_by_book[book_link] += 1
-        if link["type"] not in ("commentary", "Commentary", "targum", "Targum"):
-            links_by_book_without_commentary[book_link] += 1
+    # files left from an earlier export with more links
+    while os.path.exists('{}links{}.csv'.format(path, link_file_number)):
+        os.remove('{}links{}.csv'.format(path, link_file_number))
+        link_file_number += 1
 
     def write_aggregate_file(counter, filename):
-        with open(SEFARIA_EXPORT_PATH + "/links/%s" % filename, 'wb') as csvfile:
+        with atomic_open(SEFARIA_EXPORT_PATH + "/links/%s" % filename, 'wb') as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow([
                 "Text 1",
@@ -569,7 +619,7 @@ def export_tag_graph():
     path = SEFARIA_EXPORT_PATH + "/misc/"
     if not os.path.exists(path):
         os.makedirs(path)
-    with open(path + "tag_graph.csv", 'wb') as csvfile:
+    with atomic_open(path + "tag_graph.csv", 'wb') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow([
             "Tag 1",
@@ -578,8 +628,8 @@ def export_tag_graph():
         ])
         for link in counts.most_common():
             writer.writerow([
-                link[0][0].encode("utf-8"),
-                link[0][1].encode("utf-8"),
+                link[0][0],
+                link[0][1],
                 link[1],
             ])
 
@@ -588,25 +638,191 @@ def make_export_log():
     """
     Exports a file that logs the last export time.
     """
-    with open(SEFARIA_EXPORT_PATH + "/last_export.txt", "w") as f:
+    with atomic_open(SEFARIA_EXPORT_PATH + "/last_export.txt") as f:
         f.write(datetime.now().isoformat())
 
 
-def export_all():
+def export_title(title):
+    """
+    Exports each version of `title` that isn't copyrighted, and its merged text in each language, in all export_formats.
+    Loads the versions once for both.
+    :return: list of the paths written
+    """
+    text_docs = [text for text in db.texts.find({"title": title}) if not text_is_copyright(text)]
+    paths = []
+
+    try:
+        Ref(title)
+        mergeable = True
+    except:
+        mergeable = False
+    if mergeable:
+        for lang in ("he", "en"):
+            # in the order of .sort([["priority", -1], ["_id", 1]]), where a missing priority is lowest
+            lang_docs = sorted((text for text in text_docs if text["language"] == lang),
+                               key=lambda text: (0, -text["priority"], text["_id"]) if isinstance(text.get("priority"), (int, float)) else (1, 0, text["_id"]))
+            prepped_text = prepare_merged_text_for_export(title, lang=lang, text_docs=deepcopy(lang_docs))
+            if prepped_text:
+                paths += write_text_doc_to_disk(prepped_text)
+
+    for text in text_docs:
+        prepped_text = prepare_text_for_export(text)
+        if prepped_text:
+            paths += write_text_doc_to_disk(prepped_text)
+    return paths
+
+
+def _export_title_worker(title):
+    start = time.time()
+    errors = len(log_error.all_errors)
+    try:
+        paths = export_title(title)
+    except Exception as e:
+        log_error('export error on {}: {}'.format(title, str(e)))
+        paths = None
+    return title, paths, time.time() - start, log_error.all_errors[errors:]
+
+
+def _fingerprint(obj):
+    return hashlib.md5(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def text_fingerprints():
+    """
+    Returns a dictionary mapping each title in the texts collection to a hash of its Index and of the metadata of its versions,
+    including when each was last modified.  A title whose hash is unchanged needn't be exported again.
+    """
+    versions = defaultdict(list)
+    for v in db.texts.find({}, {"title": 1, "language": 1, "versionTitle": 1, "versionSource": 1, "license": 1, "priority": 1, "lastModified": 1}):
+        versions[v.get("title")].append([str(v["_id"]), v.get("language"), v.get("versionTitle"), v.get("versionSource"),
+                                         v.get("license"), v.get("priority"), v.get("lastModified")])
+    fingerprints = {}
+    for title, title_versions in versions.items():
+        if not title:
+            log_error('None title in texts')
+            continue
+        try:
+            index_contents = library.get_index(title).contents(v2=True)
+        except Exception:
+            index_contents = None
+        fingerprints[title] = _fingerprint([index_contents, sorted(title_versions, key=str)])
+    return fingerprints
+
+
+def links_fingerprint():
+    """
+    Returns a hash of the number of links, the last one added, and the book and category of every Index, which
+    export_links() writes out.  Links have no modification times, so a link edited in place is not detected.
+    """
+    last = db.links.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    books = sorted([i.title, i.categories] for i in library.all_index_records())
+    return _fingerprint([db.links.estimated_document_count(), last["_id"] if last else None, books])
+
+
+def export_manifest_path():
+    return SEFARIA_EXPORT_PATH + "/export_manifest.json"
+
+
+def load_export_manifest():
+    try:
+        with open(export_manifest_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def export_all(full=False, workers=None):
     """
     Export all texts, merged texts, links, schemas, toc, links & export log.
+
+    Unless `full`, only the texts and links that changed since the last export, as recorded in its manifest, are exported again.
+    Texts are exported by `workers` processes in parallel (default EXPORT_WORKERS), while the rest is exported by this one.
+    Timings are printed and kept in the manifest.
     """
-    clear_exports()
-    export_texts()
-    export_all_merged()
-    export_links()
-    export_schemas()
-    export_toc()
-    export_tag_graph()
+    workers = workers or EXPORT_WORKERS
+    start = time.time()
+    stats = {"started": datetime.now().isoformat(), "seconds": {}}
+    manifest = None if full else load_export_manifest()
+    if manifest is None:
+        clear_exports()
+        manifest = {"titles": {}, "links": None}
+    new_manifest = {"titles": {}, "links": None}
+
+    phase_start = time.time()
+    fingerprints = text_fingerprints()
+    old_titles = manifest["titles"]
+    to_export = []
+    for title, fingerprint in fingerprints.items():
+        old = old_titles.get(title)
+        if old and old["fingerprint"] == fingerprint and all(os.path.exists(path) for path in old["files"]):
+            new_manifest["titles"][title] = old
+        else:
+            to_export.append(title)
+    for title, old in old_titles.items():
+        if title not in fingerprints:
+            _remove_files(old["files"])
+    stats["seconds"]["fingerprints"] = time.time() - phase_start
+    stats["titles_skipped"] = len(new_manifest["titles"])
+    print("Exporting {} texts, {} unchanged".format(len(to_export), stats["titles_skipped"]))
+
+    def record_title(result):
+        title, paths, seconds, errors = result
+        title_times.append((seconds, title))
+        if paths is None:
+            return
+        old_files = set(old_titles.get(title, {}).get("files", []))
+        _remove_files(old_files - set(paths))
+        new_manifest["titles"][title] = {"fingerprint": fingerprints[title], "files": paths}
+
+    def export_rest():
+        for name, func in (("schemas", export_schemas), ("toc", export_toc), ("tag_graph", export_tag_graph)):
+            phase_start = time.time()
+            func()
+            stats["seconds"][name] = time.time() - phase_start
+        phase_start = time.time()
+        links_fingerprint_ = links_fingerprint()
+        if links_fingerprint_ != manifest["links"] or not os.path.exists(SEFARIA_EXPORT_PATH + "/links/links_by_book.csv"):
+            export_links()
+        else:
+            print("Links unchanged")
+        new_manifest["links"] = links_fingerprint_
+        stats["seconds"]["links"] = time.time() - phase_start
+
+    phase_start = time.time()
+    title_times = []
+    if workers > 1 and to_export:
+        with multiprocessing.get_context("fork").Pool(workers, initializer=reconnect) as pool:
+            results = pool.imap_unordered(_export_title_worker, to_export)
+            export_rest()
+            for result in results:
+                log_error.all_errors += result[3]
+                record_title(result)
+    else:
+        for title in to_export:
+            record_title(_export_title_worker(title))
+        export_rest()
+    stats["seconds"]["texts_and_rest"] = time.time() - phase_start
+
+    stats["titles_exported"] = len(to_export)
+    stats["slowest_titles"] = [[title, round(seconds, 2)] for seconds, title in sorted(title_times, reverse=True)[:20]]
+    stats["seconds"]["total"] = time.time() - start
+    stats["seconds"] = {name: round(seconds, 2) for name, seconds in stats["seconds"].items()}
+    new_manifest["stats"] = stats
+    with atomic_open(export_manifest_path()) as f:
+        json.dump(new_manifest, f, indent=2, ensure_ascii=False)
     make_export_log()
+    pprint(stats)
     print_errors()
 
 
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 
 # CSV Version import export format:
 #
@@ -0,0 +1,32 @@
+"""
+gunicorn_preload.py: gunicorn settings for loading the app once, in the master, and forking the workers from it
+
+    gunicorn -c sefaria/gunicorn_preload.py sefaria.wsgi
+
+The library is built (or loaded from LIBRARY_SNAPSHOT_PATH) once, rather than in every worker, and its pages are
+shared copy-on-write by all of them.  Other gunicorn settings can be given on the command line as usual.
+"""
+import gc
+
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Workers must not share the master's database connections.  Django reopens them on demand.
+    from django.db import connections
+    connections.close_all()
+
+    # Move everything loaded so far out of reach of the garbage collector, so that collections in the workers
+    # don't write to the objects' headers and unshare their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # MongoClient is not fork-safe, and the master queried Mongo to load the library.  Each worker opens its own.
+    from sefaria.system.database import reconnect
+    reconnect()
+
+    # The redis connection made on load of reader/views is the master's.  Each worker subscribes with its own.
+    from sefaria.system.multiserver.coordinator import server_coordinator
+    if server_coordinator:
+        server_coordinator.connect()
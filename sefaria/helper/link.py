@@ -3,7 +3,11 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from collections import defaultdict
+from pymongo import InsertOne, UpdateOne, DeleteOne
+
 from sefaria.model import *
+from sefaria.system.database import db
 from sefaria.system.exceptions import DuplicateRecordError, InputError
 import sefaria.tracker as tracker
 try:
@@ -355,80 +359,139 @@ def add_links_from_text(oref, lang, text, text_id, user, **kwargs):
 
     text["text"] may be a list of segments, an individual segment, or None.
 
+    The links found in all of the segments are compared with the links previously generated from this text
+    for those segments, fetched in a single query, and the differences written with a single bulk write.
     The set of no longer supported links (`existingLinks` - `found`) is deleted.
-    If Varnish is used, all linked refs, old and new, are refreshed
+    If Varnish is used, all linked refs, old and new, are refreshed, once per section.
 
     Returns `links` - the list of links added.
     """
-    if not text:
+    if kwargs.get('citing_only') is not None:
+        citing_only = kwargs['citing_only']
+    else:
+        citing_only = True
+
+    found = {}  # Normal ref of each segment scanned -> {normal ref: Ref} of the texts it mentions
+    _find_links_in_text(oref, lang, text, citing_only, found)
+    if not found:
         return []
-    elif isinstance(text, list):
-        subrefs = oref.subrefs(len(text))
-        links   = []
-        for i in range(len(text)):
-            single = add_links_from_text(subrefs[i], lang, text[i], text_id, user, **kwargs)
-            links += single
-        return links
-    elif isinstance(text, str):
-        """
-            Keeps three lists:
-            * existingLinks - The links that existed before the text was rescanned
-            * found - The links found in this scan of the text
-            * links - The new links added in this scan of the text
 
-            The set of no longer supported links (`existingLinks` - `found`) is deleted.
-            The set of all links (`existingLinks` + `Links`) is refreshed in Varnish.
-        """
-        existingLinks = LinkSet({
-            "refs": oref.normal(),
-            "auto": True,
-            "generated_by": "add_links_from_text",
-            "source_text_oid": text_id
-        }).array()  # Added the array here to force population, so that new links don't end up in this set
-
-        found = []  # The normal refs of the links found in this text
-        links = []  # New link objects created by this processes
-
-        if kwargs.get('citing_only') is not None:
-            citing_only = kwargs['citing_only']
-        else:
-            citing_only = True
-
-        refs = library.get_refs_in_string(text, lang, citing_only=citing_only)
-
-        for linked_oref in refs:
+    links = []       # New links, as dicts
+    inserts = []     # New links, as documents to insert
+    updates = []     # Existing non-auto Links to mark as generated from this text
+    deletes = []     # Existing Links generated from this text that it no longer supports
+    invalidated = []  # Refs to refresh in Varnish
+
+    # Every link to any of the scanned segments, for both the diff and the duplicate checks of `Link._pre_save()`
+    existing_links = {}   # frozenset of refs -> Link
+    generated_links = {}  # (segment ref, linked ref) -> Link, for the links previously generated from this text
+    for link in LinkSet({"refs": {"$in": list(found)}}):
+        existing_links[frozenset(link.refs)] = link
+        if link.auto and getattr(link, "generated_by", None) == "add_links_from_text" and getattr(link, "source_text_oid", None) == text_id:
+            base_tref, linked_tref = link.refs if link.refs[0] in found else reversed(link.refs)
+            generated_links[(base_tref, linked_tref)] = link
+
+    for (base_tref, linked_tref), link in generated_links.items():
+        try:
+            invalidated.append(Ref(linked_tref))
+        except InputError:
+            pass
+        if linked_tref not in found[base_tref]:
+            deletes.append(link)
+            existing_links.pop(frozenset(link.refs), None)
+
+    # Other refs of the remaining links to each scanned segment, to check for more precise links
+    linked_trefs = defaultdict(list)
+    for refs in existing_links:
+        for base_tref in refs & set(found):
+            linked_trefs[base_tref] += [r for r in refs if r != base_tref]
+
+    langs_cache = {}
+    for base_tref, linked_orefs in found.items():
+        for linked_tref, linked_oref in linked_orefs.items():
             link = {
                 # Note -- ref of the citing text is in the first position
-                "refs": [oref.normal(), linked_oref.normal()],
+                "refs": [base_tref, linked_tref],
                 "type": "",
                 "auto": True,
                 "generated_by": "add_links_from_text",
                 "source_text_oid": text_id
             }
-            found += [linked_oref.normal()]  # Keep this here, since tracker.add will throw an error if the link exists
+            samelink = existing_links.get(frozenset(link["refs"]))
+            if samelink:
+                if not samelink.auto:
+                    samelink.load_from_dict(link)
+                    updates.append(samelink)
+                continue
+            if _has_more_precise_link(linked_oref, linked_trefs[base_tref]):
+                continue
             try:
-                tracker.add(user, Link, link, **kwargs)
-                links += [link]
-                if USE_VARNISH:
-                    invalidate_ref(linked_oref)
-            except InputError as e:
-                pass
+                inserts.append(Link(link).prepare_bulk_insert(langs_cache))
+            except InputError:
+                continue
+            links += [link]
+            linked_trefs[base_tref].append(linked_tref)  # Links saved one by one would see the ones saved before
+            invalidated.append(linked_oref)
 
-        # Remove existing links that are no longer supported by the text
-        for exLink in existingLinks:
-            for r in exLink.refs:
-                if r == oref.normal():  # current base ref
-                    continue
-                if USE_VARNISH:
-                    try:
-                        invalidate_ref(Ref(r))
-                    except InputError:
-                        pass
-                if r not in found:
-                    tracker.delete(user, Link, exLink._id)
-                break
+    requests = [InsertOne(doc) for doc in inserts]
+    for l in updates:
+        doc = l.prepare_bulk_insert(langs_cache)
+        del doc["_id"]
+        requests.append(UpdateOne({"_id": l._id}, {"$set": doc}))
+    requests += [DeleteOne({"_id": l._id}) for l in deletes]
+    if requests:
+        db.links.bulk_write(requests, ordered=False)
+        log_many(user, Link, [(None, Link(doc).contents(**kwargs)) for doc in inserts] + [(l.contents(**kwargs), None) for l in deletes], **kwargs)
+
+    if USE_VARNISH:
+        invalidate_sections(invalidated)
 
-        return links
+    return links
+
+
+def _find_links_in_text(oref, lang, text, citing_only, found):
+    """
+    Adds to `found` the refs mentioned in each segment of `text`, keyed by the normal ref of the segment.
+    """
+    if not text:
+        return
+    elif isinstance(text, list):
+        subrefs = oref.subrefs(len(text))
+        for i in range(len(text)):
+            _find_links_in_text(subrefs[i], lang, text[i], citing_only, found)
+    elif isinstance(text, str):
+        linked = found.setdefault(oref.normal(), {})
+        for linked_oref in library.get_refs_in_string(text, lang, citing_only=citing_only):
+            linked.setdefault(linked_oref.normal(), linked_oref)
+
+
+def _has_more_precise_link(linked_oref, linked_trefs):
+    """
+    Is one of `linked_trefs` within `linked_oref`?  Mirrors the check for a more precise link in `Link._pre_save()`.
+    :param linked_trefs: the other refs of the links to the same segment, both existing and added earlier in the batch
+    """
+    for tref in linked_trefs:
+        try:
+            if linked_oref.contains(Ref(tref)):
+                return True
+        except InputError:
+            continue
+    return False
+
+
+def invalidate_sections(orefs):
+    """
+    Refreshes each of `orefs` in Varnish, once per section.
+    """
+    sections = {}
+    for oref in orefs:
+        # A range across sections is refreshed in each of them, as `section_ref()` would only give the first
+        for span in oref.split_spanning_ref():
+            if getattr(span.index_node, "depth", False) and len(span.sections) >= span.index_node.depth - 1:
+                span = span.section_ref()
+            sections.setdefault(span.normal(), span)
+    for oref in sections.values():
+        invalidate_ref(oref)
 
 
 def delete_links_from_text(title, user):
@@ -436,18 +499,20 @@ def delete_links_from_text(title, user):
     Deletes all of the citation generated links from text 'title'
     """
     regex    = Ref(title).regex()
-    links    = LinkSet({"refs.0": {"$regex": regex}, "generated_by": "add_links_from_text"})
-    for link in links:
-        if USE_VARNISH:
-            try:
-                invalidate_ref(Ref(link.refs[0]))
-            except InputError:
-                pass
-            try:
-                invalidate_ref(Ref(link.refs[1]))
-            except InputError:
-                pass
-        tracker.delete(user, Link, link._id)
+    links    = LinkSet({"refs.0": {"$regex": regex}, "generated_by": "add_links_from_text"}).array()
+    if not links:
+        return
+    if USE_VARNISH:
+        invalidated = []
+        for link in links:
+            for tref in link.refs:
+                try:
+                    invalidated.append(Ref(tref))
+                except InputError:
+                    pass
+        invalidate_sections(invalidated)
+    db.links.delete_many({"_id": {"$in": [link._id for link in links]}})
+    log_many(user, Link, [(link.contents(), None) for link in links])
 
 
 def rebuild_links_from_text(title, user):
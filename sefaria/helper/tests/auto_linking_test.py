@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from bson.objectid import ObjectId
+
 from sefaria.model import *
-from sefaria.helper.link import rebuild_links_for_title, AutoLinkerFactory
+from sefaria.helper.link import rebuild_links_for_title, AutoLinkerFactory, add_links_from_text
 import sefaria.tracker as tracker
 from sefaria.helper.schema import convert_simple_index_to_complex, insert_first_child
 
@@ -489,3 +491,43 @@ class Test_AutoLinker(object):
         link_count = LinkSet({"refs": {"$regex": regex}, "auto": True, "generated_by": "add_commentary_links"}).count()
         assert link_count == desired_link_count
 
+    def test_add_links_from_text(self):
+        oref = Ref("Many to One on Genesis 1:1")
+        text_id = ObjectId()
+        query = {"generated_by": "add_links_from_text", "source_text_oid": text_id}
+        try:
+            # Genesis 1 is skipped, since 'Many to One on Genesis 1:1:1' is already linked to Genesis 1:1
+            links = add_links_from_text(oref, "en", ["See Exodus 2:3 and Genesis 1", "As in Numbers 1:1"], text_id, 1)
+            assert sorted(l["refs"][1] for l in links) == ["Exodus 2:3", "Numbers 1:1"]
+            assert LinkSet(query).count() == 2
+
+            assert add_links_from_text(oref, "en", ["See Exodus 2:3 and Genesis 1", "As in Numbers 1:1"], text_id, 1) == []
+            assert LinkSet(query).count() == 2
+
+            links = add_links_from_text(oref, "en", ["See Exodus 2:3", "As in Deuteronomy 3:4"], text_id, 1)
+            assert [l["refs"] for l in links] == [["Many to One on Genesis 1:1:2", "Deuteronomy 3:4"]]
+            assert {tuple(l.refs) for l in LinkSet(query)} == {
+                ("Many to One on Genesis 1:1:1", "Exodus 2:3"),
+                ("Many to One on Genesis 1:1:2", "Deuteronomy 3:4"),
+            }
+        finally:
+            LinkSet(query).delete()
+
+    def test_add_links_from_text_precise_link_in_batch(self):
+        oref = Ref("Many to One on Genesis 1:1")
+        text_id = ObjectId()
+        query = {"generated_by": "add_links_from_text", "source_text_oid": text_id}
+        try:
+            # Exodus 3 is skipped, since a link to Exodus 3:4 is added before it
+            links = add_links_from_text(oref, "en", ["See Exodus 3:4 and Exodus 3"], text_id, 1)
+            assert [l["refs"][1] for l in links] == ["Exodus 3:4"]
+            assert LinkSet(query).count() == 1
+        finally:
+            LinkSet(query).delete()
+
+    def test_invalidate_sections(self, monkeypatch):
+        import sefaria.helper.link as link_helper
+        invalidated = []
+        monkeypatch.setattr(link_helper, "invalidate_ref", lambda oref: invalidated.append(oref.normal()), raising=False)
+        link_helper.invalidate_sections([Ref("Exodus 2:3-4:5"), Ref("Exodus 2:7"), Ref("Genesis 1")])
+        assert invalidated == ["Exodus 2", "Exodus 3", "Exodus 4", "Genesis 1"]
@@ -1,5 +1,6 @@
 # encoding=utf-8
 import re
+from datetime import datetime
 
 import sefaria.summaries as summaries
 from sefaria.model import *
@@ -90,6 +91,7 @@ def resize_text(title, new_structure, upsize_in_place=False):
             resized = JaggedTextArray(text["chapter"]).resize(delta).array()
 
         text["chapter"] = resized
+        text["lastModified"] = datetime.now().isoformat()
         db.texts.save(text)
 
     # TODO Rewrite any existing Links
@@ -7,8 +7,12 @@ from datetime import datetime
 from diff_match_patch import diff_match_patch
 from bson.code import Code
 
+from pymongo import UpdateOne
+
 from sefaria.model import *
+from sefaria.model.history import checkpoint_due, complete_text_log, fill_pending_text_logs
 from sefaria.system.database import db
+from sefaria.system.exceptions import InputError
 
 dmp = diff_match_patch()
 
@@ -20,11 +24,16 @@ def get_activity(query={}, page_size=100, page=1, filter_type=None, initial_skip
     """
     query.update(filter_type_to_query(filter_type))
     skip = initial_skip + (page - 1) * page_size
-    projection = { "revert_patch": 0 }
+    projection = { "revert_patch": 0, "checkpoint": 0 }
     activity = list(db.history.find(query, projection).sort([["date", -1]]).skip(skip).limit(page_size))
 
     for i in range(len(activity)):
         a = activity[i]
+        if "new_text" in a:
+            # Pending: its diff is not filled in yet
+            complete_text_log(a)
+            for k in ("revert_patch", "old_text", "new_text"):
+                del a[k]
         if a["rev_type"].endswith("text") or a["rev_type"] == "review":
             try:
                 a["history_url"] = "/activity/%s/%s/%s" % (Ref(a["ref"]).url(), a["language"], a["version"].replace(" ", "_"))
@@ -164,18 +173,100 @@ def get_maximal_collapsed_activity(query={}, page_size=100, page=1, filter_type=
 def text_at_revision(tref, version, lang, revision):
     """
     Returns the state of a text (identified by ref/version/lang) at revision number 'revision'
+
+    Starts from the nearest checkpoint at or after the revision, or from the current text if there is none,
+    and applies the revert patches of the later changes, latest first.
     """
-    changes = db.history.find({"ref": tref, "version": version, "language": lang}).sort([['revision', -1]])
-    current = TextChunk(Ref(tref), lang, version)
-    text = str(current.text)  # needed?
+    query = {"ref": tref, "version": version, "language": lang}
+    target = db.history.find_one(dict(query, revision=revision), {"date": 1})
+    checkpoint = None
+    if target:
+        checkpoint = db.history.find_one(dict(query, checkpoint={"$exists": True}, date={"$gte": target["date"]}),
+                                         {"checkpoint": 1, "date": 1}, sort=[("date", 1)])
+    if checkpoint:
+        text = checkpoint["checkpoint"]
+        query["date"] = {"$gt": target["date"], "$lte": checkpoint["date"]}
+    else:
+        current = TextChunk(Ref(tref), lang, version)
+        text = str(current.text)  # needed?
+        if target:
+            query["date"] = {"$gt": target["date"]}
 
-    for r in changes:
-        if r["revision"] == revision: break
-        patch = dmp.patch_fromText(r["revert_patch"])
+    for r in db.history.find(query, {"revert_patch": 1, "old_text": 1, "new_text": 1}).sort([["date", -1]]):
+        patch = dmp.patch_fromText(complete_text_log(r)["revert_patch"])
         text = dmp.patch_apply(patch, text)[0]
 
     return text
 
+
+def backfill_text_checkpoints(tref, version, lang):
+    """
+    Stores checkpoints in the existing history of a text (identified by ref/version/lang), where `log_text` would have.
+    :return: The number of checkpoints stored
+    """
+    fill_pending_text_logs({"ref": tref, "version": version, "language": lang})
+    query = {"ref": tref, "version": version, "language": lang, "revert_patch": {"$exists": True}}
+    changes = list(db.history.find(query, {"revert_patch": 1}).sort([["date", 1]]))
+    current = TextChunk(Ref(tref), lang, version).text
+    if not changes or not isinstance(current, str):
+        return 0
+
+    # Choose the changes to checkpoint from the oldest, as `log_text` would.  The size of each state is taken as that of the current text.
+    text_bytes = len(current.encode("utf-8"))
+    distances = []
+    revisions, patch_bytes = 0, 0
+    for change in changes:
+        revisions += 1
+        patch_bytes += len(change["revert_patch"].encode("utf-8"))
+        if checkpoint_due(revisions, patch_bytes, text_bytes):
+            revisions, patch_bytes = 0, 0
+            distances.append(None)
+        else:
+            distances.append([revisions, patch_bytes])
+
+    # Then reconstruct the states from the latest
+    updates = []
+    text = current
+    for change, distance in reversed(list(zip(changes, distances))):
+        if distance is None:
+            updates.append(UpdateOne({"_id": change["_id"]}, {"$set": {"checkpoint": text, "checkpoint_distance": [0, 0]}}))
+        else:
+            updates.append(UpdateOne({"_id": change["_id"]}, {"$set": {"checkpoint_distance": distance}}))
+        text = dmp.patch_apply(dmp.patch_fromText(change["revert_patch"]), text)[0]
+    db.history.bulk_write(updates, ordered=False)
+    return distances.count(None)
+
+
+def backfill_checkpoints(verbose=False):
+    """
+    Stores checkpoints in the existing history of every text that has enough of it.
+    """
+    from sefaria.model.history import HISTORY_CHECKPOINT_INTERVAL, HISTORY_CHECKPOINT_PATCH_BYTES
+    if not HISTORY_CHECKPOINT_INTERVAL:
+        return
+    texts = db.history.aggregate([
+        {"$match": {"revert_patch": {"$type": "string"}}},
+        {"$group": {
+            "_id": {"ref": "$ref", "version": "$version", "language": "$language"},
+            "count": {"$sum": 1},
+            "bytes": {"$sum": {"$strLenBytes": "$revert_patch"}},
+        }},
+        {"$match": {"$or": [{"count": {"$gte": HISTORY_CHECKPOINT_INTERVAL}}, {"bytes": {"$gte": HISTORY_CHECKPOINT_PATCH_BYTES}}]}},
+    ], allowDiskUse=True)
+    total = 0
+    for t in texts:
+        try:
+            n = backfill_text_checkpoints(t["_id"]["ref"], t["_id"]["version"], t["_id"]["language"])
+        except InputError as e:
+            if verbose:
+                print("Skipping {}: {}".format(t["_id"], e))
+            continue
+        total += n
+        if verbose and n:
+            print("{} checkpoints for {} / {} / {}".format(n, t["_id"]["ref"], t["_id"]["version"], t["_id"]["language"]))
+    if verbose:
+        print("{} checkpoints stored".format(total))
+
 '''
 def next_revision_num():
     """
@@ -290,26 +381,28 @@ def make_leaderboard(condition):
 
     This fucntion queries and calculates for all currently matching history.
     """
-
     reducer = Code("""
                     function(obj, prev) {
 
+                        // Records whose patch is not filled in yet are measured by their text
+                        var patchLength = obj.revert_patch ? obj.revert_patch.length : (obj.old_text || "").length + (obj.new_text || "").length;
+
                         // Total Points
                         switch(obj.rev_type) {
                             case "add text":
                                 if (obj.language !== 'he' && obj.version === "Sefaria Community Translation") {
-                                    prev.count += Math.max(obj.revert_patch.length / 10, 10);
+                                    prev.count += Math.max(patchLength / 10, 10);
                                     prev.translateCount += 1
                                 } else if(obj.language !== 'he') {
-                                    prev.count += Math.max(obj.revert_patch.length / 400, 2);
+                                    prev.count += Math.max(patchLength / 400, 2);
                                     prev.addCount += 1
                                 } else {
-                                    prev.count += Math.max(obj.revert_patch.length / 800, 1);
+                                    prev.count += Math.max(patchLength / 800, 1);
                                     prev.addCount += 1
                                 }
                                 break;
                             case "edit text":
-                                prev.count += Math.max(obj.revert_patch.length / 1200, 1);
+                                prev.count += Math.max(patchLength / 1200, 1);
                                 prev.editCount += 1
                                 break;
                             case "revert text":
@@ -129,15 +129,18 @@ SEARCH_INDEX_NAME = 'sefaria'
 SEARCH_INDEX_NAME_TEXT = 'text'  # name of the ElasticSearch index to use
 SEARCH_INDEX_NAME_SHEET = 'sheet'
 SEARCH_INDEX_NAME_MERGED = 'merged'
+SEARCH_INDEX_WORKERS = 1  # Number of processes indexing texts in parallel during a full reindex
 
 # Node Server
 USE_NODE = False
 NODE_HOST = "http://localhost:4040"
 NODE_TIMEOUT = 10
+NODE_POOL_MAXSIZE = 10  # keep-alive connections to Node kept open by each Django process
 # NODE_TIMEOUT_MONITOR = relative_to_abs_path("../log/forever/timeouts")
 
 SEFARIA_DATA_PATH = '/path/to/your/Sefaria-Data' # used for Data
 SEFARIA_EXPORT_PATH = '/path/to/your/Sefaria-Data/export' # used for exporting texts
+EXPORT_WORKERS = 1  # Number of processes exporting texts in parallel in export_all
 
 # Map domain to an interface language that the domain should be pinned to.
 # Leave as {} to prevent language pinning, in which case one domain can serve either Hebrew or English
@@ -169,12 +172,74 @@ VARNISH_ADM_ADDR = "localhost:6082" # And this one doesn't
 VARNISH_HOST = "localhost"
 VARNISH_FRNT_PORT = 8040
 VARNISH_SECRET = "/etc/varnish/secret"
+# Send purges and bans from a background thread, merged and in batches.  False sends them as they are made.
+VARNISH_ASYNC_INVALIDATION = True
+# Once bans of this many sections of one book are waiting to be sent, ban the whole book instead.
+VARNISH_BOOK_BAN_THRESHOLD = 20
 # Use ESI for user box in header.
 USE_VARNISH_ESI = False
 
 # Prevent modification of Index records
 DISABLE_INDEX_SAVE = False
 
+# Look up links for a Ref with range queries on `refIntervals`, rather than regexes on `expandedRefs`.
+# Requires that scripts/set_link_ref_intervals.py has been run.
+USE_LINK_INTERVALS = False
+# Look up sheets for a Ref with range queries on `includedRefIntervals`, rather than regexes on `includedRefs`.
+# Requires that scripts/set_sheet_ref_intervals.py has been run.
+USE_SHEET_INTERVALS = False
+
+# Bounds on the in-process Ref cache.  None for no limit.  Policy is "lru" or "slru" (segmented LRU)
+REF_CACHE_MAX_ENTRIES = None
+REF_CACHE_MAX_BYTES = None
+REF_CACHE_POLICY = "lru"
+
+# Number of TextChunk texts to keep in each process.  0 turns the cache off.
+# Other processes learn of Version changes through the multiserver coordinator, so with more than one process, set MULTISERVER_ENABLED.
+TEXT_CHUNK_CACHE_MAX_ENTRIES = 0
+
+# Number of Indexes whose segment offset tables, used to number and navigate segments, are kept in each process.
+# Other processes learn of VersionState refreshes through the multiserver coordinator, so with more than one process, set MULTISERVER_ENABLED.
+OFFSET_TABLE_CACHE_MAX_ENTRIES = 5000
+
+# Processes used by refresh_all_states() to count texts, and the seconds after which each gives up on an Index.
+VSTATE_REFRESH_WORKERS = 1
+VSTATE_REFRESH_TIMEOUT = 600
+
+# Read multi-version texts from the stored merged views in `merged_texts`, and keep those up to date on Version save.
+# Requires that scripts/build_merged_versions.py has been run.
+USE_MERGED_VERSIONS = False
+
+# File to save the library's title maps, TOC and auto completers to on first boot, and load them from after, while the texts are unchanged.
+# Each process saves it if it is missing or out of date, so use a path on local disk.  None turns it off.
+LIBRARY_SNAPSHOT_PATH = None
+
+# Most bulk version downloads (/download/bulk/versions/) to stream at once in each process.  Others are refused.
+BULK_DOWNLOAD_MAX_CONCURRENT = 2
+# Directory on local disk to keep the files made for bulk downloads in, per version and format, until the version changes.
+# None to make them for every download.
+BULK_DOWNLOAD_CACHE_DIR = None
+
+# Hold all dictionary word forms in memory in each process, rather than querying them for each lookup.
+# Takes memory in proportion to the word_form collection.  Word forms added later are seen after a restart.
+LEXICON_WORD_FORMS_IN_MEMORY = False
+
+# Linker hits are merged per page and written every this many seconds.  0 writes each hit as it comes.
+WEBPAGE_HIT_FLUSH_INTERVAL = 30
+# Most pages to hold hits for between writes.  Hits on other pages are dropped while a write is pending.
+WEBPAGE_HIT_BUFFER_MAX_ENTRIES = 10000
+
+# Store the full text in the history of a change every this many changes, or this many bytes of revert patches, to a text,
+# so that old revisions can be rebuilt from there.  0 turns checkpoints off.  For existing history, run scripts/backfill_history_checkpoints.py
+HISTORY_CHECKPOINT_INTERVAL = 50
+HISTORY_CHECKPOINT_PATCH_BYTES = 50000
+# Skip checkpoints larger than this multiple of the patches since the last one.  Bounds checkpoint storage to this fraction of patch storage.
+HISTORY_CHECKPOINT_MAX_OVERHEAD = 1.0
+# Fill in the diffs of text edits in a background thread rather than in the request.  Their history records are always written in the request.
+HISTORY_ASYNC_DIFFS = True
+# Most text edits to hold before the process making them waits for their diffs to be filled in.
+HISTORY_MAX_PENDING_CHANGES = 1000
+
 # Caching with Cloudflare
 CLOUDFLARE_ZONE = ""
 CLOUDFLARE_EMAIL = ""
@@ -15,10 +15,10 @@ from . import abstract
 from . import history, schema, text, link, note, layer, notification, queue, lock, following, user_profile, version_state, \
     translation_request, lexicon, place, person, timeperiod, garden, group
 
-from .history import History, HistorySet, log_add, log_delete, log_update, log_text
+from .history import History, HistorySet, log_add, log_delete, log_update, log_many, log_text
 from .schema import deserialize_tree, Term, TermSet, TermScheme, TermSchemeSet, TitledTreeNode, SchemaNode, \
     ArrayMapNode, JaggedArrayNode, NumberedTitledTreeNode
-from .text import library, Index, IndexSet, Version, VersionSet, TextChunk, TextFamily, Ref, merge_texts
+from .text import library, Index, IndexSet, Version, VersionSet, TextChunk, TextChunkBatch, TextFamily, Ref, merge_texts
 from .link import Link, LinkSet, get_link_counts, get_book_link_collection, get_book_category_linkset
 from .note import Note, NoteSet
 from .layer import Layer, LayerSet
@@ -43,8 +43,9 @@ from .garden import Garden, GardenStop, GardenStopRelation, GardenSet, GardenSto
 from .category import Category, CategorySet
 from .passage import Passage, PassageSet
 from .ref_data import RefData, RefDataSet
+from .merged_version import MergedVersion, MergedVersionSet
 from .webpage import WebPage, WebPageSet
 
 from . import dependencies
 
-library._build_index_maps()
+library.init_index_maps()
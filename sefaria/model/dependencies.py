@@ -2,7 +2,7 @@
 dependencies.py -- list cross model dependencies and subscribe listeners to changes.
 """
 
-from . import abstract, link, note, history, schema, text, layer, version_state, translation_request, timeperiod, person, garden, notification, story, group, library, category, ref_data, user_profile
+from . import abstract, link, note, history, schema, text, merged_version, layer, version_state, translation_request, timeperiod, person, garden, notification, story, group, library, category, ref_data, user_profile
 
 from .abstract import subscribe, cascade, cascade_to_list, cascade_delete, cascade_delete_to_list
 import sefaria.system.cache as scache
@@ -24,6 +24,8 @@ subscribe(text.process_index_title_change_in_dependant_records,         text.Ind
 subscribe(text.process_index_title_change_in_sheets,                    text.Index, "attributeChange", "title")
 subscribe(cascade(notification.GlobalNotificationSet, "content.index"), text.Index, "attributeChange", "title")
 subscribe(ref_data.process_index_title_change_in_ref_data,              text.Index, "attributeChange", "title")
+subscribe(text.process_index_change_in_text_chunk_cache,                text.Index, "attributeChange", "title")
+subscribe(cascade(merged_version.MergedVersionSet, "title"),            text.Index, "attributeChange", "title")
 subscribe(user_profile.process_index_title_change_in_user_history,      text.Index, "attributeChange", "title")
 
 # Taken care of on save
@@ -40,6 +42,8 @@ subscribe(translation_request.process_index_delete_in_translation_requests, text
 subscribe(text.process_index_delete_in_toc,                             text.Index, "delete")
 subscribe(cascade_delete(notification.GlobalNotificationSet, "content.index", "title"),   text.Index, "delete")
 subscribe(ref_data.process_index_delete_in_ref_data,                    text.Index, "delete")
+subscribe(text.process_index_change_in_text_chunk_cache,                text.Index, "delete")
+subscribe(merged_version.process_index_delete_in_merged_versions,       text.Index, "delete")
 
 
 # Process in ES
@@ -58,6 +62,13 @@ def process_version_title_change_in_search(ver, **kwargs):
             # TextIndexer.index_ref(search_index_name_merged, ref, None, ver.language, True)
 
 
+# Version Save / Delete
+# The merged view is rewritten before the text chunk cache is cleared, so that no read in between caches the old view
+subscribe(merged_version.process_version_save_in_merged_versions,       text.Version, "save")
+subscribe(merged_version.process_version_change_in_merged_versions,     text.Version, "delete")
+subscribe(text.process_version_change_in_text_chunk_cache,              text.Version, "save")
+subscribe(text.process_version_change_in_text_chunk_cache,              text.Version, "delete")
+
 # Version Title Change
 subscribe(history.process_version_title_change_in_history,              text.Version, "attributeChange", "versionTitle")
 subscribe(process_version_title_change_in_search,                       text.Version, "attributeChange", "versionTitle")
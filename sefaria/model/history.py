@@ -19,6 +19,10 @@ Writes to MongoDB Collection: history
 """
 
 import regex as re
+import os
+import atexit
+import threading
+from collections import deque
 from datetime import datetime
 from diff_match_patch import diff_match_patch
 dmp = diff_match_patch()
@@ -26,46 +30,244 @@ dmp = diff_match_patch()
 from . import abstract as abst
 from sefaria.system.database import db
 
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    from sefaria.settings import HISTORY_CHECKPOINT_INTERVAL, HISTORY_CHECKPOINT_PATCH_BYTES, HISTORY_CHECKPOINT_MAX_OVERHEAD
+except ImportError:
+    HISTORY_CHECKPOINT_INTERVAL = 50
+    HISTORY_CHECKPOINT_PATCH_BYTES = 50000
+    HISTORY_CHECKPOINT_MAX_OVERHEAD = 1.0
+
+try:
+    from sefaria.settings import HISTORY_ASYNC_DIFFS, HISTORY_MAX_PENDING_CHANGES
+except ImportError:
+    HISTORY_ASYNC_DIFFS = True
+    HISTORY_MAX_PENDING_CHANGES = 1000
+
 
 def log_text(user, action, oref, lang, vtitle, old_text, new_text, **kwargs):
+    """
+    Records the change of a text from `old_text` to `new_text` in history, with a record for each segment that changed.
+    The records are written here, with the old and new text of their segment.  Their diffs, revert patches and
+    checkpoints are filled in by `text_history_queue`.  Until then, `complete_text_log()` computes them on demand.
+    """
+    changes = _changed_segments(old_text, new_text)
+    if changes:
+        logs = _text_log_records(user, action, oref, lang, vtitle, changes, datetime.now(), kwargs)
+        ids = db.history.insert_many(logs).inserted_ids
+        text_history_queue.add(ids)
+
 
+def _changed_segments(old_text, new_text, path=()):
+    """
+    :return: list of (path, old segment, new segment) for each segment that differs between `old_text` and `new_text`,
+        latest first.  `path` is the tuple of 1-based indexes of the segment within the text.
+    """
     if isinstance(new_text, list):
         if not isinstance(old_text, list):  # is this necessary? the TextChunk should handle it.
             old_text = [old_text]
-        maxlength = max(len(old_text), len(new_text))
-        for i in reversed(list(range(maxlength))):
-            subref = oref.subref(i + 1)
+        changes = []
+        for i in reversed(list(range(max(len(old_text), len(new_text))))):
             subold = old_text[i] if i < len(old_text) else [] if isinstance(new_text[i], list) else ""
             subnew = new_text[i] if i < len(new_text) else [] if isinstance(old_text[i], list) else ""
-            log_text(user, action, subref, lang, vtitle, subold, subnew, **kwargs)
-        return
+            changes += _changed_segments(subold, subnew, path + (i + 1,))
+        return changes
 
     if old_text == new_text:
-        return
+        return []
+    return [(path, old_text, new_text)]
 
-    # create a patch that turns the new version back into the old
-    backwards_diff = dmp.diff_main(new_text, old_text)
-    patch = dmp.patch_toText(dmp.patch_make(backwards_diff))
-    # get html displaying edits in this change.
-    forwards_diff = dmp.diff_main(old_text, new_text)
-    dmp.diff_cleanupSemantic(forwards_diff)
-    diff_html = dmp.diff_prettyHtml(forwards_diff)
 
-    log = {
-        "ref": oref.normal(),
+def _text_log_records(user, action, oref, lang, vtitle, changes, date, kwargs):
+    """
+    :param changes: list of changed segments, as returned by `_changed_segments()`
+    :return: list of the history records of `changes`, pending: with the old and new text of the segment,
+        but without their diffs.  See `fill_text_log()`
+    """
+    return [{
+        "ref": (oref.subref(list(path)) if path else oref).normal(),
         "version": vtitle,
         "language": lang,
-        "diff_html": diff_html,
-        "revert_patch": patch,
+        "old_text": old_text,
+        "new_text": new_text,
         "user": user,
-        "date": datetime.now(),
+        "date": date,
         #"revision": next_revision_num(),
         "message": kwargs.get("message", ""), # is this used?
         "rev_type": "{} text".format(action),
         "method": kwargs.get("method", "Site")
-    }
+    } for path, old_text, new_text in changes]
+
+
+def text_log_diffs(old_text, new_text):
+    """
+    :return: tuple of the html displaying the edits from `old_text` to `new_text`,
+        and the patch that turns `new_text` back into `old_text`
+    """
+    # create a patch that turns the new version back into the old
+    backwards_diff = dmp.diff_main(new_text, old_text)
+    patch = dmp.patch_toText(dmp.patch_make(backwards_diff))
+    # get html displaying edits in this change.
+    forwards_diff = dmp.diff_main(old_text, new_text)
+    dmp.diff_cleanupSemantic(forwards_diff)
+    return dmp.diff_prettyHtml(forwards_diff), patch
+
 
-    History(log).save()
+def complete_text_log(log):
+    """
+    Sets `diff_html` and `revert_patch` in `log`, a text history record read from the db, if it is still pending.
+    Nothing is written.
+    :return: `log`
+    """
+    if "new_text" in log and "revert_patch" not in log:
+        log["diff_html"], log["revert_patch"] = text_log_diffs(log["old_text"], log["new_text"])
+    return log
+
+
+def fill_text_log(log):
+    """
+    Writes the diff, revert patch and checkpoint of `log`, a pending text history record read from the db,
+    in place of its old and new text.
+    """
+    complete_text_log(log)
+    _set_checkpoint(log, log["new_text"])
+    fields = {k: log[k] for k in ("diff_html", "revert_patch", "checkpoint", "checkpoint_distance") if k in log}
+    db.history.update_one({"_id": log["_id"], "new_text": {"$exists": True}},
+                          {"$set": fields, "$unset": {"old_text": "", "new_text": ""}})
+
+
+def fill_pending_text_logs(query=None):
+    """
+    Fills in the pending text history records matching `query`, oldest first, e.g. those a process left pending
+    when it was killed.
+    :return: the number of records filled
+    """
+    query = dict(query or {}, new_text={"$exists": True})
+    count = 0
+    for log in db.history.find(query).sort([("date", 1), ("_id", 1)]):
+        fill_text_log(log)
+        count += 1
+    return count
+
+
+class TextHistoryQueue(object):
+    """
+    Fills in the diffs, revert patches and checkpoints of the text history records written by `log_text()`,
+    one change after another, from a background thread.  Readers that need a diff or patch of a record still
+    pending compute it with `complete_text_log()`, so nothing needs to wait for this queue.
+
+    Once `max_pending` changes are waiting, the caller adding one fills them itself.
+    When not `asynchronous`, every change is filled as it is added.  What is waiting is filled at exit.
+    Anything left pending by a killed process is filled by `fill_pending_text_logs()`.
+    """
+    def __init__(self, asynchronous=True, max_pending=1000):
+        self.asynchronous = asynchronous
+        self.max_pending = max_pending
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._lock = threading.Condition()
+        self._writing = threading.Lock()  # Held while a change is taken and filled, so that changes are filled in order
+        self._pending = deque()
+        self._thread = None
+        self._pid = os.getpid()
+
+        self.added = 0     # Number of changes added
+        self.written = 0   # Number of history records filled
+        self.failed = 0    # Number of changes that failed to be filled
+
+    def add(self, ids):
+        """
+        :param ids: The ids of the pending history records of one change
+        """
+        if self._pid != os.getpid():
+            # Forked.  What is waiting will be filled by the parent.
+            self._reset()
+        with self._lock:
+            self.added += 1
+            self._pending.append(ids)
+            full = len(self._pending) >= self.max_pending
+            self._lock.notify()
+        if not self.asynchronous or full:
+            self.flush()
+        elif self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="text-history")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def flush(self):
+        """
+        Fills all the changes waiting in the calling thread, after the change the background thread is filling, if any.
+        """
+        with self._writing:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return
+                    ids = self._pending.popleft()
+                try:
+                    for log in db.history.find({"_id": {"$in": ids}, "new_text": {"$exists": True}}).sort([("_id", 1)]):
+                        fill_text_log(log)
+                        with self._lock:
+                            self.written += 1
+                except Exception:
+                    with self._lock:
+                        self.failed += 1
+                    logger.exception("Failed to fill the history records {}".format(ids))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "added": self.added,
+                "written": self.written,
+                "failed": self.failed,
+            }
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._lock.wait()
+            self.flush()
+
+
+text_history_queue = TextHistoryQueue(HISTORY_ASYNC_DIFFS, HISTORY_MAX_PENDING_CHANGES)
+
+
+def checkpoint_due(revisions, patch_bytes, text_bytes):
+    """
+    Is a checkpoint of a text of `text_bytes` due, `revisions` changes and `patch_bytes` of revert patches after the last one?
+    A checkpoint is never larger than HISTORY_CHECKPOINT_MAX_OVERHEAD times the patches since the last one,
+    which bounds the storage of checkpoints to that fraction of the storage of patches.
+    """
+    if not HISTORY_CHECKPOINT_INTERVAL or text_bytes > HISTORY_CHECKPOINT_MAX_OVERHEAD * patch_bytes:
+        return False
+    return revisions >= HISTORY_CHECKPOINT_INTERVAL or patch_bytes >= HISTORY_CHECKPOINT_PATCH_BYTES
+
+
+def _set_checkpoint(log, text):
+    """
+    Sets the distance of the change in `log` from the last checkpoint of its text, and, if one is due, stores `text`,
+    the state of the text after the change, as a checkpoint.  See `sefaria.history.text_at_revision()`
+    """
+    if not HISTORY_CHECKPOINT_INTERVAL:
+        return
+    last = db.history.find_one({"ref": log["ref"], "version": log["version"], "language": log["language"],
+                                "_id": {"$ne": log["_id"]}, "date": {"$lte": log["date"]},
+                                "checkpoint_distance": {"$exists": True}},
+                               {"checkpoint_distance": 1}, sort=[("date", -1)])
+    revisions, patch_bytes = last.get("checkpoint_distance", [0, 0]) if last else [0, 0]
+    revisions += 1
+    patch_bytes += len(log["revert_patch"].encode("utf-8"))
+    if checkpoint_due(revisions, patch_bytes, len(text.encode("utf-8"))):
+        log["checkpoint"] = text
+        log["checkpoint_distance"] = [0, 0]
+    else:
+        log["checkpoint_distance"] = [revisions, patch_bytes]
 
 
 def log_update(user, klass, old_dict, new_dict, **kwargs):
@@ -86,7 +288,32 @@ def log_add(user, klass, new_dict, **kwargs):
     return _log_general(user, kind, None, new_dict, rev_type, **kwargs)
 
 
+def log_many(user, klass, changes, **kwargs):
+    """
+    Records the history of many changes to records of `klass` with a single write.
+    :param changes: list of (old_dict, new_dict) tuples.  `old_dict` is None for an addition, `new_dict` None for a deletion.
+    :return: The number of history records written
+    """
+    kind = klass.history_noun
+    logs = []
+    for old_dict, new_dict in changes:
+        rev_type = "{} {}".format("add" if old_dict is None else "delete" if new_dict is None else "edit", kind)
+        log = _general_log_record(user, kind, old_dict, new_dict, rev_type, **kwargs)
+        if log:
+            logs.append(log)
+    if logs:
+        db.history.insert_many(logs, ordered=False)
+    return len(logs)
+
+
 def _log_general(user, kind, old_dict, new_dict, rev_type, **kwargs):
+    log = _general_log_record(user, kind, old_dict, new_dict, rev_type, **kwargs)
+    if log is None:
+        return
+    return History(log).save()
+
+
+def _general_log_record(user, kind, old_dict, new_dict, rev_type, **kwargs):
     log = {
         #"revision": next_revision_num(),
         "user": user,
@@ -110,7 +337,7 @@ def _log_general(user, kind, old_dict, new_dict, rev_type, **kwargs):
     if kind == "index":
         log['title'] = new_dict["title"]
 
-    return History(log).save()
+    return log
 
 '''
 def next_revision_num():
@@ -143,7 +370,11 @@ class History(abst.AbstractMongoRecord):
         "note_id",  # .05%
         "comment",  # rev_type: review
         "score",    # rev_type: review
-        "sheet"     # rev_type: publish sheet
+        "sheet",    # rev_type: publish sheet
+        "checkpoint",           # str: the full text after this change.  See sefaria.history.text_at_revision()
+        "checkpoint_distance",  # [number of changes, bytes of revert patches] since the last checkpoint, this change included
+        "old_text",  # str: the segment before this change, until diff_html and revert_patch are filled in
+        "new_text",  # str: the segment after this change, until diff_html and revert_patch are filled in
     ]
 
     def _sanitize(self):
@@ -168,6 +399,7 @@ def process_index_title_change_in_history(indx, **kwargs):
     """
     Update all history entries which reference 'old' to 'new'.
     """
+    text_history_queue.flush()
     from sefaria.model.text import prepare_index_regex_for_dependency_process
     queries = prepare_index_regex_for_dependency_process(indx, as_list=True)
     queries = [query.replace(re.escape(indx.title), re.escape(kwargs["old"])) for query in queries]
@@ -207,4 +439,5 @@ def process_version_title_change_in_history(ver, **kwargs):
         "version": kwargs["old"],
         "language": ver.language,
     }
+    text_history_queue.flush()
     db.history.update(query, {"$set": {"version": kwargs["new"]}}, upsert=False, multi=True)
\ No newline at end of file
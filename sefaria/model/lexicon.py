@@ -4,10 +4,17 @@ translation_request.py
 Writes to MongoDB Collection:
 """
 import re
+from collections import defaultdict
 from . import abstract as abst
 from sefaria.datatype.jagged_array import JaggedTextArray
+from sefaria.system.database import db
 from sefaria.system.exceptions import InputError
 
+try:
+    from sefaria.settings import LEXICON_WORD_FORMS_IN_MEMORY
+except ImportError:
+    LEXICON_WORD_FORMS_IN_MEMORY = False
+
 
 class WordForm(abst.AbstractMongoRecord):
 
@@ -301,16 +308,24 @@ class LexiconLookupAggregator(object):
         return gram_list
 
     @classmethod
-    def get_word_form_objects(cls, input_word, lookup_key='form', **kwargs):
+    def _lookup_key(cls, input_word, lookup_key='form'):
+        """
+        Returns the (field, value) of the word forms to look up for `input_word`
+        """
         from sefaria.utils.hebrew import is_hebrew, strip_cantillation, has_cantillation
-        from sefaria.model import Ref
 
-        lookup_ref = kwargs.get("lookup_ref", None)
-        wform_pkey = lookup_key
         if is_hebrew(input_word):
             input_word = strip_cantillation(input_word)
             if not has_cantillation(input_word, detect_vowels=True):
-                wform_pkey = 'c_form'
+                lookup_key = 'c_form'
+        return lookup_key, input_word
+
+    @classmethod
+    def get_word_form_objects(cls, input_word, lookup_key='form', **kwargs):
+        from sefaria.model import Ref
+
+        lookup_ref = kwargs.get("lookup_ref", None)
+        wform_pkey, input_word = cls._lookup_key(input_word, lookup_key)
         query_obj = {wform_pkey: input_word}
         if lookup_ref:
             nref = Ref(lookup_ref).normal()
@@ -321,6 +336,64 @@ class LexiconLookupAggregator(object):
             forms = WordFormSet(query_obj)
         return forms
 
+    _word_forms = None  # (field, value) -> list of word form records, when LEXICON_WORD_FORMS_IN_MEMORY
+
+    @classmethod
+    def load_word_forms(cls):
+        """
+        Loads all word forms into memory, for lookups that don't query the database.  Word forms saved later are not seen
+        until the next load.  Used when LEXICON_WORD_FORMS_IN_MEMORY is set.
+        """
+        word_forms = defaultdict(list)
+        for form in db.word_form.find({}, {"form": 1, "c_form": 1, "lookups": 1, "refs": 1, "_id": 0}):
+            for field in ("form", "c_form"):
+                if isinstance(form.get(field), str):
+                    word_forms[(field, form[field])].append(form)
+        cls._word_forms = dict(word_forms)
+
+    @classmethod
+    def _find_word_forms(cls, keys):
+        """
+        :param keys: set of (field, value), as returned by `_lookup_key`
+        :return: dict mapping each of `keys` that has word forms to the list of their records
+        """
+        if LEXICON_WORD_FORMS_IN_MEMORY:
+            if cls._word_forms is None:
+                cls.load_word_forms()
+            return {key: cls._word_forms[key] for key in keys if key in cls._word_forms}
+
+        if not keys:
+            return {}
+        values = defaultdict(set)
+        for field, value in keys:
+            values[field].add(value)
+        query = {"$or": [{field: {"$in": list(field_values)}} for field, field_values in values.items()]}
+        found = defaultdict(list)
+        for form in db.word_form.find(query, {"form": 1, "c_form": 1, "lookups": 1, "refs": 1}):
+            for field, field_values in values.items():
+                if isinstance(form.get(field), str) and form[field] in field_values:
+                    found[(field, form[field])].append(form)
+        return found
+
+    @classmethod
+    def _batch_lookup(cls, keys, lookup_ref=None):
+        """
+        Looks up the word forms of all of `keys` at once.
+        :param keys: list of (field, value), as returned by `_lookup_key`
+        :return: dict mapping each of `keys` to the list of lookups of its word forms, as `_single_lookup` returns them.
+        """
+        from sefaria.model import Ref
+
+        found = cls._find_word_forms(set(keys))
+        nref = Ref(lookup_ref).normal() if lookup_ref else None
+        results = {}
+        for key in keys:
+            forms = found.get(key, [])
+            if nref:
+                # prefer the forms found in lookup_ref, as `get_word_form_objects` does
+                forms = [form for form in forms if any(r.startswith(nref) for r in form.get("refs", []))] or forms
+            results[key] = [dict(lookup) for form in forms for lookup in form["lookups"]]
+        return results
 
     @classmethod
     def _single_lookup(cls, input_word, lookup_key='form', **kwargs):
@@ -337,27 +410,35 @@ class LexiconLookupAggregator(object):
     @classmethod
     def _ngram_lookup(cls, input_str, **kwargs):
         words = cls._split_input(input_str)
-        input_length = len(words)
+        keys = [cls._lookup_key(ng) for ng in cls._create_ngrams(words, len(words) - 1)]
+        found = cls._batch_lookup(keys, kwargs.get("lookup_ref", None))
         queries = []
-        for i in reversed(list(range(input_length))):
-            ngrams = cls._create_ngrams(words, i)
-            for ng in ngrams:
-                res = cls._single_lookup(ng, **kwargs)
-                if res:
-                    queries += res
+        for key in keys:
+            queries += found[key]
         return queries
 
     @classmethod
     def lexicon_lookup(cls, input_str, **kwargs):
-        results = cls._single_lookup(input_str, **kwargs)
-        if not results:
-            results = cls._single_lookup(input_str, lookup_key='c_form', **kwargs)
-        if not kwargs.get('never_split', None) and (len(results) == 0 or kwargs.get("always_split", None)):
-            ngram_results = cls._ngram_lookup(input_str, **kwargs)
-            results += ngram_results
+        """
+        Returns a LexiconEntrySet of the entries for `input_str`, or, unless `never_split`, for the n-grams of its words
+        if there are none or `always_split`.  Looks up the word forms of the string and of all its n-grams with one query.
+        """
+        split = not kwargs.get('never_split', None)
+        keys = [cls._lookup_key(input_str), cls._lookup_key(input_str, lookup_key='c_form')]
+        ngram_keys = []
+        if split:
+            words = cls._split_input(input_str)
+            ngram_keys = [cls._lookup_key(ng) for ng in cls._create_ngrams(words, len(words) - 1)]
+        found = cls._batch_lookup(keys + ngram_keys, kwargs.get("lookup_ref", None))
+
+        results = list(found[keys[0]] or found[keys[1]])
+        if split and (len(results) == 0 or kwargs.get("always_split", None)):
+            for key in ngram_keys:
+                results += found[key]
         if len(results):
             primary_tuples = set()
-            query = set() #TODO: optimize number of word form lookups? there can be a lot of duplicates... is it needed?
+            headwords = defaultdict(set)  # parent_lexicon -> headwords
+            other_lookups = []
             for r in results:
                 # extract the lookups with "primary" field so it can be used for sorting lookup in the LexicinEntrySet,
                 # but also delete it, because its not part of the query obj
@@ -365,6 +446,11 @@ class LexiconLookupAggregator(object):
                     if r["primary"] is True:
                         primary_tuples.add((r["headword"], r["parent_lexicon"]))
                     del r["primary"]
-            return LexiconEntrySet({"$or": results}, primary_tuples=primary_tuples)
+                if set(r) == {"headword", "parent_lexicon"}:
+                    headwords[r["parent_lexicon"]].add(r["headword"])
+                elif r not in other_lookups:
+                    other_lookups.append(r)
+            query = [{"parent_lexicon": lexicon, "headword": {"$in": sorted(hws)}} for lexicon, hws in headwords.items()]
+            return LexiconEntrySet({"$or": query + other_lookups}, primary_tuples=primary_tuples)
         else:
             return None
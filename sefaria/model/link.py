@@ -14,6 +14,11 @@ from . import text
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+    from sefaria.settings import USE_LINK_INTERVALS
+except ImportError:
+    USE_LINK_INTERVALS = False
+
 
 class Link(abst.AbstractMongoRecord):
     """
@@ -30,6 +35,7 @@ class Link(abst.AbstractMongoRecord):
     optional_attrs = [
         "expandedRefs0",    # list of refs corresponding to `refs.0`, but breaking ranging refs down into individual segments
         "expandedRefs1",    # list of refs corresponding to `refs.1`, but breaking ranging refs down into individual segments
+        "refIntervals",     # list of dicts corresponding to `refs`, each of the form returned by Ref.order_interval()
         "anchorText",       # string of dibbur hamatchil (largely depcrated) 
         "availableLangs",   # list of lists corresponding to `refs` showing languages available, e.g. [["he"], ["he", "en"]]  
         "highlightedWords", # list of strings to be highlighted when presenting a text as a connection
@@ -101,17 +107,45 @@ class Link(abst.AbstractMongoRecord):
         if not getattr(self, "_skip_expanded_refs_set", False):
             self._set_expanded_refs()
 
-    def _set_available_langs(self):
+        self._set_ref_intervals()
+
+    def _set_available_langs(self, langs_cache=None):
         LANGS_CHECKED = ["he", "en"]
         
         def lang_list(ref):
             return [lang for lang in LANGS_CHECKED if text.Ref(ref).is_text_fully_available(lang)]
-        self.availableLangs = [lang_list(ref) for ref in self.refs]
+
+        if langs_cache is None:
+            self.availableLangs = [lang_list(ref) for ref in self.refs]
+        else:
+            for ref in self.refs:
+                if ref not in langs_cache:
+                    langs_cache[ref] = lang_list(ref)
+            self.availableLangs = [langs_cache[ref] for ref in self.refs]
+
+    def prepare_bulk_insert(self, langs_cache=None):
+        """
+        Runs the steps of `save()` up to the write, other than the checks for existing links in `_pre_save()`,
+        so that many new links can be inserted at once.  The caller is responsible for those checks.
+        Dependencies are not notified.
+        :param langs_cache: dict from tref to its available languages, to share across links
+        :return: dict to insert into the links collection
+        """
+        self._normalize()
+        self._validate()
+        self._sanitize()
+        self._set_available_langs(langs_cache)
+        self._set_expanded_refs()
+        self._set_ref_intervals()
+        return self._saveable_attrs()
 
     def _set_expanded_refs(self):
         self.expandedRefs0 = [oref.normal() for oref in text.Ref(self.refs[0]).all_segment_refs()]
         self.expandedRefs1 = [oref.normal() for oref in text.Ref(self.refs[1]).all_segment_refs()]
 
+    def _set_ref_intervals(self):
+        self.refIntervals = [text.Ref(tref).order_interval() for tref in self.refs]
+
     def ref_opposite(self, from_ref, as_tuple=False):
         """
         Return the Ref in this link that is opposite the one matched by `from_ref`.
@@ -159,6 +193,16 @@ class LinkSet(abst.AbstractMongoSet):
         except AttributeError:
             super(LinkSet, self).__init__(query_or_ref, page, limit)
 
+    @classmethod
+    def by_interval(cls, oref, page=0, limit=0):
+        """
+        Returns the set of Links that refer to `oref` or below, as `LinkSet(oref)` does,
+        but with range comparisons over the `refIntervals` index rather than regex scans over `expandedRefs0/1`.
+        Relies on `refIntervals` having been set on every link.  See scripts/set_link_ref_intervals.py
+        :param oref: :py:class: `sefaria.text.Ref`
+        """
+        return cls(oref.interval_query(), page, limit)
+
     def filter(self, sources):
         """
         Filter LinkSet according to 'sources' which may be either
@@ -0,0 +1,268 @@
+"""
+merged_version.py
+Writes to MongoDB Collection: merged_texts
+
+A merged view of all the versions of an index in one language, as `VersionSet.merge` would produce it,
+stored with the version each segment came from.  Kept up to date on Version save and delete.
+On save, only the sections of the saved version that change the merge are merged again.
+"""
+from functools import reduce
+
+import logging
+logger = logging.getLogger(__name__)
+
+from pymongo.errors import DocumentTooLarge, WriteError
+
+from . import abstract as abst
+from . import text
+from sefaria.system.database import db
+from sefaria.system.exceptions import BookNameError
+
+try:
+    from sefaria.settings import USE_MERGED_VERSIONS
+except ImportError:
+    USE_MERGED_VERSIONS = False
+
+
+class MergedVersion(abst.AbstractMongoRecord, text.AbstractSchemaContent):
+    """
+    The merged text of all Versions of an Index in one language.
+    `chapter` has the shape of a Version's content.  `sources` has the same shape, with each segment holding the position
+    in `versionTitles` of the version it was taken from.
+    Only stored for texts with more than one version in the language.
+    """
+    collection = 'merged_texts'
+    content_attr = "chapter"
+
+    required_attrs = [
+        "title",          # FK to Index.title
+        "language",
+        "versionTitles",  # titles of the merged versions, in priority order
+        "chapter",
+        "sources",
+    ]
+
+    def sources_node(self, snode):
+        """
+        :return: The sources of the content at schema node `snode`
+        """
+        return reduce(lambda d, k: d[k], snode.version_address(), self.sources)
+
+
+class MergedVersionSet(abst.AbstractMongoSet):
+    recordClass = MergedVersion
+
+
+def merge_with_sources(contents, depth):
+    """
+    Merges the content of one node from several versions, taking each segment from the first version that has it.
+    Unlike :func:`sefaria.model.text.merge_texts`, the source of every segment is kept, at any depth.
+    :param contents: list of the jagged arrays of each version, in priority order
+    :param depth: depth of the jagged arrays
+    :return: (merged jagged array, jagged array of the same shape with the position in `contents` of the source of each segment)
+    """
+    if depth == 0:
+        for i, c in enumerate(contents):
+            if c:
+                return c, i
+        return "", 0
+    lists = [c if isinstance(c, list) else [] for c in contents]
+    merged, sources = [], []
+    for k in range(max([len(l) for l in lists] or [0])):
+        m, s = merge_with_sources([l[k] if k < len(l) else None for l in lists], depth - 1)
+        merged.append(m)
+        sources.append(s)
+    return merged, sources
+
+
+def _has_other_source(merged, sources, position):
+    """
+    :return: Does the merged content hold a segment taken from a version other than the one at `position`?
+    """
+    if isinstance(merged, list):
+        return any(_has_other_source(m, s, position) for m, s in zip(merged, sources if isinstance(sources, list) else []))
+    return bool(merged) and sources != position
+
+
+def _update_with_version(merged, sources, content, position, depth):
+    """
+    :return: (merged, sources) of one element of a merge after the version at `position` changed to `content`,
+        or None if that can't be told without the content of the other versions
+    """
+    if depth == 0:
+        if merged and sources < position:
+            return merged, sources
+        if content:
+            return content, position
+        if merged and sources == position:
+            return None  # The version no longer has the segment it gave.  A later version may have it.
+        return merged, sources
+    if not isinstance(merged, list) or not isinstance(sources, list) or len(merged) != len(sources):
+        return None
+    content = content if isinstance(content, list) else []
+    new_merged, new_sources = [], []
+    for k in range(max(len(merged), len(content))):
+        r = _update_with_version(merged[k] if k < len(merged) else ([] if depth > 1 else ""),
+                                 sources[k] if k < len(sources) else ([] if depth > 1 else 0),
+                                 content[k] if k < len(content) else None, position, depth - 1)
+        if r is None:
+            return None
+        new_merged.append(r[0])
+        new_sources.append(r[1])
+    if len(content) < len(merged) and not _has_other_source(new_merged[-1], new_sources[-1], position):
+        return None  # The version may have been the longest
+    return new_merged, new_sources
+
+
+def update_merged_content(merged, sources, content, position, depth, merge_section):
+    """
+    Updates, in place, the merged content of one node after the version at `position` in the merge changed to `content`.
+    A section is merged again with the other versions, by `merge_section(k)`, only where the merge can't be told from
+    `merged` and `sources` alone.
+    :param merged: merged jagged array of the node, as returned by :func:`merge_with_sources`
+    :param sources: jagged array of the sources of `merged`
+    :param merge_section: function of a section index returning the full (merged, sources) of that section
+    :return: list of the indexes of the sections that changed, or None if the whole node has to be merged again
+    """
+    if depth == 0 or not isinstance(merged, list) or not isinstance(sources, list) or len(merged) != len(sources):
+        return None
+    content = content if isinstance(content, list) else []
+    changed = []
+    for k in range(max(len(merged), len(content))):
+        old = (merged[k], sources[k]) if k < len(merged) else None
+        new = _update_with_version(old[0] if old else ([] if depth > 1 else ""), old[1] if old else ([] if depth > 1 else 0),
+                                   content[k] if k < len(content) else None, position, depth - 1)
+        if new is None:
+            new = merge_section(k)
+        if new == old:
+            continue
+        if old:
+            merged[k], sources[k] = new
+        else:
+            merged.append(new[0])
+            sources.append(new[1])
+        changed.append(k)
+    if len(content) < len(merged) and not _has_other_source(merged[-1], sources[-1], position):
+        return None
+    return changed
+
+
+def _version_content(v, node):
+    try:
+        return v.content_node(node)
+    except (KeyError, TypeError, IndexError):
+        return []
+
+
+def build_merged_version(title, lang):
+    """
+    Rebuilds the merged view of all versions of `title` in `lang`, or removes it if there are fewer than two.
+    """
+    vset = text.VersionSet({"title": title, "language": lang})
+    existing = MergedVersion().load({"title": title, "language": lang})
+    if len(vset) < 2:
+        if existing:
+            existing.delete()
+        return None
+
+    try:
+        index = text.library.get_index(title)
+    except BookNameError:
+        return None
+
+    merges = {}
+
+    def merge_node(node):
+        if not isinstance(node, text.JaggedArrayNode):
+            return [], []
+        if id(node) not in merges:
+            merges[id(node)] = merge_with_sources([_version_content(v, node) for v in vset], node.depth)
+        return merges[id(node)]
+
+    mv = existing or MergedVersion({"title": title, "language": lang})
+    mv.versionTitles = [v.versionTitle for v in vset]
+    mv.chapter = index.nodes.create_content(lambda n: merge_node(n)[0])
+    mv.sources = index.nodes.create_content(lambda n: merge_node(n)[1])
+    try:
+        mv.save()
+    except DocumentTooLarge:
+        logger.warning("Merged text of {} ({}) is too large to store.".format(title, lang))
+        MergedVersionSet({"title": title, "language": lang}).delete()
+        return None
+    return mv
+
+
+def update_merged_version(ver):
+    """
+    Updates the merged view of the index and language of `ver` after `ver` was saved.
+    Only the sections that change are merged again, and written.  The other versions are loaded only if one of them
+    is needed to merge a section.  If the versions, or their priorities, changed, rebuilds the view.
+    """
+    title, lang = ver.title, ver.language
+    titles = [v.versionTitle for v in text.VersionSet({"title": title, "language": lang}, proj={"versionTitle": 1})]
+    existing = MergedVersion().load({"title": title, "language": lang})
+    if not existing or existing.versionTitles != titles or getattr(ver, "versionTitle", None) not in titles:
+        return build_merged_version(title, lang)
+    try:
+        index = text.library.get_index(title)
+    except BookNameError:
+        return None
+
+    position = titles.index(ver.versionTitle)
+    others = []
+
+    def contents(node):
+        if not others:
+            others.extend(text.VersionSet({"title": title, "language": lang}))
+        return [_version_content(v, node) if v.versionTitle != ver.versionTitle else _version_content(ver, node) for v in others]
+
+    def merge_section(node, k):
+        return merge_with_sources([c[k] if isinstance(c, list) and k < len(c) else None for c in contents(node)], node.depth - 1)
+
+    updates = {}
+    for node in index.nodes.get_leaf_nodes():
+        if not isinstance(node, text.JaggedArrayNode):
+            continue
+        path = "".join(".{}".format(key) for key in node.version_address())
+        try:
+            merged, sources = existing.content_node(node), existing.sources_node(node)
+        except (KeyError, TypeError, IndexError):
+            return build_merged_version(title, lang)
+        changed = update_merged_content(merged, sources, _version_content(ver, node), position, node.depth,
+                                        lambda k: merge_section(node, k))
+        if changed is None:
+            merged, sources = merge_with_sources(contents(node), node.depth)
+            updates["chapter" + path], updates["sources" + path] = merged, sources
+        else:
+            for k in changed:
+                updates["chapter{}.{}".format(path, k)] = merged[k]
+                updates["sources{}.{}".format(path, k)] = sources[k]
+    if not updates:
+        return existing
+    try:
+        db.merged_texts.update_one({"_id": existing._id}, {"$set": updates})
+    except (DocumentTooLarge, WriteError):
+        logger.warning("Merged text of {} ({}) is too large to store.".format(title, lang))
+        MergedVersionSet({"title": title, "language": lang}).delete()
+        return None
+    return existing
+
+
+def rebuild_all_merged_versions():
+    for title in text.VersionSet().distinct("title"):
+        for lang in ("he", "en"):
+            build_merged_version(title, lang)
+
+
+def process_version_save_in_merged_versions(ver, **kwargs):
+    if USE_MERGED_VERSIONS:
+        update_merged_version(ver)
+
+
+def process_version_change_in_merged_versions(ver, **kwargs):
+    if USE_MERGED_VERSIONS:
+        build_merged_version(ver.title, ver.language)
+
+
+def process_index_delete_in_merged_versions(indx, **kwargs):
+    MergedVersionSet({"title": indx.title}).delete()
@@ -455,6 +455,47 @@ def test_complex_with_depth_2():
     pass
 
 
+def test_text_chunk_cache():
+    from sefaria.model.text import text_chunk_cache, process_version_change_in_text_chunk_cache
+    text_chunk_cache.resize(100)
+    try:
+        r = Ref("Genesis 1:1-3")
+        c = TextChunk(r, "en")
+        expected = list(c.text)
+        c.text[0] = "Changed in place"
+        hits = text_chunk_cache.stats()["hits"]
+        assert TextChunk(r, "en").text == expected
+        assert text_chunk_cache.stats()["hits"] == hits + 1
+
+        process_version_change_in_text_chunk_cache(Version({"title": "Genesis"}))
+        assert text_chunk_cache.get(text_chunk_cache.key(r, "en", None, False)) is None
+        assert TextChunk(r, "en").text == expected
+    finally:
+        text_chunk_cache.resize(0)
+
+
+def test_chunk_batch():
+    trefs = ["Genesis 1:1", "Genesis 1:3-5", "Genesis 1:31-2:2", "Genesis 3", "Exodus 2:2",
+             "Rashi on Genesis 1:1:1", "Rashi on Genesis 1:2-3", "Shabbat 8b", "Shabbat 8b:3-9a:2",
+             "Pesach Haggadah, Kadesh 2-4", "Mishnah Berakhot 1:1", "Genesis"]
+    orefs = [Ref(tref) for tref in trefs]
+    batch = TextChunkBatch(orefs, ["he", "en"])
+    for oref in orefs:
+        for lang in ["he", "en"]:
+            assert batch.text(oref, lang) == TextChunk(oref, lang).text, "{} {}".format(oref.normal(), lang)
+
+    with pytest.raises(InputError):
+        batch.text(Ref("Leviticus 1:1"), "en")
+
+
+def test_chunk_batch_reports_errors_per_ref():
+    good, bad = Ref("Genesis 1:1"), Ref("Pesach Haggadah")
+    batch = TextChunkBatch([bad, good], ["he", "en"])
+    with pytest.raises(InputError):
+        batch.text(bad, "en")
+    assert batch.text(good, "en") == TextChunk(good, "en").text
+
+
 def test_strip_itags():
     vs = ["Hadran Test"]
     for vt in vs:
@@ -41,6 +41,17 @@ class Test_Lexicon_Lookup(object):
         results = LexiconLookupAggregator.lexicon_lookup(word3)
         assert results.count() == 1
 
+    def test_batch_lookup_matches_single_lookups(self):
+        word = "Ma'aser Sheni Bikurim"
+        words = LexiconLookupAggregator._split_input(word)
+        for kwargs in ({}, {"lookup_ref": "Mishnah Maaser Sheni 3"}):
+            single = []
+            for ng in LexiconLookupAggregator._create_ngrams(words, len(words) - 1):
+                single += LexiconLookupAggregator._single_lookup(ng, **kwargs)
+            batched = LexiconLookupAggregator._ngram_lookup(word, **kwargs)
+            assert len(single) > 0
+            assert sorted(map(str, batched)) == sorted(map(str, single))
+
 
 class Test_Lexicon_Save(object):
 
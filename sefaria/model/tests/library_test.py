@@ -137,6 +137,19 @@ class Test_get_refs_in_text(object):
         wrapped = library.get_wrapped_refs_string(st, lang="en", citing_only=citing_only)
         assert wrapped == res
 
+    @pytest.mark.parametrize(('workers'), (None, 2))
+    def test_get_refs_in_strings(self, workers):
+        keys = ['bible_mid', 'bible_begin', '2ref', 'barenum', 'false_pos', 'he_2ref', 'neg327', '2talmud']
+        results = list(library.get_refs_in_strings(((k, texts[k]) for k in keys), workers=workers, batch_size=3))
+        assert [doc_id for doc_id, orefs, spans in results] == keys
+        for doc_id, orefs, spans in results:
+            assert set(orefs) == set(library.get_refs_in_string(texts[doc_id]))
+            assert len(spans) == len(orefs)
+
+    def test_get_refs_in_strings_spans(self):
+        [(doc_id, orefs, spans)] = list(library.get_refs_in_strings([(0, texts['2ref'])]))
+        assert [texts['2ref'][start:end] for start, end in spans] == ["Brachot 7b", "Isaiah 12:13"]
+
 class Test_he_get_refs_in_text(object):
     @pytest.mark.parametrize(('citing_only'), (True, False))
     def test_positions(self, citing_only):
@@ -356,6 +369,16 @@ class Test_get_titles_in_text(object):
             assert set(titles) == {'ויקרא', 'ספר שושנה'}
 
 
+    @pytest.mark.parametrize(('citing_only'), (True, False))
+    def test_automaton_matches_regex(self, citing_only):
+        for lang, st in [("en", "This is a test of a Brachot 7b and also of an Isaiah 12:13. Genesis 3:5 at the end"),
+                         ("en", texts['weird_ref']),
+                         ("he", "תלמוד לומר (דברים טז, יח) שופטים תתן שוטרים"),
+                         ("he", texts['weird_ref_he'])]:
+            by_regex = [m.group('title') for m in library.all_titles_regex(lang, citing_only=citing_only).finditer(st)]
+            assert library.get_titles_in_string(st, lang, citing_only=citing_only) == by_regex
+
+
 class Test_Library(object):
     def test_schema_validity(self):
         for i in library.all_index_records():
@@ -433,6 +456,28 @@ class Test_Library(object):
         n2 = library.get_schema_node("שמות", "he")
         assert node == n2
 
+    def test_snapshot(self, tmpdir):
+        path = str(tmpdir.join("library.snapshot"))
+        key = library.snapshot_key()
+        assert library.save_snapshot(path, key) >= 1
+
+        from sefaria.model.text import Library
+        loaded = Library()
+        assert not loaded.load_snapshot(path, "stale")
+        assert loaded.load_snapshot(path, key)
+        assert set(loaded._index_map) == set(library._index_map)
+        assert loaded.get_schema_node("Exodus").primary_title() == "Exodus"
+        assert loaded.get_index("Genesis").nodes.primary_title("he") == "בראשית"
+
+    def test_ref_pickled_without_neighbors(self):
+        import pickle
+        oref = Ref("Genesis 1")
+        assert oref.next_section_ref() == Ref("Genesis 2")
+        restored = pickle.loads(pickle.dumps(oref, pickle.HIGHEST_PROTOCOL))
+        assert restored == oref
+        assert restored._next is None
+        assert restored.next_section_ref() == Ref("Genesis 2")
+
 
 class Test_Term_Map(object):
     @classmethod
@@ -50,4 +50,31 @@ class Test_Link_Save(object):
                      "refs": ["Deuteronomy 10", "Avi Ezer, Deuteronomy 10:16:1"]})
         with pytest.raises(DuplicateRecordError) as e_info:
             link._pre_save()
-            assert "A more precise link already exists: {} - {}".format("Avi Ezer, Deuteronomy 10:16:1", "Deuteronomy 10:16") in str(e_info.value)
\ No newline at end of file
+            assert "A more precise link already exists: {} - {}".format("Avi Ezer, Deuteronomy 10:16:1", "Deuteronomy 10:16") in str(e_info.value)
+
+class Test_Link_Intervals(object):
+
+    def test_ref_intervals_set_on_save(self):
+        refs = ["Genesis 1:3-2:4", "Psalms 119:176"]
+        LinkSet({"generated_by": "link_tester", "refs": refs}).delete()
+        try:
+            Link({"auto": True, "generated_by": "link_tester", "type": "", "refs": refs}).save()
+            link = Link().load({"generated_by": "link_tester", "refs": refs})
+            assert link.refIntervals == [
+                {"book": "Genesis", "start": 1000300000000, "end": 2000499999999},
+                {"book": "Psalms", "start": 119017600000000, "end": 119017699999999},
+            ]
+        finally:
+            LinkSet({"generated_by": "link_tester", "refs": refs}).delete()
+
+    def test_order_interval_clamps_large_sections(self):
+        assert Ref._order_key([12000, 3], 0) == Ref._order_key([9999, 3], 0)
+        assert Ref._order_key([12000, 3], 0) < Ref._order_key([12000, 4], 0)
+
+    @pytest.mark.deep
+    def test_by_interval_matches_regex(self):
+        for tref in ["Genesis 1:3", "Genesis 1", "Genesis 1:3-2:4", "Rashi on Genesis 1:1"]:
+            oref = Ref(tref)
+            by_regex = {str(l._id) for l in LinkSet(oref) if getattr(l, "refIntervals", None)}
+            by_interval = {str(l._id) for l in LinkSet.by_interval(oref)}
+            assert by_regex == by_interval
@@ -552,6 +552,65 @@ class Test_Cache(object):
         r2 = Ref("Ramban on Genesis 1")
         assert r1 is not r2
 
+    def test_cache_eviction(self):
+        try:
+            Ref.configure_cache(max_entries=2)
+            r1 = Ref("Genesis 1")
+            assert Ref("Gen. 1") is r1
+            Ref("Exodus 1")
+            Ref("Leviticus 1")
+            assert Ref.cache_size() == 2
+            assert Ref.cache_stats()["evictions"] == 1
+            r2 = Ref("Gen. 1")
+            assert r2 is not r1
+            assert Ref("Genesis 1") is r2
+        finally:
+            Ref.reset_cache_config()
+
+    def test_segmented_cache_keeps_hot_refs(self):
+        try:
+            Ref.configure_cache(max_entries=4, policy="slru")
+            r1 = Ref("Genesis 1")
+            assert Ref("Genesis 1") is r1  # promoted to the protected segment
+            for tref in ["Exodus 1", "Exodus 2", "Exodus 3", "Exodus 4", "Exodus 5"]:
+                Ref(tref)
+            assert Ref("Genesis 1") is r1
+        finally:
+            Ref.reset_cache_config()
+
+    def test_cache_across_threads(self):
+        import threading
+        trefs = ["Genesis {}".format(i) for i in range(1, 30)]
+        results, errors = [], []
+
+        def build():
+            try:
+                for tref in trefs:
+                    results.append(Ref(tref))
+            except Exception as e:
+                errors.append(e)
+
+        try:
+            Ref.configure_cache(max_entries=5, policy="slru")
+            threads = [threading.Thread(target=build) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert not errors
+            assert None not in results
+            assert Ref.cache_size() <= 5
+        finally:
+            Ref.reset_cache_config()
+
+    def test_cache_stats(self):
+        Ref.clear_cache()
+        Ref("Genesis 1")
+        Ref("Genesis 1")
+        stats = Ref.cache_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
     '''
     # Retired.  Since we're dealing with objects, tref will either bleed one way or the other.
     # Removed last dependencies on tref outside of object init. 
@@ -906,6 +965,28 @@ class Test_Order_Id(object):
         assert first.ref().order_id() < second.ref().order_id()
         assert second.ref().order_id() < third.ref().order_id()
 
+
+class Test_Order_Interval(object):
+    def test_order_interval(self):
+        i = Ref("Genesis 1:3").order_interval()
+        assert i["book"] == "Genesis"
+        assert i["start"] <= i["end"]
+        assert Ref("Genesis 1").order_interval()["start"] <= i["start"]
+        assert Ref("Genesis 1").order_interval()["end"] >= i["end"]
+
+    def test_ordering_of_order_interval(self):
+        assert Ref("Genesis 1:3").order_interval()["end"] < Ref("Genesis 1:4").order_interval()["start"]
+        assert Ref("Genesis 1:31").order_interval()["end"] < Ref("Genesis 2:1").order_interval()["start"]
+        assert Ref("Shabbat 12b").order_interval()["end"] < Ref("Shabbat 17b").order_interval()["start"]
+
+    def test_range_order_interval(self):
+        r = Ref("Genesis 1:3-2:4").order_interval()
+        assert r["start"] == Ref("Genesis 1:3").order_interval()["start"]
+        assert r["end"] == Ref("Genesis 2:4").order_interval()["end"]
+
+    def test_complex_order_interval(self):
+        assert Ref("Pesach Haggadah, Magid, Four Sons 1").order_interval()["book"] == "Pesach Haggadah, Magid, Four Sons"
+
 '''
 class Test_ref_manipulations():
 
@@ -315,6 +315,51 @@ def test_merge():
     assert model.merge_texts([[["a", ""],["p","",""]], [["", "b", ""],["p","d",""]], [["","","c"],["","","q"]]], ["first", "second", "third"])[0] == [["a", "b", "c"],["p","d","q"]]
 
 
+def test_merge_with_sources():
+    from sefaria.model.merged_version import merge_with_sources
+    assert merge_with_sources([["a", ""], ["", "b", "c"]], 1) == (["a", "b", "c"], [0, 1, 1])
+
+    # sources stay nested at depth 2
+    assert merge_with_sources([[["a", ""],["p","","q"]], [["", "b", "c"],["p","d",""]]], 2) == ([["a", "b", "c"],["p","d","q"]], [[0, 1, 1],[0, 1, 0]])
+
+    # missing sections
+    assert merge_with_sources([[["a"]], [[], ["b"]]], 2) == ([["a"], ["b"]], [[0], [1]])
+
+
+def test_update_merged_content():
+    import random
+    from sefaria.model.merged_version import merge_with_sources, update_merged_content
+
+    versions = [[["a", ""], ["p", "", "q"]], [["", "b", "c"], ["p", "d", ""]], [["x"], [], ["z"]]]
+    merged, sources = merge_with_sources(versions, 2)
+    versions[1][1][1] = "D"
+    assert update_merged_content(merged, sources, versions[1], 1, 2, lambda k: pytest.fail("merged section {}".format(k))) == [1]
+    assert (merged, sources) == merge_with_sources(versions, 2)
+    assert merged == [["a", "b", "c"], ["p", "D", "q"], ["z"]]
+
+    # A segment given by the edited version is taken from the next version that has it
+    versions[0][0][0] = ""
+    merged_sections = []
+
+    def merge_section(k):
+        merged_sections.append(k)
+        return merge_with_sources([v[k] if k < len(v) else None for v in versions], 1)
+    assert update_merged_content(merged, sources, versions[0], 0, 2, merge_section) == [0]
+    assert merged_sections == [0]
+    assert (merged, sources) == merge_with_sources(versions, 2)
+
+    rand = random.Random(9)
+    for _ in range(300):
+        versions = [[[rand.choice(["", "s{}".format(i)]) for _ in range(rand.randint(0, 3))] for _ in range(rand.randint(0, 3))] for i in range(3)]
+        merged, sources = merge_with_sources(versions, 2)
+        position = rand.randint(0, 2)
+        versions[position] = [[rand.choice(["", "t"]) for _ in range(rand.randint(0, 3))] for _ in range(rand.randint(0, 3))]
+        changed = update_merged_content(merged, sources, versions[position], position, 2,
+                                        lambda k: merge_with_sources([v[k] if k < len(v) else None for v in versions], 1))
+        if changed is not None:
+            assert (merged, sources) == merge_with_sources(versions, 2)
+
+
 def test_text_helpers():
     res = model.library.get_dependant_indices()
     assert 'Rashbam on Genesis' in res
@@ -0,0 +1,29 @@
+from sefaria.model import *
+from sefaria.system.database import db
+
+
+def test_save_history_items():
+    uid = -999
+    db.user_history.delete_many({"uid": uid})
+    try:
+        UserHistory.save_history_item(uid, {"ref": "Genesis 1:1", "versions": {}, "time_stamp": 1})
+        items = UserHistory.save_history_items(uid, [
+            {"ref": "Genesis 1:2", "versions": {}, "time_stamp": 2},
+            {"ref": "Genesis 1:3", "versions": {}, "time_stamp": 3},
+            {"ref": "Genesis 1:3", "versions": {}, "time_stamp": 3, "action": "add_saved"},
+            {"ref": "Exodus 1:1", "versions": {"en": None}, "time_stamp": 4},
+            {"ref": "Not a ref 1:1", "versions": {}, "time_stamp": 5},
+        ], 10)
+        assert [uh.ref for uh in items] == ["Genesis 1:2", "Genesis 1:3", "Genesis 1:3", "Exodus 1:1"]
+
+        last_places = {uh.ref for uh in UserHistorySet({"uid": uid, "last_place": True})}
+        assert last_places == {"Genesis 1:3", "Exodus 1:1"}
+
+        saved = UserHistorySet({"uid": uid, "saved": True}).array()
+        assert len(saved) == 1
+        assert saved[0].ref == "Genesis 1:3"
+        assert saved[0].server_time_stamp == 10
+        assert saved[0].context_refs == ["Genesis 1:3", "Genesis 1"]
+        assert UserHistorySet({"uid": uid}).count() == 4
+    finally:
+        db.user_history.delete_many({"uid": uid})
@@ -13,6 +13,56 @@ class Test_VState(object):
             assert getattr(vs, "title")
             assert getattr(vs, "content")
 
+    def test_refresh_skips_unchanged(self):
+        vs = VersionState("Exodus")
+        assert vs.refresh(force=True)
+        versions = VersionSet({"title": "Exodus", "language": {"$in": VersionState.langs}})
+        assert {(c["language"], c["versionTitle"]) for c in vs.contributors} == {(v.language, v.versionTitle) for v in versions}
+        assert not VersionState("Exodus").refresh()
+
+    def test_refresh_recounts_only_changed_nodes(self, monkeypatch):
+        title, vtitle = "Pesach Haggadah", "VState Partial Refresh Test"
+        VersionSet({"title": title, "versionTitle": vtitle}).delete()
+        VersionState(title).refresh(force=True)
+        index = library.get_index(title)
+        leaf = index.nodes.first_leaf()
+
+        def content(*segments):
+            c = list(segments)
+            for _ in range(leaf.depth - 1):
+                c = [c]
+            return c
+
+        counted = []
+        node_count = VersionState._node_count
+
+        def counting_node_count(vs, snode, lang="en"):
+            counted.append(tuple(snode.version_address()))
+            return node_count(vs, snode, lang)
+
+        v = Version({"title": title, "language": "en", "versionTitle": vtitle, "versionSource": "http://www.sefaria.org",
+                     "chapter": index.nodes.create_skeleton()})
+        v.sub_content(leaf.version_address(), value=content("First", "", "Third"))
+        v.save()
+        try:
+            assert VersionState(title).refresh()
+            v = Version().load({"title": title, "language": "en", "versionTitle": vtitle})
+            v.sub_content(leaf.version_address(), value=content("First", "Second", "Third"))
+            v.save()
+
+            monkeypatch.setattr(VersionState, "_node_count", counting_node_count)
+            vs = VersionState(title)
+            assert vs.refresh()
+            monkeypatch.undo()
+            assert set(counted) == {tuple(leaf.version_address())}
+
+            forced = VersionState(title)
+            assert forced.refresh(force=True)
+            assert forced.content == vs.content
+        finally:
+            VersionSet({"title": title, "versionTitle": vtitle}).delete()
+            VersionState(title).refresh(force=True)
+
 
 class Test_VSNode(object):
     def test_section_counts(self):
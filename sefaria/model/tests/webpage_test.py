@@ -0,0 +1,73 @@
+import time
+
+from sefaria.model import *
+from sefaria.model.webpage import WebPageHitBuffer
+
+
+def test_hit_buffer_merges_hits():
+    url = "https://www.example.com/test-hit-buffer"
+    WebPageSet({"url": url}).delete()
+    buffer = WebPageHitBuffer(flush_interval=3600, background=False)
+    try:
+        for title in ("First Title", "Second Title", "Third Title"):
+            buffer.add(url, {"url": url, "title": title, "refs": ["Genesis 1:1", "Not a ref"]})
+
+        stats = buffer.stats()
+        assert stats["buffered_pages"] == 1
+        assert stats["buffered_hits"] == 3
+        assert WebPage().load(url) is None
+
+        assert buffer.flush() == 1
+        webpage = WebPage().load(url)
+        assert webpage.linkerHits == 3
+        assert webpage.title == "Third Title"
+        assert webpage.refs == ["Genesis 1:1"]
+
+        buffer.add(url, {"url": url, "title": "Third Title", "refs": ["Genesis 1:1"]})
+        buffer.flush()
+        assert WebPage().load(url).linkerHits == 4
+        assert WebPageSet({"url": url}).count() == 1
+    finally:
+        WebPageSet({"url": url}).delete()
+
+
+def test_hit_buffer_drops_when_full():
+    url = "https://www.example.com/test-hit-buffer"
+    other = "https://www.example.com/another-page"
+    WebPageSet({"url": {"$in": [url, other]}}).delete()
+    buffer = WebPageHitBuffer(flush_interval=3600, max_entries=1, background=False)
+    try:
+        buffer.add(url, {"url": url, "title": "First Title", "refs": []})
+        buffer.add(other, {"url": other, "title": "Another", "refs": []})
+        buffer.add(url, {"url": url, "title": "Second Title", "refs": []})
+
+        stats = buffer.stats()
+        assert stats["buffered_pages"] == 1
+        assert stats["buffered_hits"] == 2
+        assert stats["dropped_hits"] == 1
+
+        assert buffer.flush() == 1
+        assert WebPage().load(url).linkerHits == 2
+        assert WebPage().load(other) is None
+
+        # Once flushed, there is room again
+        buffer.add(other, {"url": other, "title": "Another", "refs": []})
+        assert buffer.stats()["buffered_pages"] == 1
+        assert buffer.stats()["dropped_hits"] == 1
+    finally:
+        WebPageSet({"url": {"$in": [url, other]}}).delete()
+
+
+def test_hit_buffer_flushes_when_full():
+    url = "https://www.example.com/test-hit-buffer"
+    WebPageSet({"url": url}).delete()
+    buffer = WebPageHitBuffer(flush_interval=3600, max_entries=1)
+    try:
+        buffer.add(url, {"url": url, "title": "First Title", "refs": []})
+        deadline = time.time() + 10
+        while WebPage().load(url) is None and time.time() < deadline:
+            time.sleep(0.05)
+        assert WebPage().load(url).linkerHits == 1
+        assert buffer.stats()["buffered_pages"] == 0
+    finally:
+        WebPageSet({"url": url}).delete()
@@ -8,11 +8,17 @@ from functools import reduce
 logger = logging.getLogger(__name__)
 
 import sys
+import os
+import io
 import regex
 import copy
+import pickle
+import hashlib
+from datetime import datetime
 import bleach
 import json
 import itertools
+import threading
 from collections import defaultdict
 from bs4 import BeautifulSoup, Tag
 try:
@@ -33,9 +39,30 @@ from sefaria.utils.talmud import daf_to_section
 from sefaria.utils.hebrew import is_hebrew, hebrew_term
 from sefaria.utils.util import list_depth
 from sefaria.datatype.jagged_array import JaggedTextArray, JaggedArray
+from sefaria.datatype.title_automaton import TitleAutomaton
 from sefaria.settings import DISABLE_INDEX_SAVE, USE_VARNISH, MULTISERVER_ENABLED
+try:
+    from sefaria.settings import REF_CACHE_MAX_ENTRIES, REF_CACHE_MAX_BYTES, REF_CACHE_POLICY
+except ImportError:
+    REF_CACHE_MAX_ENTRIES = None
+    REF_CACHE_MAX_BYTES = None
+    REF_CACHE_POLICY = "lru"
+try:
+    from sefaria.settings import TEXT_CHUNK_CACHE_MAX_ENTRIES
+except ImportError:
+    TEXT_CHUNK_CACHE_MAX_ENTRIES = 0
+try:
+    from sefaria.settings import USE_MERGED_VERSIONS
+except ImportError:
+    USE_MERGED_VERSIONS = False
+try:
+    from sefaria.settings import LIBRARY_SNAPSHOT_PATH
+except ImportError:
+    LIBRARY_SNAPSHOT_PATH = None
 from sefaria.system.multiserver.coordinator import server_coordinator
 
+REF_CACHE_BYTES_CHECK_INTERVAL = 5000  # Refs added to the cache between measurements of its size in bytes
+
 """
                 ----------------------------------
                          Index, IndexSet
@@ -1103,6 +1130,7 @@ class Version(AbstractTextRecord, abst.AbstractMongoRecord, AbstractSchemaConten
         "versionNotesInHebrew",  # stores VersionNotes in Hebrew
         "extendedNotes",
         "extendedNotesHebrew",
+        "lastModified",  # isoformat time of the last save
     ]
 
     def __str__(self):
@@ -1126,6 +1154,7 @@ class Version(AbstractTextRecord, abst.AbstractMongoRecord, AbstractSchemaConten
                 self.priority = float(self.priority)
             except ValueError as e:
                 self.priority = None
+        self.lastModified = datetime.now().isoformat()
 
     def _sanitize(self):
         # sanitization happens on TextChunk saving
@@ -1317,6 +1346,61 @@ def merge_texts(text, sources):
     return [text, text_sources]
 
 
+class TextChunkCache(object):
+    """
+    Per-process read-through cache of the text loaded by :class:`TextChunk`, bounded by least recent use.
+    Keyed by (index title, ref, lang, version title or None for merged, exclude_copyrighted).
+    Values are (versions, merge sources, is_merged, text), with the text already trimmed to the ref.
+    Entries are dropped by title when a Version is saved or deleted, see :func:`process_version_change_in_text_chunk_cache`.
+    A `max_entries` of 0 turns the cache off.
+    """
+
+    def __init__(self, max_entries=0):
+        self._title_keys = defaultdict(set)
+        self._cache = scache.LRUCache(max_entries, on_evict=self._forget)
+
+    @staticmethod
+    def key(oref, lang, vtitle, exclude_copyrighted):
+        return oref.index.title, oref.normal(), lang, vtitle, bool(exclude_copyrighted)
+
+    def _forget(self, key, value):
+        keys = self._title_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._title_keys[key[0]]
+
+    def get(self, key):
+        if not self._cache.max_entries:
+            return None
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        if not self._cache.max_entries:
+            return
+        self._title_keys[key[0]].add(key)
+        self._cache.set(key, value)
+
+    def invalidate(self, title):
+        for key in self._title_keys.pop(title, set()):
+            self._cache.pop(key)
+
+    def clear(self):
+        self._title_keys = defaultdict(set)
+        self._cache.clear()
+
+    def resize(self, max_entries):
+        self._cache.resize(max_entries)
+        if not max_entries:
+            self.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+text_chunk_cache = TextChunkCache(TEXT_CHUNK_CACHE_MAX_ENTRIES)
+
+
 class TextFamilyDelegator(type):
     """
     Metaclass to delegate virtual text records
@@ -1375,15 +1459,33 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
         self.full_version = None
         self.versionSource = None  # handling of source is hacky
 
+        key = text_chunk_cache.key(self._oref, lang, vtitle, exclude_copyrighted) if lang else None
+        cached = text_chunk_cache.get(key) if key else None
+        if cached is None:
+            self._load_text(lang, vtitle, exclude_copyrighted)
+            if key:
+                text_chunk_cache.set(key, (list(self._versions), list(self.sources), self.is_merged, copy.deepcopy(self.text)))
+        else:
+            versions, sources, self.is_merged, text = cached
+            self._versions = list(versions)
+            self.sources = list(sources)
+            self.text = copy.deepcopy(text)
+            if vtitle:
+                self._saveable = True
+                self._original_text = self.text
+
+    def _load_text(self, lang, vtitle, exclude_copyrighted):
         if lang and vtitle:
             self._saveable = True
             v = Version().load({"title": self._oref.index.title, "language": lang, "versionTitle": vtitle}, self._oref.part_projection())
             if exclude_copyrighted and v.is_copyrighted():
-                raise InputError("Can not provision copyrighted text. {} ({}/{})".format(oref.normal(), vtitle, lang))
+                raise InputError("Can not provision copyrighted text. {} ({}/{})".format(self._oref.normal(), vtitle, lang))
             if v:
                 self._versions += [v]
                 self.text = self._original_text = self.trim_text(v.content_node(self._oref.index_node))
         elif lang:
+            if USE_MERGED_VERSIONS and not exclude_copyrighted and self._load_merged_version(lang):
+                return
             vset = VersionSet(self._oref.condition_query(lang), proj=self._oref.part_projection())
 
             if len(vset) == 0:
@@ -1393,7 +1495,7 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
             if len(vset) == 1:
                 v = vset[0]
                 if exclude_copyrighted and v.is_copyrighted():
-                    raise InputError("Can not provision copyrighted text. {} ({}/{})".format(oref.normal(), v.versionTitle, v.language))
+                    raise InputError("Can not provision copyrighted text. {} ({}/{})".format(self._oref.normal(), v.versionTitle, v.language))
                 self._versions += [v]
                 self.text = self.trim_text(v.content_node(self._oref.index_node))
                 #todo: Should this instance, and the non-merge below, be made saveable?
@@ -1414,6 +1516,49 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
         else:
             raise Exception("TextChunk requires a language.")
 
+    def _load_merged_version(self, lang):
+        """
+        Loads the text from the stored merged view of all versions in `lang`, if there is one.
+        Only the part of the merged view covering this ref is read.  Then the versions that contributed to it are loaded, without content.
+        :return: False if there is no merged view
+        """
+        from . import merged_version
+
+        proj = {"versionTitles": 1, "_id": 1}
+        for k, v in self._oref.part_projection().items():
+            if k.startswith("chapter"):
+                proj[k] = v
+                proj["sources" + k[len("chapter"):]] = v
+        mv = merged_version.MergedVersion().load({"title": self._oref.index.title, "language": lang}, proj)
+        if not mv:
+            return False
+
+        node = self._oref.index_node
+        text = self.trim_text(mv.content_node(node))
+        sources = self.trim_text(mv.sources_node(node))
+
+        def segments(t, s):
+            if isinstance(t, list):
+                for t_child, s_child in zip(t, s):
+                    yield from segments(t_child, s_child)
+            else:
+                yield t, s
+
+        flat = list(segments(text, sources))
+        used = [mv.versionTitles[s] for t, s in flat if t]
+        self.text = text
+        if not used:
+            return True
+
+        vset = VersionSet({"title": self._oref.index.title, "language": lang, "versionTitle": {"$in": list(set(used))}}, proj={"chapter": 0})
+        if len(set(used)) == 1:
+            self._versions = vset.array()[:1]
+        else:
+            self.sources = [mv.versionTitles[s] for _, s in flat]
+            self.is_merged = True
+            self._versions = vset.array()
+        return True
+
     def __str__(self):
         args = "{}, {}".format(self._oref, self.lang)
         if self.vtitle:
@@ -1672,14 +1817,25 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
         :param txt:
         :return: List|String depending on depth of Ref
         """
-        range_index = self._oref.range_index()
-        sections = self._oref.sections
-        toSections = self._oref.toSections
+        return self.trim_text_to_ref(self._oref, txt)
+
+    @staticmethod
+    def trim_text_to_ref(oref, txt):
+        """
+        Trims a text loaded from Version record with oref.part_projection() to the specifications of oref.
+        Modifies txt in place, when oref is a range that starts or ends mid-section.
+        :param oref: :class:`Ref` to a :class:`JaggedArrayNode`
+        :param txt:
+        :return: List|String depending on depth of Ref
+        """
+        range_index = oref.range_index()
+        sections = oref.sections
+        toSections = oref.toSections
 
         if not sections:
             pass
         else:
-            for i in range(0, self._ref_depth):
+            for i in range(0, len(sections)):
                 if i == 0 == range_index:  # First level slice handled at DB level
                     pass
                 elif range_index > i:  # Either not range, or range begins later.  Return simple value.
@@ -1688,7 +1844,7 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
                     elif len(txt) >= sections[i]:
                         txt = txt[sections[i] - 1]
                     else:
-                        return self.empty_text()
+                        return TextChunk.empty_text_for_ref(oref)
                 elif range_index == i:  # Range begins here
                     start = sections[i] - 1
                     end = toSections[i]
@@ -1707,7 +1863,14 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
         """
         :return: Either empty array or empty string, depending on depth of Ref
         """
-        if not self._oref.is_range() and self._ref_depth == self._oref.index_node.depth:
+        return self.empty_text_for_ref(self._oref)
+
+    @staticmethod
+    def empty_text_for_ref(oref):
+        """
+        :return: Either empty array or empty string, depending on depth of oref
+        """
+        if not oref.is_range() and len(oref.sections) == oref.index_node.depth:
             return ""
         else:
             return []
@@ -1861,6 +2024,132 @@ class VirtualTextChunk(AbstractTextRecord):
         return [self._versions[0]._id] if self._versions else []
 
 
+class TextChunkBatch(object):
+    """
+    The merged text of many Refs, fetched together.
+
+    Refs are grouped by the node they address.  Each group is loaded with a single query for all requested languages,
+    projecting only the top level sections that cover every Ref in the group,
+    and each Ref's text is then sliced and merged out of that in memory.
+    The text of each Ref is what `TextChunk(oref, lang).text` would return.
+
+    ::
+
+        batch = TextChunkBatch([Ref("Genesis 1:1"), Ref("Genesis 1:3-5"), Ref("Rashi on Genesis 1:1:1")])
+        batch.text(Ref("Genesis 1:3-5"), "he")
+
+    A Ref whose text can't be loaded doesn't fail the batch; :meth:`text` raises its error instead.
+
+    :param orefs: iterable of :class:`Ref`
+    :param langs: languages to load
+    """
+
+    # What getting the text of a bad Ref raises.  These are reported per Ref.
+    ref_errors = (InputError, ValueError, AttributeError, KeyError, IndexError)
+
+    def __init__(self, orefs, langs=("en", "he")):
+        self.langs = list(langs)
+        self._texts = {}   # (Ref, lang) -> text
+        self._errors = {}  # Ref -> exception raised in getting its text
+
+        groups = defaultdict(list)  # (index title, storage address) -> list of (requested Ref, Ref to a JaggedArrayNode)
+        for oref in orefs:
+            if oref in self._errors or (oref, self.langs[0]) in self._texts:
+                continue
+            try:
+                if oref.index_node.is_virtual:
+                    for lang in self.langs:
+                        self._texts[(oref, lang)] = TextChunk(oref, lang).text
+                    continue
+                if isinstance(oref.index_node, JaggedArrayNode):
+                    chunk_ref = oref
+                else:
+                    chunk_ref = oref.default_child_ref()
+                    if chunk_ref == oref:
+                        raise InputError("Can not get TextChunk at this level, please provide a more precise reference")
+                groups[(chunk_ref.index.title, chunk_ref.storage_address())].append((oref, chunk_ref))
+            except self.ref_errors as e:
+                self._errors[oref] = e
+
+        for (title, address), refs in groups.items():
+            try:
+                self._load_group(title, address, refs)
+            except self.ref_errors as e:
+                for oref, _ in refs:
+                    self._errors.setdefault(oref, e)
+
+    def _load_group(self, title, address, refs):
+        chunk_refs = [chunk_ref for _, chunk_ref in refs]
+        node = chunk_refs[0].index_node
+        projection = next((r for r in chunk_refs if r.sections), chunk_refs[0]).part_projection()
+        if all(r.sections for r in chunk_refs):
+            skip = min(r.sections[0] for r in chunk_refs) - 1
+            end = max(r.sections[0] if r.range_index() > 0 else r.toSections[0] for r in chunk_refs)
+            projection[address] = {"$slice": [skip, end - skip]}
+        else:
+            skip = 0
+            projection[address] = 1
+
+        vset = VersionSet({"title": title, "language": {"$in": self.langs}, address: {"$exists": True}}, proj=projection)
+        contents = defaultdict(list)  # lang -> content of each version, in priority order
+        for v in vset:
+            contents[v.language].append(v.content_node(node))
+
+        if not len(vset) and VersionSet({"title": title}).count() == 0:
+            for oref, _ in refs:
+                self._errors[oref] = NoVersionFoundError("No text record found for '{}'".format(title))
+            return
+
+        for oref, chunk_ref in refs:
+            try:
+                for lang in self.langs:
+                    self._texts[(oref, lang)] = self._ref_text(chunk_ref, contents[lang], skip)
+            except self.ref_errors as e:
+                self._errors[oref] = e
+
+    @classmethod
+    def _ref_text(cls, oref, version_contents, skip):
+        """
+        :param version_contents: the content of each version, beginning at top level section `skip`
+        :return: The text of oref, merged from every version with content there
+        """
+        if oref.sections:
+            start = oref.sections[0] - 1 - skip
+            end = start + 1 if oref.range_index() > 0 else oref.toSections[0] - skip
+            version_contents = [c[start:end] for c in version_contents]
+
+        candidates = []
+        for content in version_contents:
+            trimmed = TextChunk.trim_text_to_ref(oref, copy.deepcopy(content))
+            if cls._has_content(trimmed):
+                candidates.append((content, trimmed))
+
+        if not candidates:
+            return TextChunk.empty_text_for_ref(oref)
+        if len(candidates) == 1:
+            return candidates[0][1]
+        merged_text, _ = merge_texts([content for content, _ in candidates], [None] * len(candidates))
+        return TextChunk.trim_text_to_ref(oref, merged_text)
+
+    @classmethod
+    def _has_content(cls, text):
+        if isinstance(text, list):
+            return any(cls._has_content(t) for t in text)
+        return bool(text)
+
+    def text(self, oref, lang):
+        """
+        :return: The text of oref in lang
+        :raises InputError: if oref was not loaded, or if `TextChunk` would have raised in loading it
+        """
+        if oref in self._errors:
+            raise self._errors[oref]
+        try:
+            return self._texts[(oref, lang)]
+        except KeyError:
+            raise InputError("{} was not loaded in {}".format(oref.normal(), lang))
+
+
 # This was built as a bridge between the object model and existing front end code, so has some hallmarks of that legacy.
 class TextFamily(object):
     """
@@ -2187,29 +2476,80 @@ class RefCacheType(type):
     Metaclass for Ref class.
     Caches all Ref isntances according to the string they were instanciated with and their normal form.
     Returns cached instance on instanciation if either instanciation string or normal form are matched.
+
+    The cache can be bounded, by number of Refs and/or by approximate size in bytes.  See :meth:`configure_cache`.
+    Refs are evicted together with every string that resolves to them,
+    so a tref and its normal form always resolve to the same instance.
+    Refs are also built from background threads (e.g. when web page hits are flushed), so the cache is guarded by a lock.
     """
 
     def __init__(cls, name, parents, dct):
         super(RefCacheType, cls).__init__(name, parents, dct)
-        cls.__tref_oref_map = {}
-        cls.__index_tref_map = {}
+        cls.__lock = threading.RLock()
+        cls.reset_cache_config()
+
+    def reset_cache_config(cls):
+        """
+        Restores the eviction policy set in settings, e.g. after a test configured its own, and clears the cache.
+        """
+        cls.configure_cache(REF_CACHE_MAX_ENTRIES, REF_CACHE_MAX_BYTES, REF_CACHE_POLICY)
+
+    def configure_cache(cls, max_entries=None, max_bytes=None, policy="lru"):
+        """
+        Sets the eviction policy for the cache, and clears it.  Without arguments, the cache is unbounded.
+        See :meth:`reset_cache_config` to restore the policy set in settings.
+        :param max_entries: Maximum number of Refs held.  None for no limit.
+        :param max_bytes: Approximate maximum size of the cache, as measured by :meth:`cache_size_bytes`.  None for no limit.
+        :param policy: "lru" or "slru" (segmented LRU)
+        """
+        if policy not in ("lru", "slru"):
+            raise InputError("Unknown Ref cache policy: {}".format(policy))
+        with cls.__lock:
+            cls.__max_entries = max_entries
+            cls.__max_bytes = max_bytes
+            cls.__policy = policy
+            cls.clear_cache()
 
     def cache_size(cls):
-        return len(cls.__tref_oref_map)
+        return len(cls.__oref_cache)
 
     def cache_size_bytes(cls):
         from sefaria.utils.util import get_size
-        return get_size(cls.__tref_oref_map)
+        with cls.__lock:
+            orefs = cls.__oref_cache.values()
+            # Indexes and their nodes are held by the library, not by the cache
+            seen = {id(o.index) for o in orefs} | {id(o.index_node) for o in orefs}
+            return get_size(cls.__tref_uid_map, seen) + get_size(orefs, seen)
+
+    def cache_stats(cls):
+        with cls.__lock:
+            stats = cls.__oref_cache.stats()
+            stats.update({
+                "policy": cls.__policy,
+                "max_bytes": cls.__max_bytes,
+                "trefs": len(cls.__tref_uid_map),
+                "hits": cls.__hits,
+                "misses": cls.__misses,
+            })
+        return stats
 
     def cache_dump(cls):
-        return [(a, repr(b)) for (a, b) in cls.__tref_oref_map.items()]
+        return [(a, repr(b)) for (a, b) in cls._raw_cache().items()]
 
     def _raw_cache(cls):
-        return cls.__tref_oref_map
+        with cls.__lock:
+            return {tref: cls.__oref_cache.peek(uid) for tref, uid in cls.__tref_uid_map.items()}
 
     def clear_cache(cls):
-        cls.__tref_oref_map = {}
-        cls.__index_tref_map = {}
+        with cls.__lock:
+            cache_class = scache.SegmentedLRUCache if cls.__policy == "slru" else scache.LRUCache
+            cls.__oref_cache = cache_class(cls.__max_entries, on_evict=cls.__forget)
+            cls.__tref_uid_map = {}     # every string seen -> uid of its Ref
+            cls.__uid_tref_map = {}     # uid -> every string seen for that Ref
+            cls.__index_tref_map = {}   # index title -> uids of cached Refs
+            cls.__hits = 0
+            cls.__misses = 0
+            cls.__inserts_since_size_check = 0
 
     def remove_index_from_cache(cls, index_title):
         """
@@ -2218,15 +2558,57 @@ class RefCacheType(type):
         :param index_title:
         :return:
         """
+        with cls.__lock:
+            for uid in list(cls.__index_tref_map.get(index_title, [])):
+                oref = cls.__oref_cache.pop(uid)
+                if oref is not None:
+                    cls.__forget(uid, oref)
+
+    def __forget(cls, uid, oref):
+        for tref in cls.__uid_tref_map.pop(uid, []):
+            cls.__tref_uid_map.pop(tref, None)
         try:
-            for tref in cls.__index_tref_map[index_title]:
-                try:
-                    del cls.__tref_oref_map[tref]
-                except KeyError:
-                    continue
+            cls.__index_tref_map[oref.index.title].discard(uid)
         except KeyError:
             pass
 
+    def __store(cls, result, tref=None):
+        """
+        Caches `result`, or the already cached Ref with the same normal form, under `tref` and its uid.
+        :return: the cached Ref
+        """
+        uid = result.uid()
+        with cls.__lock:
+            cached = cls.__oref_cache.get(uid)
+            if cached is None:
+                cached = result
+                cls.__tref_uid_map[uid] = uid
+                cls.__uid_tref_map[uid] = [uid]
+                cls.__index_tref_map.setdefault(result.index.title, set()).add(uid)
+                cls.__oref_cache.set(uid, result)
+                cls.__check_size()
+            if tref and tref not in cls.__tref_uid_map and uid in cls.__uid_tref_map:
+                cls.__tref_uid_map[tref] = uid
+                cls.__uid_tref_map[uid].append(tref)
+            return cached
+
+    def __check_size(cls):
+        """
+        Measuring the cache is expensive, so only every so often shrink the entry limit to what fits in `max_bytes`.
+        """
+        if cls.__max_bytes is None:
+            return
+        cls.__inserts_since_size_check += 1
+        if cls.__inserts_since_size_check < REF_CACHE_BYTES_CHECK_INTERVAL:
+            return
+        cls.__inserts_since_size_check = 0
+        size = cls.cache_size_bytes()
+        if size > cls.__max_bytes:
+            fitting = int(len(cls.__oref_cache) * cls.__max_bytes / size)
+            if cls.__max_entries is not None:
+                fitting = min(fitting, cls.__max_entries)
+            cls.__oref_cache.resize(max(fitting, 1))
+
     def __call__(cls, *args, **kwargs):
         if len(args) == 1:
             tref = args[0]
@@ -2235,43 +2617,25 @@ class RefCacheType(type):
 
         obj_arg = kwargs.get("_obj")
 
+        # The lock is not held while a Ref is built, as building one can take a while and build others
         if tref:
-            if tref in cls.__tref_oref_map:
-                return cls.__tref_oref_map[tref]
-            else:
-                result = super(RefCacheType, cls).__call__(*args, **kwargs)
-                uid = result.uid()
-                title = result.index.title
-                if uid in cls.__tref_oref_map:
-                    #del result  #  Do we need this to keep memory clean?
-                    cls.__tref_oref_map[tref] = cls.__tref_oref_map[uid]
-                    try:
-                        cls.__index_tref_map[title] += [tref]
-                    except KeyError:
-                        cls.__index_tref_map[title] = [tref]
-                    return cls.__tref_oref_map[uid]
-                cls.__tref_oref_map[uid] = result
-                cls.__tref_oref_map[tref] = result
-                try:
-                    cls.__index_tref_map[title] += [tref]
-                except KeyError:
-                    cls.__index_tref_map[title] = [tref]
-                cls.__index_tref_map[title] += [uid]
-
-                return result
+            with cls.__lock:
+                uid = cls.__tref_uid_map.get(tref)
+                cached = cls.__oref_cache.get(uid) if uid is not None else None
+                if cached is not None:
+                    cls.__hits += 1
+                    return cached
+                cls.__misses += 1
+            result = super(RefCacheType, cls).__call__(*args, **kwargs)
+            return cls.__store(result, tref)
         elif obj_arg:
             result = super(RefCacheType, cls).__call__(*args, **kwargs)
-            uid = result.uid()
-            title = result.index.title
-            if uid in cls.__tref_oref_map:
-                #del result  #  Do we need this to keep memory clean?
-                return cls.__tref_oref_map[uid]
-            cls.__tref_oref_map[uid] = result
-            try:
-                cls.__index_tref_map[title] += [uid]
-            except KeyError:
-                cls.__index_tref_map[title] = [uid]
-            return result
+            with cls.__lock:
+                if result.uid() in cls.__oref_cache:
+                    cls.__hits += 1
+                else:
+                    cls.__misses += 1
+                return cls.__store(result)
         else:  # Default.  Shouldn't be used.
             return super(RefCacheType, cls).__call__(*args, **kwargs)
 
@@ -2324,6 +2688,18 @@ class Ref(object, metaclass=RefCacheType):
             self.tref = self.normal()
             self._validate()
 
+    # Cached Refs of neighboring and containing sections.  Through them, one Ref reaches every Ref of its book.
+    _ref_pointer_attrs = ("_next", "_prev", "_padded", "_context", "_first_spanned_ref", "_spanned_refs", "_ranged_refs")
+
+    def __getstate__(self):
+        """
+        Pickles a Ref without its cached neighbors, which would otherwise be pickled recursively, Ref after Ref.
+        """
+        state = self.__dict__.copy()
+        for attr in self._ref_pointer_attrs:
+            state[attr] = None
+        return state
+
     def __init_ref_pointer_vars(self):
         self._normal = None
         self._he_normal = None
@@ -3155,7 +3531,7 @@ class Ref(object, metaclass=RefCacheType):
             if not r:
                 return None
             d = r._core_dict()
-            newSections = r.sections + [self.get_state_ja().sub_array_length([i - 1 for i in r.sections])]
+            newSections = r.sections + [self.get_offset_table().sub_array_length([i - 1 for i in r.sections])]
             d["sections"] = d["toSections"] = newSections
             return Ref(_obj=d)
 
@@ -3171,7 +3547,7 @@ class Ref(object, metaclass=RefCacheType):
         if not r.is_segment_level():
             return r
         sectionRef = r.section_ref()
-        sectionLength = self.get_state_ja().sub_array_length([i - 1 for i in sectionRef.sections])
+        sectionLength = self.get_offset_table().sub_array_length([i - 1 for i in sectionRef.sections])
         if r.sections[-1] < sectionLength:
             d = r._core_dict()
             d["sections"] = d["toSections"] = r.sections[:-1] + [r.sections[-1] + 1]
@@ -3232,6 +3608,14 @@ class Ref(object, metaclass=RefCacheType):
         #TODO: also does not work with complex texts...
         return self.get_state_node(hint=[(lang, "availableTexts")]).ja(lang)
 
+    def get_offset_table(self):
+        """
+        Unlike the state node, this is cached in process, and kept up to date by :meth:`VersionState.refresh`.
+        :return: :class:`sefaria.datatype.offset_table.OffsetTable` of the "all" availableTexts of this Ref's node
+        """
+        from . import version_state
+        return version_state.offset_tables.get(self.index_node)
+
     def is_text_fully_available(self, lang):
         """
         :param lang: "he" or "en"
@@ -3299,7 +3683,7 @@ class Ref(object, metaclass=RefCacheType):
         if vstate:
             c = vstate.state_node(self.index_node).ja("all", "availableTexts")
         else:
-            c = self.get_state_node(hint=[("all","availableTexts")]).ja("all", "availableTexts")
+            c = self.get_offset_table()
         new_section = c.next_index(starting_points) if forward else c.prev_index(starting_points)
 
         # we are also scaling back the sections to the level ABOVE the lowest section type (eg, for bible we want chapter, not verse)
@@ -3406,7 +3790,8 @@ class Ref(object, metaclass=RefCacheType):
             size = len(self.text().text)
             return self.subrefs(size)
 
-        size = self.get_state_ja(lang).sub_array_length([i - 1 for i in self.sections])
+        ja = self.get_offset_table() if lang == "all" else self.get_state_ja(lang)
+        size = ja.sub_array_length([i - 1 for i in self.sections])
         if size is None:
             size = 0
         return self.subrefs(size)
@@ -3891,6 +4276,67 @@ class Ref(object, metaclass=RefCacheType):
             logger.warning("Failed to execute order_id for {} : {}".format(self, e))
             return "Z"
 
+    # Each level of an order key takes ORDER_KEY_BASE values and only the top ORDER_KEY_DEPTH levels are encoded,
+    # so that keys fit in a 64 bit integer.  Deeper sections, or sections past the base, widen the interval rather than breaking it.
+    ORDER_KEY_BASE = 10000
+    ORDER_KEY_DEPTH = 4
+
+    @classmethod
+    def _order_key(cls, sections, fill):
+        key = 0
+        for i in range(cls.ORDER_KEY_DEPTH):
+            key = key * cls.ORDER_KEY_BASE + (min(sections[i], cls.ORDER_KEY_BASE - 1) if i < len(sections) else fill)
+        return key
+
+    def order_interval(self):
+        """
+        Returns the numeric interval covered by this Ref within its node, as a dict of the form:
+        {"book": <full title of the node>, "start": <int>, "end": <int>}
+
+        Like :meth:`order_id`, keys are built from the sections of the Ref, one fixed width place per level.
+        Unlike :meth:`order_id`, they are integers, and they don't depend on the ordering of the table of contents.
+        Two Refs on the same node overlap iff their intervals overlap.
+
+        Sections above ``ORDER_KEY_BASE - 1`` (9999) are counted as 9999, so that every section fits its place.
+        Beyond it, Refs that differ only in that section share an interval: a query by interval may then match
+        more records than :meth:`ref_regex_query`, but never fewer.
+
+        ::
+
+            >>> Ref("Genesis 1:3").order_interval()
+            {"book": "Genesis", "start": 1000300000000, "end": 1000399999999}
+
+        :return dict:
+        """
+        start = self.starting_ref().sections
+        end = self.ending_ref().toSections
+        return {
+            "book": self.index_node.full_title("en"),
+            "start": self._order_key(start, 0),
+            "end": self._order_key(end, self.ORDER_KEY_BASE - 1)
+        }
+
+    def interval_query(self, field="refIntervals"):
+        """
+        Returns a query that will find records with an interval in `field` that overlaps this Ref.
+        Records are expected to store a list of intervals, as returned by :meth:`order_interval`.
+        This is the interval counterpart of :meth:`ref_regex_query`, and it matches the same records.
+
+        :param field: name of the attribute holding the list of intervals
+        :return dict:
+        """
+        if getattr(self.index_node, "children", None) and not self.index_node.is_virtual:
+            # A schema node - match anything on any of the leaves below it
+            titles = [n.full_title("en") for n in self.index_node.get_leaf_nodes()]
+            return {field: {"$elemMatch": {"book": {"$in": titles}}}}
+
+        interval = self.order_interval()
+        return {field: {"$elemMatch": {
+            "book": interval["book"],
+            "start": {"$lte": interval["end"]},
+            "end": {"$gte": interval["start"]}
+        }}}
+
     """ Methods for working with Versions and VersionSets """
     def storage_address(self):
         """
@@ -4185,7 +4631,9 @@ class Ref(object, metaclass=RefCacheType):
         """
         :return: :class:`LinkSet` for this Ref
         """
-        from . import LinkSet
+        from .link import LinkSet, USE_LINK_INTERVALS
+        if USE_LINK_INTERVALS:
+            return LinkSet.by_interval(self)
         return LinkSet(self)
 
     def autolinker(self, **kwargs):
@@ -4204,7 +4652,7 @@ class Ref(object, metaclass=RefCacheType):
         """
 
         :param ref: ref which you want to compare distance with
-        :param max_dist: maximum distance beyond which the function will return -1. it's suggested you set this param b/c alternative is very slow
+        :param max_dist: maximum distance beyond which the function will return -1
         :return: int: num refs between self and ref. -1 if self and ref aren't in the same index
         """
         if self.index_node != ref.index_node:
@@ -4218,7 +4666,7 @@ class Ref(object, metaclass=RefCacheType):
         for i in range(len(sec2)):
             sec2[i] -= 1
 
-        distance = self.get_state_ja().distance(sec1,sec2)
+        distance = self.get_offset_table().distance(sec1,sec2)
         if max_dist and distance > max_dist:
             return -1
         else:
@@ -4241,10 +4689,11 @@ class Library(object):
     1. On load of this file, library instance is created.
         - Terms maps created
     2. On load of full model with `from sefaria.model import *`
-        - Indexes are built
+        - Indexes are built, or loaded from the snapshot at LIBRARY_SNAPSHOT_PATH
     3. On load of reader/views
         - toc tree is built (categories loaded)
         - autocompleters are created
+        - Both skipped if loaded from the snapshot, which is saved here if it was missing or out of date
 
 
     """
@@ -4269,6 +4718,9 @@ class Library(object):
         self._title_regex_strings = {}
         self._title_regexes = {}
 
+        # Title automata, keys are generated as for `all_titles_regex`.  See `title_automaton()`
+        self._title_automata = {}
+
         # Maps, keyed by language, from term names to text refs
         self._term_ref_maps = {lang: {} for lang in self.langs}
 
@@ -4302,6 +4754,9 @@ class Library(object):
         self._lexicon_auto_completer_is_ready = False
         self._cross_lexicon_auto_completer_is_ready = False
 
+        # Key of the snapshot at LIBRARY_SNAPSHOT_PATH, and whether it was loaded.  See `init_index_maps()`
+        self._snapshot_key = None
+        self._snapshot_loaded = False
 
         if not hasattr(sys, '_doc_build'):  # Can't build cache without DB
             self.build_term_mappings()
@@ -4325,11 +4780,157 @@ class Library(object):
             except IndexSchemaError as e:
                 logger.error("Error in generating title node dictionary: {}".format(e))
 
+    # Bump when the structures saved in a snapshot change shape
+    SNAPSHOT_FORMAT = 1
+
+    # Attributes saved in a snapshot, in tiers.  If a tier can't be pickled, the snapshot is saved without it and those that follow.
+    _snapshot_tiers = [
+        ["_index_map", "_title_node_maps", "_index_title_maps", "_term_ref_maps", "_simple_term_mapping", "_full_term_mapping",
+         "_full_title_lists", "_title_regex_strings", "_title_automata"],
+        ["_toc", "_toc_json", "_search_filter_toc", "_search_filter_toc_json", "_toc_tree", "_toc_tree_is_ready"],
+        ["_full_auto_completer", "_full_auto_completer_is_ready", "_ref_auto_completer", "_ref_auto_completer_is_ready",
+         "_lexicon_auto_completer", "_lexicon_auto_completer_is_ready",
+         "_cross_lexicon_auto_completer", "_cross_lexicon_auto_completer_is_ready"],
+    ]
+
+    @staticmethod
+    def snapshot_key():
+        """
+        :return: A hash of the records that the Library's derived structures are built from.
+        Records have no update timestamps, so `index`, `category`, `term` and the parts of `vstate` read by the TOC are hashed whole.
+        The larger collections read only by the auto completers are summarized by their count and last `_id`.
+        """
+        import bson
+        h = hashlib.md5(str(Library.SNAPSHOT_FORMAT).encode())
+        hashed = [("index", None), ("category", None), ("term", None), ("vstate", {"title": 1, "first_section_ref": 1, "flags": 1})]
+        for collection, proj in hashed:
+            for doc in db[collection].find({}, proj).sort("_id", 1):
+                h.update(bson.BSON.encode(doc))
+        for collection in ("person", "groups", "word_form", "lexicon_entry"):
+            last = db[collection].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            h.update("{}:{}:{}".format(collection, db[collection].estimated_document_count(), last["_id"] if last else "").encode())
+        return h.hexdigest()
+
+    def save_snapshot(self, path, key=None):
+        """
+        Saves the Library's derived structures to `path`, to be loaded with `load_snapshot`.
+        :param key: The `snapshot_key()` of the records the structures were built from.  Computed if not given.
+        :return: The number of tiers of `_snapshot_tiers` saved
+        """
+        key = key or self.snapshot_key()
+        library_self = self
+
+        class LibraryPickler(pickle.Pickler):
+            # Objects such as the auto completers hold the library.  Save a reference, rather than a copy.
+            def persistent_id(self, obj):
+                return "library" if obj is library_self else None
+
+        # Refs are pickled without their cached neighbors (see `Ref.__getstate__`), which keeps the pickle shallow
+        data, tiers = None, 0
+        attrs = {}
+        for tier in self._snapshot_tiers:
+            attrs.update({attr: getattr(self, attr) for attr in tier})
+            buf = io.BytesIO()
+            try:
+                LibraryPickler(buf, pickle.HIGHEST_PROTOCOL).dump(attrs)
+            except (pickle.PicklingError, TypeError, AttributeError, RecursionError) as e:
+                logger.warning("Library snapshot can't include {}: {}".format(", ".join(tier), e))
+                break
+            data, tiers = buf.getvalue(), tiers + 1
+
+        if data is None:
+            return 0
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"format": self.SNAPSHOT_FORMAT, "key": key, "tiers": tiers}, f, pickle.HIGHEST_PROTOCOL)
+            f.write(data)
+        os.replace(tmp_path, path)
+        return tiers
+
+    def load_snapshot(self, path, key=None):
+        """
+        Loads the structures saved by `save_snapshot` at `path`, if it was saved from records matching `key`.
+        :param key: The current `snapshot_key()`.  Computed if not given.
+        :return: True if the snapshot was loaded
+        """
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return False
+        library_self = self
+
+        class LibraryUnpickler(pickle.Unpickler):
+            def persistent_load(self, pid):
+                if pid == "library":
+                    return library_self
+                raise pickle.UnpicklingError("Unknown persistent id {}".format(pid))
+
+        try:
+            with f:
+                header = pickle.load(f)
+                if header.get("format") != self.SNAPSHOT_FORMAT or header.get("key") != (key or self.snapshot_key()):
+                    logger.info("Library snapshot at {} is out of date.".format(path))
+                    return False
+                attrs = LibraryUnpickler(f).load()
+        except Exception as e:
+            logger.warning("Failed to load library snapshot at {}: {}".format(path, e))
+            return False
+
+        for attr, value in attrs.items():
+            setattr(self, attr, value)
+        return True
+
+    def init_index_maps(self):
+        """
+        Builds the index maps, or, if LIBRARY_SNAPSHOT_PATH is set and holds an up to date snapshot, loads them and
+        whatever else the snapshot holds from it.  Run on load of the full model.
+        """
+        if LIBRARY_SNAPSHOT_PATH:
+            self._snapshot_key = self.snapshot_key()
+            self._snapshot_loaded = self.load_snapshot(LIBRARY_SNAPSHOT_PATH, self._snapshot_key)
+            if self._snapshot_loaded:
+                logger.info("Loaded library from snapshot {}".format(LIBRARY_SNAPSHOT_PATH))
+                return
+        self._build_index_maps()
+
+    def warm_up(self):
+        """
+        Builds the TOC and auto completers, unless loaded from a snapshot, then saves a snapshot if LIBRARY_SNAPSHOT_PATH
+        is set and none was loaded.  Loads the word forms if LEXICON_WORD_FORMS_IN_MEMORY is set.  Run on load of reader/views.
+        """
+        if not self._toc_tree_is_ready:
+            self.get_toc_tree()
+        if not self._full_auto_completer_is_ready:
+            self.build_full_auto_completer()
+        if not self._ref_auto_completer_is_ready:
+            self.build_ref_auto_completer()
+        if not self._lexicon_auto_completer_is_ready:
+            self.build_lexicon_auto_completers()
+        if not self._cross_lexicon_auto_completer_is_ready:
+            self.build_cross_lexicon_auto_completer()
+        from .lexicon import LexiconLookupAggregator, LEXICON_WORD_FORMS_IN_MEMORY
+        if LEXICON_WORD_FORMS_IN_MEMORY:
+            LexiconLookupAggregator.load_word_forms()
+
+        if LIBRARY_SNAPSHOT_PATH and not self._snapshot_loaded:
+            self.get_toc()
+            self.get_toc_json()
+            self.get_search_filter_toc()
+            self.get_search_filter_toc_json()
+            for lang in self.langs:
+                self.all_titles_regex_string(lang)
+                self.title_automaton(lang)
+            try:
+                self.save_snapshot(LIBRARY_SNAPSHOT_PATH, self._snapshot_key)
+            except (IOError, OSError) as e:
+                logger.warning("Failed to save library snapshot at {}: {}".format(LIBRARY_SNAPSHOT_PATH, e))
+
     def _reset_index_derivative_objects(self, include_auto_complete=False):
         self._full_title_lists = {}
         self._full_title_list_jsons = {}
         self._title_regex_strings = {}
         self._title_regexes = {}
+        self._title_automata = {}
         # TOC is handled separately since it can be edited in place
 
     def rebuild(self, include_toc = False, include_auto_complete=False):
@@ -4339,6 +4940,7 @@ class Library(object):
         self._full_title_list_jsons = {}
         self._title_regex_strings = {}
         self._title_regexes = {}
+        self._title_automata = {}
         Ref.clear_cache()
         if include_toc:
             self.rebuild_toc()
@@ -4699,6 +5301,35 @@ class Library(object):
             self._title_regexes[key] = reg
         return reg
 
+    # Characters that may follow a title found in a string.  Mirrors the tail of `all_titles_regex_string`
+    TITLE_DELIMITERS = ":., <"
+
+    def title_automaton(self, lang="en", with_terms=False, citing_only=False):
+        """
+        :return: A :class:`TitleAutomaton` over every known title in the library in the provided language.
+        Finds the same titles as `all_titles_regex`, in a single linear pass, without the memory cost of the giant alternation.
+        :param lang: "en" or "he"
+        :param bool with_terms: Default False.  If True, include shared titles ('terms'). (Will have no effect if citing_only is True)
+        :param citing_only: Match only those texts which have is_cited set to True
+        """
+        if citing_only:
+            key = "citing_titles_" + lang
+        else:
+            key = "all_titles_" + lang
+            key += "_terms" if with_terms else ""
+        automaton = self._title_automata.get(key)
+        if not automaton:
+            titles = self.citing_title_list(lang) if citing_only else self.full_title_list(lang, with_terms=with_terms)
+            automaton = TitleAutomaton(titles)
+            self._title_automata[key] = automaton
+        return automaton
+
+    def get_title_spans_in_string(self, s, lang="en", citing_only=False):
+        """
+        :return: list of (start, end) tuples for each title found in `s`, as `all_titles_regex` would find them
+        """
+        return self.title_automaton(lang, citing_only=citing_only).find_all(s, self.TITLE_DELIMITERS)
+
     def full_title_list(self, lang="en", with_terms=False):
         """
         :return: list of strings of all possible titles
@@ -4884,7 +5515,7 @@ class Library(object):
         """
         if not lang:
             lang = "he" if is_hebrew(s) else "en"
-        return [m.group('title') for m in self.all_titles_regex(lang, citing_only=citing_only).finditer(s)]
+        return [s[start:end] for start, end in self.get_title_spans_in_string(s, lang, citing_only)]
 
     def get_refs_in_string(self, st, lang=None, citing_only=False):
         """
@@ -4896,6 +5527,65 @@ class Library(object):
         :return: list of :class:`Ref` objects
             Order is not guaranteed
         """
+        return [oref for oref, span in self._get_refs_and_spans_in_string(st, lang, citing_only)]
+
+    def get_refs_in_strings(self, docs, lang=None, citing_only=False, workers=None, batch_size=100):
+        """
+        Finds Refs in many strings.  With `workers`, the work is done in a pool of forked processes,
+        which share the title automata and schema nodes built here, copy-on-write.
+
+        :param docs: iterable of (doc_id, string) tuples.  doc_ids must be picklable.  Consumed lazily.
+        :param lang: "he" or "en".  If None, detected per string.
+        :param citing_only: boolean whether to use only records explicitly marked as being referenced in text.
+        :param workers: number of worker processes.  None or 1 to work in this process.
+        :param batch_size: number of docs sent to a worker at once
+        :return: generator of (doc_id, [:class:`Ref`], [(start, end)]) tuples, in the order of `docs`.
+            Spans are positions in the string (in Hebrew, in the string with nikkud stripped)
+        """
+        def _batches():
+            it = iter(docs)
+            batch = list(itertools.islice(it, batch_size))
+            while batch:
+                yield batch
+                batch = list(itertools.islice(it, batch_size))
+        batches = _batches()
+
+        if not workers or workers <= 1:
+            for batch in batches:
+                for doc_id, st in batch:
+                    results = self._get_refs_and_spans_in_string(st, lang, citing_only)
+                    yield doc_id, [oref for oref, span in results], [span for oref, span in results]
+            return
+
+        import multiprocessing
+        from collections import deque
+        from sefaria.system.database import reconnect
+        # Build everything the workers need before forking, so that they share it rather than each building their own
+        for l in ([lang] if lang else self.langs):
+            self.title_automaton(l, citing_only=citing_only)
+
+        pool = multiprocessing.get_context("fork").Pool(workers, initializer=reconnect)
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(pool.apply_async(_refs_in_strings_worker, (batch, lang, citing_only)))
+                # Bound the number of batches in flight, so that `docs` is streamed rather than read into memory
+                while len(pending) >= workers * 2:
+                    yield from self._hydrate_refs_in_strings_results(pending.popleft().get())
+            while pending:
+                yield from self._hydrate_refs_in_strings_results(pending.popleft().get())
+        finally:
+            pool.terminate()
+
+    @staticmethod
+    def _hydrate_refs_in_strings_results(results):
+        for doc_id, found in results:
+            yield doc_id, [Ref(tref) for tref, span in found], [span for tref, span in found]
+
+    def _get_refs_and_spans_in_string(self, st, lang=None, citing_only=False):
+        """
+        :return: list of (:class:`Ref`, (start, end)) tuples for each Ref found in `st`.  See `get_refs_in_string`.
+        """
         # todo: only match titles of content nodes
 
         refs = []
@@ -4907,7 +5597,7 @@ class Library(object):
             unique_titles = set(self.get_titles_in_string(st, lang, citing_only))
             for title in unique_titles:
                 try:
-                    res = self._build_all_refs_from_string(title, st)
+                    res = self._internal_ref_from_string(title, st, lang, return_locations=True)
                     refs += res
                 except AssertionError as e:
                     logger.info("Skipping Schema Node: {}".format(title))
@@ -4915,13 +5605,11 @@ class Library(object):
                     logger.error("Error finding ref for {} in: {}".format(title, st))
 
         else:  # lang == "en"
-            for match in self.all_titles_regex(lang, citing_only=citing_only).finditer(st):
-                title = match.group('title')
-                if not title:
-                    continue
+            for start, end in self.get_title_spans_in_string(st, lang, citing_only):
+                title = st[start:end]
                 try:
-                    res = self._build_ref_from_string(title, st[match.start():])  # Slice string from title start
-                    refs += res
+                    res = self._internal_ref_from_string(title, st[start:], "en", stIsAnchored=True, return_locations=True)  # Slice string from title start
+                    refs += [(oref, (span[0] + start, span[1] + start)) for oref, span in res]
                 except AssertionError as e:
                     logger.info("Skipping Schema Node: {}".format(title))
                 except InputError as e:
@@ -5024,6 +5712,17 @@ class Library(object):
                     [)}]										# zero-width: literal ')' or brace
                 )"""
 
+    def _get_compiled_regex(self, node, title, lang, anchored=False):
+        """
+        Returns the compiled result of `get_regex_string`, cached on the node.
+        """
+        key = ("ref_from_string", title, lang, anchored)
+        reg = node._regexes.get(key)
+        if reg is None:
+            reg = regex.compile(self.get_regex_string(title, lang, anchored=anchored), regex.VERBOSE)
+            node._regexes[key] = reg
+        return reg
+
     def _get_ref_from_match(self, ref_match, node, lang):
         sections = []
         toSections = []
@@ -5082,13 +5781,12 @@ class Library(object):
 
         refs = []
         try:
-            re_string = self.get_regex_string(title, lang, anchored=stIsAnchored)
+            reg = self._get_compiled_regex(node, title, lang, anchored=stIsAnchored)
         except AttributeError as e:
             logger.warning(
                 "Library._internal_ref_from_string() failed to create regex for: {}.  {}".format(title, e))
             return refs
 
-        reg = regex.compile(re_string, regex.VERBOSE)
         if stIsAnchored:
             m = reg.match(st)
             matches = [m] if m else []
@@ -5211,6 +5909,17 @@ class Library(object):
 library = Library()
 
 
+def _refs_in_strings_worker(batch, lang, citing_only):
+    """
+    Runs in a forked worker of `Library.get_refs_in_strings`.  Returns normal forms rather than Refs, which are costly to pickle.
+    """
+    results = []
+    for doc_id, st in batch:
+        found = library._get_refs_and_spans_in_string(st, lang, citing_only)
+        results.append((doc_id, [(oref.normal(), span) for oref, span in found]))
+    return results
+
+
 def prepare_index_regex_for_dependency_process(index_object, as_list=False):
     """
     :return string: Regular Expression which will find any titles that match this index title exactly, or more specifically.
@@ -5254,12 +5963,34 @@ def process_index_title_change_in_sheets(indx, **kwargs):
     sheets = db.sheets.find(query)
     for sheet in sheets:
         sheet["includedRefs"] = [r.replace(kwargs["old"], kwargs["new"], 1) if re.search('|'.join(regex_list), r) else r for r in sheet.get("includedRefs", [])]
+        if "includedRefIntervals" in sheet:
+            from sefaria.sheets import ref_intervals
+            sheet["includedRefIntervals"] = ref_intervals(sheet["includedRefs"])
         for source in sheet.get("sources", []):
             if "ref" in source:
                 source["ref"] = source["ref"].replace(kwargs["old"], kwargs["new"], 1) if re.search('|'.join(regex_list), source["ref"]) else source["ref"]
         db.sheets.save(sheet)
 
 
+def invalidate_text_chunk_cache(title):
+    text_chunk_cache.invalidate(title)
+
+
+def process_version_change_in_text_chunk_cache(ver, **kwargs):
+    invalidate_text_chunk_cache(ver.title)
+
+    if MULTISERVER_ENABLED:
+        server_coordinator.publish_event("text", "invalidate_text_chunk_cache", [ver.title])
+
+
+def process_index_change_in_text_chunk_cache(indx, **kwargs):
+    title = kwargs.get("old", indx.title)
+    invalidate_text_chunk_cache(title)
+
+    if MULTISERVER_ENABLED:
+        server_coordinator.publish_event("text", "invalidate_text_chunk_cache", [title])
+
+
 def process_index_delete_in_versions(indx, **kwargs):
     VersionSet({"title": indx.title}).delete()
 
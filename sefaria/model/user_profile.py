@@ -8,6 +8,9 @@ import csv
 from datetime import datetime
 from random import randint
 
+from bson.objectid import ObjectId
+from pymongo import InsertOne, ReplaceOne
+
 from sefaria.system.exceptions import InputError, SheetNotFoundError
 from functools import reduce
 
@@ -70,17 +73,7 @@ class UserHistory(abst.AbstractMongoRecord):
         """
         if attrs is None:
             attrs = {}
-        # set defaults
-        if "saved" not in attrs:
-            attrs["saved"] = False
-        if "secondary" not in attrs:
-            attrs["secondary"] = False
-        if "last_place" not in attrs:
-            attrs["last_place"] = False
-        # remove empty versions
-        for k, v in list(attrs.get("versions", {}).items()):
-            if v is None:
-                del attrs["versions"][k]
+        self._set_defaults(attrs)
         if load_existing:
             temp = UserHistory().load({"uid": attrs["uid"], "ref": attrs["ref"], "versions": attrs["versions"]})
             if temp is not None:
@@ -97,6 +90,19 @@ class UserHistory(abst.AbstractMongoRecord):
 
         super(UserHistory, self).__init__(attrs=attrs)
 
+    @staticmethod
+    def _set_defaults(attrs):
+        if "saved" not in attrs:
+            attrs["saved"] = False
+        if "secondary" not in attrs:
+            attrs["secondary"] = False
+        if "last_place" not in attrs:
+            attrs["last_place"] = False
+        # remove empty versions
+        for k, v in list(attrs.get("versions", {}).items()):
+            if v is None:
+                del attrs["versions"][k]
+
     def _normalize(self):
         # Derived values - used to make downstream queries quicker
         self.datetime = datetime.utcfromtimestamp(self.time_stamp)
@@ -108,7 +114,7 @@ class UserHistory(abst.AbstractMongoRecord):
             self.is_sheet       = r.index.title == "Sheet"
             if self.is_sheet:
                 self.sheet_id = r.sections[0]
-            if not self.secondary and not self.is_sheet and getattr(self, "language", None) != "hebrew" and r.is_empty("en"):
+            if not self.secondary and not self.is_sheet and getattr(self, "language", None) != "hebrew" and self._is_empty_in_english(r):
                 # logically, this would be on frontend, but easier here.
                 self.language = "hebrew"
         except SheetNotFoundError:
@@ -124,6 +130,21 @@ class UserHistory(abst.AbstractMongoRecord):
         except KeyError:     # is_text_translated() stumbled on a bad version state
             pass
 
+    def _is_empty_in_english(self, oref):
+        """
+        When saved with `save_history_items`, answered from the VersionState of the text, shared across the batch.
+        """
+        state_jas = getattr(self, "_state_jas", None)
+        if state_jas is None:
+            return oref.is_empty("en")
+        key = (oref.index.title, tuple(oref.index_node.version_address()))
+        try:
+            if key not in state_jas:
+                state_jas[key] = oref.get_state_ja("en")
+            return state_jas[key].subarray_with_ref(oref).is_empty()
+        except Exception:
+            return oref.is_empty("en")
+
     def contents(self, **kwargs):
         d = super(UserHistory, self).contents(**kwargs)
         if kwargs.get("for_api", False):
@@ -170,6 +191,97 @@ class UserHistory(abst.AbstractMongoRecord):
         uh.save()
         return uh
 
+    @classmethod
+    def save_history_items(cls, uid, hists, time_stamp=None):
+        """
+        Saves each of `hists`, in order, as `save_history_item` would, with a single query for the existing records
+        they touch and a single ordered bulk write.  Items with refs that can't be parsed are skipped.
+        :return: list of the UserHistory saved for each item
+        """
+        if time_stamp is None:
+            time_stamp = epoch_time()
+        items = []
+        for hist in hists:
+            hist["uid"] = uid
+            if "he_ref" not in hist or "book" not in hist:
+                try:
+                    oref = Ref(hist["ref"])
+                except InputError as e:
+                    logger.warning("Skipping history item for user {}: {}".format(uid, e))
+                    continue
+                hist["he_ref"] = oref.he_normal()
+                hist["book"] = oref.index.title
+            hist["server_time_stamp"] = time_stamp if "server_time_stamp" not in hist else hist["server_time_stamp"]
+            action = hist.pop("action", None)
+            cls._set_defaults(hist)
+            items.append((hist, action))
+        if not items:
+            return []
+
+        def versions_key(attrs):
+            # Matches as Mongo compares embedded documents, in order
+            return attrs["ref"], tuple(attrs.get("versions", {}).items())
+
+        # Records as `load_existing` and `update_last_place` would find them, in the order Mongo returns them
+        docs = {}           # _id -> record
+        existing = {}       # (ref, versions) -> _id
+        last_places = {}    # book -> _id
+        clauses = []
+        refs = {hist["ref"] for hist, action in items if action is not None}
+        books = {hist["book"] for hist, action in items if action is None}
+        if refs:
+            clauses.append({"ref": {"$in": list(refs)}})
+        if books:
+            clauses.append({"book": {"$in": list(books)}, "last_place": True})
+        for doc in db.user_history.find({"uid": uid, "$or": clauses}):
+            docs[doc["_id"]] = doc
+            if doc.get("ref") in refs:
+                existing.setdefault(versions_key(doc), doc["_id"])
+            if doc.get("last_place") and doc.get("book") in books:
+                last_places.setdefault(doc["book"], doc["_id"])
+
+        state_jas = {}
+        changed = []     # _ids of records to write, in order of first change
+        new_ids = set()
+        saved_items = []
+        for hist, action in items:
+            attrs = hist
+            if action is not None:
+                _id = existing.get(versions_key(attrs))
+                if _id is not None:
+                    attrs = dict(docs[_id])
+                attrs.update({
+                    "saved": True if action == "add_saved" else (False if action == "delete_saved" else hist.get("saved", False)),
+                    "server_time_stamp": hist["server_time_stamp"],
+                    "delete_saved": action == "delete_saved"
+                })
+            else:
+                _id = last_places.get(attrs["book"])
+                if _id is not None:
+                    docs[_id]["last_place"] = False
+                    changed.append(_id)
+                attrs["last_place"] = True
+
+            uh = UserHistory(attrs)
+            uh._state_jas = state_jas
+            uh._normalize()
+            uh._validate()
+            if uh.is_new():
+                uh._id = ObjectId()
+                new_ids.add(uh._id)
+            docs[uh._id] = uh._saveable_attrs()
+            changed.append(uh._id)
+            existing.setdefault(versions_key(attrs), uh._id)
+            if uh.last_place:
+                last_places[uh.book] = uh._id
+            saved_items.append(uh)
+
+        requests = []
+        for _id in dict.fromkeys(changed):
+            requests.append(InsertOne(docs[_id]) if _id in new_ids else ReplaceOne({"_id": _id}, docs[_id]))
+        db.user_history.bulk_write(requests, ordered=True)
+        return saved_items
+
     @staticmethod
     def timeclause(start=None, end=None):
         """
@@ -2,7 +2,12 @@
 version_state.py
 Writes to MongoDB Collection:
 """
+import hashlib
+import json
 import logging
+import multiprocessing
+import signal
+import time
 from functools import reduce
 
 
@@ -11,14 +16,30 @@ logger = logging.getLogger(__name__)
 from . import abstract as abst
 from . import text
 from . import link
-from .text import VersionSet, AbstractIndex, AbstractSchemaContent, IndexSet, library, Ref
+from .text import Version, VersionSet, AbstractIndex, AbstractSchemaContent, IndexSet, library, Ref
 from sefaria.datatype.jagged_array import JaggedTextArray, JaggedIntArray
+from sefaria.datatype.offset_table import OffsetTable
 from sefaria.system.exceptions import InputError, BookNameError
-from sefaria.system.cache import delete_template_cache
+from sefaria.system.cache import delete_template_cache, LRUCache
+from sefaria.system.database import reconnect
+from sefaria.system.multiserver.coordinator import server_coordinator
 try:
     from sefaria.settings import USE_VARNISH
 except ImportError:
     USE_VARNISH = False
+try:
+    from sefaria.settings import MULTISERVER_ENABLED
+except ImportError:
+    MULTISERVER_ENABLED = False
+try:
+    from sefaria.settings import OFFSET_TABLE_CACHE_MAX_ENTRIES
+except ImportError:
+    OFFSET_TABLE_CACHE_MAX_ENTRIES = 5000
+try:
+    from sefaria.settings import VSTATE_REFRESH_WORKERS, VSTATE_REFRESH_TIMEOUT
+except ImportError:
+    VSTATE_REFRESH_WORKERS = 1
+    VSTATE_REFRESH_TIMEOUT = 600
 '''
 old count docs were:
     c["allVersionCounts"]
@@ -91,7 +112,9 @@ class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
     optional_attrs = [
         "flags",
         "linksCount",
-        "first_section_ref"
+        "first_section_ref",
+        "structure",     # digest of the content nodes of the Index, as counted
+        "contributors",  # list of {"language", "versionTitle", "lastModified", "masks": digest of the version's mask at each content node}
     ]
 
     langs = ["en", "he"]
@@ -138,12 +161,19 @@ class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
         c.update(self.index.contents())
         return c
 
-    def _load_versions(self):
+    def _load_versions(self, snodes=None):
+        """
+        :param snodes: If given, load only the content of these content nodes
+        """
+        proj = None
+        if snodes is not None:
+            proj = {"language": 1, "versionTitle": 1}
+            proj.update({".".join([Version.content_attr] + snode.version_address()): 1 for snode in snodes})
         for lang in self.langs:
-            self._versions[lang] = [v for v in VersionSet({"title": self.index.title, "language": lang})]
+            self._versions[lang] = [v for v in VersionSet({"title": self.index.title, "language": lang}, proj=proj)]
 
     def versions(self, lang):
-        if not self._versions.get(lang):
+        if lang not in self._versions:
             self._load_versions()
         return self._versions.get(lang)
 
@@ -172,19 +202,111 @@ class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
         d["toSections"] = d["sections"] = [(s + 1) for s in new_section[:-depth_up]]
         return Ref(_obj=d)
 
-    def refresh(self):
+    def refresh(self, force=False):
+        """
+        Brings the counts up to date with the versions of the Index.
+
+        Versions are compared with the ones recorded in `contributors` by their `lastModified` time.  Only versions added,
+        removed, or modified since the last refresh are loaded, to find the content nodes at which their mask changed.
+        Only those nodes are counted again, loading just their content from every version.
+        Everything is counted again if `force`, or if the content nodes of the Index have changed.
+        Versions written around :meth:`Version.save` go unnoticed, so refresh with `force` after such writes.
+
+        :return: True if any counts were recomputed
+        """
         if self.is_new_state:  # refresh done on init
-            return
-        self.content = self.index.nodes.visit_content(self._content_node_visitor, self.content)
+            return True
+        self._versions = {}
+        self._masks = {}  # (lang, versionTitle) -> {version address: mask digest}, for versions counted
+        leaves = self._content_leaves()
+        structure = self._digest([[leaf.version_address(), leaf.depth, getattr(leaf, "lengths", None)] for leaf in leaves])
+        current = {(v.language, v.versionTitle): getattr(v, "lastModified", None)
+                   for v in VersionSet({"title": self.index.title, "language": {"$in": self.langs}},
+                                      proj={"language": 1, "versionTitle": 1, "lastModified": 1})}
+        known = {(c["language"], c["versionTitle"]): c for c in getattr(self, "contributors", None) or []}
+
+        if force or structure != getattr(self, "structure", None) or getattr(self, "contributors", None) is None:
+            dirty = None
+            self.content = self.index.nodes.visit_content(self._content_node_visitor, self.content)
+        else:
+            dirty = self._dirty_leaves(leaves, current, known)
+            if dirty:
+                self._load_versions([leaves[i] for i in dirty])
+                for i in dirty:
+                    self._content_node_visitor(leaves[i], self.content_node(leaves[i]))
+
+        self.structure = structure
+        contributors = self._contributors(leaves, current, known)
+        links_count = link.LinkSet(Ref(self.index.title)).count()
+        if dirty is not None and not dirty:
+            if contributors != getattr(self, "contributors", None) or links_count != getattr(self, "linksCount", None):
+                self.contributors = contributors
+                self.linksCount = links_count
+                self.save()
+            return False
+
+        self.contributors = contributors
         self.index.nodes.visit_structure(self._aggregate_structure_state, self)
-        self.linksCount = link.LinkSet(Ref(self.index.title)).count()
+        self.linksCount = links_count
         fsr = self._first_section_ref()
         self.first_section_ref = fsr.normal() if fsr else None
         self.save()
 
+        offset_tables.rebuild(self)
+        if MULTISERVER_ENABLED:
+            server_coordinator.publish_event("version_state", "invalidate_offset_tables", [self.title])
+
         if USE_VARNISH:
             from sefaria.system.varnish.wrapper import invalidate_counts
             invalidate_counts(self.index)
+        return True
+
+    def _content_leaves(self):
+        """
+        :return: the content nodes of the Index, in order
+        """
+        leaves = []
+        self.index.nodes.create_content(lambda n: leaves.append(n))
+        return leaves
+
+    @staticmethod
+    def _digest(obj):
+        return hashlib.md5(json.dumps(obj, separators=(",", ":")).encode("utf-8")).hexdigest()[:16]
+
+    def _dirty_leaves(self, leaves, current, known):
+        """
+        Loads the versions added or modified since the last refresh, and compares their masks with the recorded ones.
+        :return: sorted list of the positions in `leaves` of the content nodes whose counts need to be recomputed
+        """
+        empty = self._digest([])
+        dirty = set()
+        for key, old in known.items():
+            if key not in current:
+                dirty |= {i for i, digest in enumerate(old["masks"]) if digest != empty}
+        for (lang, vtitle), modified in current.items():
+            old = known.get((lang, vtitle))
+            if old and old["lastModified"] == modified:
+                continue
+            version = Version().load({"title": self.index.title, "language": lang, "versionTitle": vtitle})
+            for i, leaf in enumerate(leaves):
+                digest = self._digest(JaggedTextArray(version.content_node(leaf)).mask().array())
+                if digest != (old["masks"][i] if old else empty):
+                    dirty.add(i)
+        return sorted(dirty)
+
+    def _contributors(self, leaves, current, known):
+        empty = self._digest([])
+        contributors = []
+        for (lang, vtitle), modified in sorted(current.items()):
+            counted = self._masks.get((lang, vtitle), {})
+            old_masks = known[(lang, vtitle)]["masks"] if (lang, vtitle) in known else [empty] * len(leaves)
+            contributors.append({
+                "language": lang,
+                "versionTitle": vtitle,
+                "lastModified": modified,
+                "masks": [counted.get(tuple(leaf.version_address()), old_masks[i]) for i, leaf in enumerate(leaves)],
+            })
+        return contributors
 
     def get_flag(self, flag):
         return self.flags.get(flag, False) # consider all flags False until set True
@@ -299,6 +421,7 @@ class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
             raw_text_ja = version.content_node(snode)
             ja = JaggedTextArray(raw_text_ja)
             mask = ja.mask()
+            self._masks.setdefault((lang, version.versionTitle), {})[tuple(snode.version_address())] = self._digest(mask.array())
             counts = counts + mask
 
         return counts
@@ -471,25 +594,130 @@ class StateNode(object):
         return en[unit]
 
 
-def refresh_all_states():
-    indices = IndexSet()
+class OffsetTableCache(object):
+    """
+    Per-process cache of an :class:`OffsetTable` for each JaggedArrayNode, built from the "all" availableTexts of its
+    VersionState, so that numbering and navigating segments needs neither the state document nor a walk of its arrays.
+    Held per Index title, bounded by least recent use.
+    The tables of an Index are rebuilt by :meth:`VersionState.refresh`, which has other processes drop theirs through
+    the multiserver coordinator.
+    """
 
-    for index in indices:
-        logger.debug("Rebuilding state for {}".format(index.title))
-        try:
-            VersionState(index).refresh()
-        except Exception as e:
-            logger.warning("Got exception rebuilding state for {}: {}".format(index.title, e))
+    def __init__(self, max_entries=None):
+        self._cache = LRUCache(max_entries)
+
+    def get(self, snode):
+        """
+        :param snode: JaggedArrayNode
+        :return: OffsetTable
+        """
+        tables = self._cache.get(snode.index.title)
+        if tables is None:
+            tables = {}
+            self._cache.set(snode.index.title, tables)
+        key = tuple(snode.version_address())
+        table = tables.get(key)
+        if table is None:
+            counts = StateNode(snode=snode, hint=[("all", "availableTexts")]).var("all", "availableTexts")
+            table = tables[key] = OffsetTable(counts, snode.depth)
+        return table
+
+    def rebuild(self, vstate):
+        tables = {}
+        for leaf in vstate.index.nodes.get_leaf_nodes():
+            if leaf.is_virtual:
+                continue
+            counts = vstate.state_node(leaf).var("all", "availableTexts")
+            tables[tuple(leaf.version_address())] = OffsetTable(counts, leaf.depth)
+        self._cache.set(vstate.title, tables)
+
+    def invalidate(self, title):
+        self._cache.pop(title)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+offset_tables = OffsetTableCache(OFFSET_TABLE_CACHE_MAX_ENTRIES)
+
+
+def invalidate_offset_tables(title):
+    offset_tables.invalidate(title)
+
+
+def refresh_all_states(force=False, workers=None, timeout=None):
+    """
+    Refreshes the VersionState of every Index, skipping those whose versions haven't changed unless `force`,
+    and rebuilds the TOC once at the end.
+
+    With more than one of `workers` (default VSTATE_REFRESH_WORKERS), Indexes are refreshed by a pool of processes, each
+    Index given up after `timeout` seconds (default VSTATE_REFRESH_TIMEOUT).
+    :return: report dict with the titles recomputed, the number unchanged, and the error of each Index that failed
+    """
+    workers = workers or VSTATE_REFRESH_WORKERS
+    timeout = timeout or VSTATE_REFRESH_TIMEOUT
+    start = time.time()
+    titles = [index.title for index in IndexSet()]
+    report = {"recomputed": [], "unchanged": 0, "failed": {}}
+
+    def record(result):
+        title, recomputed, error = result
+        if error:
+            logger.warning("Got exception rebuilding state for {}: {}".format(title, error))
+            report["failed"][title] = error
+        elif recomputed:
+            report["recomputed"].append(title)
+        else:
+            report["unchanged"] += 1
+
+    if workers > 1:
+        with multiprocessing.get_context("fork").Pool(workers, initializer=reconnect) as pool:
+            for result in pool.imap_unordered(_refresh_state_worker, [(title, force, timeout) for title in titles]):
+                record(result)
+        for title in report["recomputed"]:
+            invalidate_offset_tables(title)  # rebuilt in the workers
+    else:
+        for title in titles:
+            record(_refresh_state_worker((title, force, None)))
 
     library.rebuild_toc()
+    report["seconds"] = round(time.time() - start, 2)
+    logger.info("Refreshed states: {} recomputed, {} unchanged, {} failed, in {} seconds".format(
+        len(report["recomputed"]), report["unchanged"], len(report["failed"]), report["seconds"]))
+    return report
+
+
+def _refresh_state_worker(args):
+    """
+    :param args: (title, force, timeout in seconds or None).  The timeout uses SIGALRM, so is only set in pool workers.
+    :return: (title, whether counts were recomputed, error message or None)
+    """
+    title, force, timeout = args
+    logger.debug("Rebuilding state for {}".format(title))
+
+    def on_timeout(signum, frame):
+        raise TimeoutError("Timed out after {} seconds".format(timeout))
+
+    if timeout:
+        signal.signal(signal.SIGALRM, on_timeout)
+        signal.alarm(int(timeout))
+    try:
+        return title, VersionState(title).refresh(force=force), None
+    except Exception as e:
+        return title, None, "{}: {}".format(e.__class__.__name__, e)
+    finally:
+        if timeout:
+            signal.alarm(0)
 
 
 def process_index_delete_in_version_state(indx, **kwargs):
     from sefaria.system.database import db
     db.vstate.delete_one({"title": indx.title})
+    invalidate_offset_tables(indx.title)
 
 def process_index_title_change_in_version_state(indx, **kwargs):
     VersionStateSet({"title": kwargs["old"]}).update({"title": kwargs["new"]})
+    invalidate_offset_tables(kwargs["old"])
 
 
 def create_version_state_on_index_creation(indx, **kwargs):
@@ -1,9 +1,14 @@
 # coding=utf-8
 from urllib.parse import urlparse
 import regex as re
+import os
+import atexit
+import threading
 from datetime import datetime
 from collections import defaultdict
 
+from pymongo import UpdateOne
+
 from . import abstract as abst
 from . import text
 from sefaria.system.database import db
@@ -11,6 +16,12 @@ from sefaria.system.database import db
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+    from sefaria.settings import WEBPAGE_HIT_FLUSH_INTERVAL, WEBPAGE_HIT_BUFFER_MAX_ENTRIES
+except ImportError:
+    WEBPAGE_HIT_FLUSH_INTERVAL = 30
+    WEBPAGE_HIT_BUFFER_MAX_ENTRIES = 10000
+
 
 class WebPage(abst.AbstractMongoRecord):
     collection = 'webpages'
@@ -114,10 +125,14 @@ class WebPage(abst.AbstractMongoRecord):
 
     @staticmethod
     def add_or_update_from_linker(data):
-        webpage = WebPage().load(data["url"]) or WebPage(data)
-        if webpage.should_be_excluded():
+        """
+        Records a hit on the linker from the page described by `data`.
+        Hits are merged per page in `webpage_hit_buffer` and written in bulk, so no database access happens here.
+        """
+        url = WebPage.normalize_url(data["url"])
+        if re.match(WebPage.excluded_pages_url_regex(), url) or re.match(WebPage.excluded_pages_title_regex(), data.get("title", "")):
             return
-        webpage.update_from_linker(data)
+        webpage_hit_buffer.add(url, data)
 
     def client_contents(self):
         d = self.contents()
@@ -167,6 +182,118 @@ class WebPageSet(abst.AbstractMongoSet):
     recordClass = WebPage
 
 
+class WebPageHitBuffer(object):
+    """
+    Merges linker hits per normalized URL, and writes them with a single bulk upsert every `flush_interval` seconds,
+    from a background thread.  For each page, the data of the latest hit is kept, along with the number of hits.
+
+    At most `max_entries` pages are held.  Once full, a flush is started, and, until it takes what is held,
+    hits on pages not already held are dropped.  What is held is flushed at exit.
+    With a `flush_interval` of 0, every hit is written as it is added.
+    Without a `background` thread, hits are only written by `flush()`.
+    """
+    def __init__(self, flush_interval=30, max_entries=10000, background=True):
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.background = background
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._lock = threading.Condition()
+        self._hits = {}     # normalized url -> [data of latest hit, number of hits, time of latest hit]
+        self._full = False
+        self._thread = None
+        self._pid = os.getpid()
+
+        self.flushed_hits = 0
+        self.dropped_hits = 0
+        self.failed_hits = 0
+
+    def add(self, url, data):
+        if self._pid != os.getpid():
+            # Forked.  What is held will be written by the parent.
+            self._reset()
+        with self._lock:
+            entry = self._hits.get(url)
+            if entry:
+                entry[0] = data
+                entry[1] += 1
+                entry[2] = datetime.now()
+            elif len(self._hits) < self.max_entries:
+                self._hits[url] = [data, 1, datetime.now()]
+            else:
+                self.dropped_hits += 1
+            if len(self._hits) >= self.max_entries:
+                self._full = True
+                self._lock.notify()
+        if not self.flush_interval:
+            self.flush()
+        elif self.background and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run, name="webpage-hits")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def flush(self):
+        """
+        Writes the hits held with a single bulk write.
+        :return: The number of pages written
+        """
+        with self._lock:
+            hits, self._hits = self._hits, {}
+            self._full = False
+        if not hits:
+            return 0
+
+        requests = []
+        for url, (data, count, last_updated) in hits.items():
+            webpage = WebPage(data)
+            webpage.url = url
+            webpage.lastUpdated = last_updated
+            try:
+                webpage._normalize()
+                webpage._validate()
+            except Exception as e:
+                logger.warning("Bad linker data for {}: {}".format(url, e))
+                self.failed_hits += count
+                continue
+            updates = webpage._saveable_attrs()
+            for attr in ("_id", "url", "linkerHits"):
+                updates.pop(attr, None)
+            requests.append(UpdateOne({"url": url}, {"$set": updates, "$inc": {"linkerHits": count}}, upsert=True))
+            self.flushed_hits += count
+
+        if requests:
+            try:
+                db.webpages.bulk_write(requests, ordered=False)
+            except Exception:
+                logger.exception("Failed to write {} webpages from linker hits".format(len(requests)))
+        return len(requests)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered_pages": len(self._hits),
+                "buffered_hits": sum(entry[1] for entry in self._hits.values()),
+                "flushed_hits": self.flushed_hits,
+                "dropped_hits": self.dropped_hits,
+                "failed_hits": self.failed_hits,
+            }
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._full:
+                    self._lock.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush linker hits")
+
+
+webpage_hit_buffer = WebPageHitBuffer(WEBPAGE_HIT_FLUSH_INTERVAL, WEBPAGE_HIT_BUFFER_MAX_ENTRIES)
+
+
 def get_webpages_for_ref(tref):
     oref = text.Ref(tref)
     regex_list = oref.regex(as_list=True)
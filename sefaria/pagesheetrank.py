@@ -2,29 +2,38 @@
 #source: http://michaelnielsen.org/blog/using-your-laptop-to-compute-pagerank-for-millions-of-webpages/
 
 import re
+import os
 import math
+import hashlib
 import numpy
 import random
 import json
 import time
+from array import array
 from pymongo.errors import AutoReconnect
 from collections import defaultdict, OrderedDict
 from sefaria.model import *
 from sefaria.system.exceptions import InputError, NoVersionFoundError
-from sefaria.system.database import db
+from sefaria.system.database import db, reconnect
 from .settings import STATICFILES_DIRS
 from functools import reduce
 
+PAGERANK_LINK_BATCH_SIZE = 10000
+
 class web:
-  def __init__(self,n):
+  '''A weighted link graph of n pages, held as parallel arrays of edges.
+  An edge (src[i], dst[i], weight[i]) means that page src[i] links to page dst[i].
+  As when each in-link was listed int(round(weight)) times, an edge passes on round(weight) shares of its
+  source page's rank, out of the sum of the unrounded weights of the page's edges.'''
+  def __init__(self, n, src=None, dst=None, weight=None):
     self.size = n
-    self.in_links = {}
-    self.number_out_links = {}
-    self.dangling_pages = {}
-    for j in range(n):
-      self.in_links[j] = []
-      self.number_out_links[j] = 0
-      self.dangling_pages[j] = True
+    self.src = numpy.asarray(src if src is not None else [], dtype=numpy.int64)
+    self.dst = numpy.asarray(dst if dst is not None else [], dtype=numpy.int64)
+    self.weight = numpy.asarray(weight if weight is not None else numpy.ones(len(self.src)), dtype=numpy.float64)
+    self.number_out_links = numpy.bincount(self.src, weights=self.weight, minlength=n)
+    self.dangling_pages = numpy.bincount(self.src, minlength=n) == 0
+    # Each edge's share of its source page's rank, i.e. the nonzero entries of the transition matrix
+    self.transition = numpy.round(self.weight) / numpy.where(self.number_out_links == 0, 1.0, self.number_out_links)[self.src]
 
 def paretosample(n,power=2.0):
   '''Returns a sample from a truncated Pareto distribution
@@ -41,15 +50,13 @@ def random_web(n=1000,power=2.0):
   variables with a shifted and truncated Pareto
   probability mass function p(l) proportional to
   1/(l+1)^power.'''
-  g = web(n)
+  src, dst = [], []
   for k in range(n):
     lk = paretosample(n+1,power)-1
     values = random.sample(range(n),lk)
-    g.in_links[k] = values
-    for j in values:
-      if g.number_out_links[j] == 0: g.dangling_pages.pop(j)
-      g.number_out_links[j] += 1
-  return g
+    src += values
+    dst += [k]*lk
+  return web(n, src, dst)
 
 
 def create_empty_nodes(g):
@@ -61,17 +68,16 @@ def create_empty_nodes(g):
 
 
 def create_web(g):
-  n = len(g)
-  w = web(n)
+  '''g is a list of (page, {linking page: weight}) tuples'''
   node2index = {r:i for i, r in enumerate([x[0] for x in g])}
-  for i, (r, links) in enumerate(g):
+  src, dst, weight = [], [], []
+  for r, links in g:
     r_ind = node2index[r]
-    link_inds = [(node2index[r_temp], count) for r_temp, count in list(links.items())]
-    w.in_links[r_ind] = reduce(lambda a, b: a + [b[0]]*int(round(b[1])), link_inds, [])
-    for j, count in link_inds:
-      if w.number_out_links[j] == 0: w.dangling_pages.pop(j)
-      w.number_out_links[j] += count
-  return w
+    for r_temp, count in links.items():
+      src.append(node2index[r_temp])
+      dst.append(r_ind)
+      weight.append(count)
+  return web(len(g), src, dst, weight)
 
 def step(w,p,s=0.85):
   '''Performs a single step in the PageRank computation,
@@ -79,20 +85,61 @@ def step(w,p,s=0.85):
   matrix to the vector p, and returns the resulting
   vector.'''
   n = w.size
-  v = numpy.matrix(numpy.zeros((n,1)))
-  inner_product = sum([p[j] for j in list(w.dangling_pages.keys())])
-  for j in range(n):
-    v[j] = s*sum([p[k]/w.number_out_links[k]
-    for k in w.in_links[j]])+s*inner_product/n+(1-s)/n
+  inner_product = p[w.dangling_pages].sum()
+  v = s*numpy.bincount(w.dst, weights=w.transition*p[w.src], minlength=n) + s*inner_product/n + (1-s)/n
   # We rescale the return vector, so it remains a
   # probability distribution even with floating point
   # roundoff.
   return v/numpy.sum(v)
 
-def pagerank(g,s=0.85,tolerance=0.00001, maxiter=100, verbose=False):
-  w = create_web(g)
+def initial_vector(n, nodes=None, warm_start=None):
+  '''Returns the starting distribution for n pages.  Uniform, unless warm_start,
+  a dict of page to previous rank, is given, in which case previous ranks are kept
+  and new pages start at the average rank.'''
+  if not warm_start or nodes is None:
+    return numpy.ones(n)/n
+  p = numpy.array([warm_start.get(r, numpy.nan) for r in nodes], dtype=numpy.float64)
+  known = ~numpy.isnan(p)
+  if not known.any():
+    return numpy.ones(n)/n
+  p[~known] = p[known].mean()
+  return p/numpy.sum(p)
+
+def _checkpoint_key(nodes, w):
+  h = hashlib.md5("\n".join(nodes).encode("utf-8"))
+  for a in (w.src, w.dst, w.weight):
+    h.update(numpy.ascontiguousarray(a).tobytes())
+  return h.hexdigest()
+
+def load_checkpoint(path, nodes, w):
+  '''Returns the vector saved at path, if it was saved for the same list of nodes and the same edges of web w.  Otherwise None'''
+  if not path or not os.path.exists(path):
+    return None
+  saved = numpy.load(path)
+  if str(saved["key"]) != _checkpoint_key(nodes, w):
+    print("Ignoring pagerank checkpoint at {} from a different graph".format(path))
+    return None
+  return saved["p"]
+
+def save_checkpoint(path, nodes, w, p):
+  tmp_path = path + ".tmp.npz"
+  numpy.savez(tmp_path, p=p, key=_checkpoint_key(nodes, w))
+  os.replace(tmp_path, path)
+
+def pagerank(g,s=0.85,tolerance=0.00001, maxiter=100, verbose=False, warm_start=None, checkpoint_path=None, checkpoint_every=10):
+  '''g is a list of (page, {linking page: weight}) tuples.
+  warm_start is an optional dict of page to previous rank, from which iteration starts.
+  If checkpoint_path is given, the vector is saved there every checkpoint_every iterations,
+  and a run over the same graph picks up from it.'''
+  nodes = [x[0] for x in g]
+  return rank_web(create_web(g), nodes, s, tolerance, maxiter, verbose, warm_start, checkpoint_path, checkpoint_every)
+
+def rank_web(w,nodes,s=0.85,tolerance=0.00001, maxiter=100, verbose=False, warm_start=None, checkpoint_path=None, checkpoint_every=10):
+  '''Computes the PageRank of web w, whose pages are named by the list nodes.  See pagerank() for the other parameters'''
   n = w.size
-  p = numpy.matrix(numpy.ones((n,1)))/n
+  p = load_checkpoint(checkpoint_path, nodes, w)
+  if p is None:
+    p = initial_vector(n, nodes, warm_start)
   iteration = 1
   change = 2
   while change > tolerance and iteration < maxiter:
@@ -101,124 +148,293 @@ def pagerank(g,s=0.85,tolerance=0.00001, maxiter=100, verbose=False):
     change = numpy.sum(numpy.abs(p-new_p))
     if verbose: print("Change in l1 norm: %s" % change)
     p = new_p
+    if checkpoint_path and iteration % checkpoint_every == 0:
+      save_checkpoint(checkpoint_path, nodes, w, p)
     iteration += 1
-  pr_list = list(numpy.squeeze(numpy.asarray(p)))
-  return {k:v for k,v in zip([x[0] for x in g], pr_list)}
+  return {k:v for k,v in zip(nodes, p.tolist())}
 
 
-def init_pagerank_graph():
+def iter_raw_links(min_id=None, max_id=None, batch_size=PAGERANK_LINK_BATCH_SIZE):
     """
-    :return: graph which is a double dict. the keys of both dicts are refs. the values are the number of incoming links
-    between outer key and inner key
+    Yields the raw records, with only `refs`, of links with min_id <= _id < max_id.
+    Walks the _id index from where the last batch ended, so that reading the whole collection is linear in its size.
     """
-    tanach_indexes = library.get_indexes_in_category("Tanakh")
-    def is_tanach(r):
-        return r.index.title in tanach_indexes
+    last_id = None
+    while True:
+        id_query = {}
+        if last_id is not None:
+            id_query["$gt"] = last_id
+        elif min_id is not None:
+            id_query["$gte"] = min_id
+        if max_id is not None:
+            id_query["$lt"] = max_id
+        batch = list(db.links.find({"_id": id_query} if id_query else {}, {"refs": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return
+        for link in batch:
+            yield link
+        last_id = batch[-1]["_id"]
 
-    def recursively_put_in_graph(ref1, ref2, weight=1.0):
-        if ref1.is_section_level():
-            return  # ignore section level
-            seg_refs = ref1.all_segment_refs()
-            for ref1_seg in seg_refs:
-                recursively_put_in_graph(ref1_seg, ref2, weight / len(seg_refs))
-        elif ref2.is_section_level():
+
+def link_id_boundaries(num_shards):
+    """
+    :return: list of num_shards + 1 link _ids splitting the links collection into shards of about equal size.
+    The first and last are None, meaning unbounded.
+    """
+    count = db.links.count_documents({})
+    boundaries = [None]
+    for i in range(1, num_shards):
+        first = list(db.links.find({}, {"_id": 1}).sort("_id", 1).skip(i * count // num_shards).limit(1))
+        if first and (boundaries[-1] is None or first[0]["_id"] > boundaries[-1]):
+            boundaries.append(first[0]["_id"])
+    boundaries.append(None)
+    return boundaries
+
+
+def links_signature():
+    """
+    :return: The number of links and the _id of the last one added, stored with a graph by `build_pagerank_graph`.
+    Links have no modification times, so a link edited in place is not detected.
+    """
+    last = db.links.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return "{}:{}".format(db.links.count_documents({}), last["_id"] if last else None)
+
+
+def _pack_strings(strings):
+    return numpy.frombuffer("\n".join(strings).encode("utf-8"), dtype=numpy.uint8)
+
+
+def _unpack_strings(packed):
+    return packed.tobytes().decode("utf-8").split("\n") if len(packed) else []
+
+
+class PagerankGraphBuilder(object):
+    """
+    Accumulates the link graph as an edge list.  An edge (src, dst, weight) means that the newer ref src links to the older ref dst.
+    Nodes are numbered in the order they are first seen.
+    """
+    def __init__(self):
+        self.nodes = []
+        self.node_ids = {}
+        self.src = array('l')
+        self.dst = array('l')
+        self.weight = array('d')
+        self.ref_cats = defaultdict(set)  # node id -> categories of the refs linked to it
+        self._start_years = {}
+        self._tanach_indexes = set(library.get_indexes_in_category("Tanakh"))
+
+    def node_id(self, tref):
+        nid = self.node_ids.get(tref)
+        if nid is None:
+            nid = self.node_ids[tref] = len(self.nodes)
+            self.nodes.append(tref)
+        return nid
+
+    def start_year(self, index):
+        """
+        :return: the start year of the best time period of index, or 3000 if it has none.  Memoized per index.
+        """
+        year = self._start_years.get(index.title)
+        if year is None:
+            tp = index.best_time_period()
+            year = self._start_years[index.title] = int(tp.start) if tp else 3000
+        return year
+
+    def add_link(self, trefs):
+        #TODO pagerank segments except Talmud. Talmud is pageranked by section
+        #TODO if you see a section link, add pagerank to all of its segments
+        refs = [Ref(r) for r in trefs]
+        start1 = self.start_year(refs[0].index)
+        start2 = self.start_year(refs[1].index)
+
+        older_ref, newer_ref = (refs[0], refs[1]) if start1 < start2 else (refs[1], refs[0])
+
+        older_ref = older_ref.padded_ref()
+        newer_ref = newer_ref.padded_ref()
+        if start1 == start2:
+            # randomly switch refs that are equally dated
+            older_ref, newer_ref = (older_ref, newer_ref) if random.choice([True, False]) else (newer_ref, older_ref)
+        self._add_refs(older_ref, newer_ref)
+
+    def _add_refs(self, ref1, ref2, weight=1.0):
+        if ref1.is_section_level() or ref2.is_section_level():
             return  # ignore section level
-            seg_refs = ref2.all_segment_refs()
-            for ref2_seg in seg_refs:
-                recursively_put_in_graph(ref1, ref2_seg, weight / len(seg_refs))
         elif ref1.is_range():
             for ref1_seg in ref1.range_list():
                 if ref2.is_range():
                     for ref2_seg in ref2.range_list():
-                        recursively_put_in_graph(ref1_seg, ref2_seg)
+                        self._add_refs(ref1_seg, ref2_seg)
                 else:
-                    recursively_put_in_graph(ref1_seg, ref2)
+                    self._add_refs(ref1_seg, ref2)
         else:
-            put_link_in_graph(ref1, ref2, weight)
-
-    def put_link_in_graph(ref1, ref2, weight=1.0):
-        str1 = ref1.normal()
-        str2 = ref2.normal()
-        if str1 not in all_ref_cat_counts:
-            all_ref_cat_counts[str1] = set()
-        if str2 not in all_ref_cat_counts:
-            all_ref_cat_counts[str2] = set()
-        #not a typo. add the cat of ref2 to ref1
-        all_ref_cat_counts[str1].add(ref2.primary_category)
-        all_ref_cat_counts[str2].add(ref1.primary_category)
-
-        if str1 not in graph:
-            graph[str1] = {}
+            self._add_edge(ref1, ref2, weight)
 
+    def _add_edge(self, ref1, ref2, weight=1.0):
+        id1 = self.node_id(ref1.normal())
+        id2 = self.node_id(ref2.normal())
+        #not a typo. add the cat of ref2 to ref1
+        self.ref_cats[id1].add(ref2.primary_category)
+        self.ref_cats[id2].add(ref1.primary_category)
 
-        if str2 == str1 or (is_tanach(ref1) and is_tanach(ref2)):
+        if id1 == id2 or (ref1.index.title in self._tanach_indexes and ref2.index.title in self._tanach_indexes):
             # self link
             return
-
-        if str2 not in graph[str1]:
-            graph[str1][str2] = 0
-        graph[str1][str2] += weight
-
-    graph = OrderedDict()
-    all_links = LinkSet()  # LinkSet({"type": re.compile(ur"(commentary|quotation)")}).array()
-    len_all_links = all_links.count()
-    all_ref_cat_counts = {}
-    current_link, page, link_limit = 0, 0, 100000
-    all_links = LinkSet(limit=link_limit, page=page)
-
-
-    while len(all_links.array()) > 0:
-        for link in all_links:  # raw records avoids caching the entire LinkSet into memory
-            if current_link % 1000 == 0:
-                print("{}/{}".format(current_link, len_all_links))
-
+        self.src.append(id2)
+        self.dst.append(id1)
+        self.weight.append(weight)
+
+    def add_links(self, links, total=None):
+        for i, link in enumerate(links):
+            if i % 10000 == 0:
+                print("{}/{}".format(i, total if total is not None else "?"))
             try:
-                #TODO pagerank segments except Talmud. Talmud is pageranked by section
-                #TODO if you see a section link, add pagerank to all of its segments
-                refs = [Ref(r) for r in link.refs]
-                tp1 = refs[0].index.best_time_period()
-                tp2 = refs[1].index.best_time_period()
-                start1 = int(tp1.start) if tp1 else 3000
-                start2 = int(tp2.start) if tp2 else 3000
-
-                older_ref, newer_ref = (refs[0], refs[1]) if start1 < start2 else (refs[1], refs[0])
-
-                temp_links = []
-                older_ref = older_ref.padded_ref()
-                newer_ref = newer_ref.padded_ref()
-                if start1 == start2:
-                    # randomly switch refs that are equally dated
-                    older_ref, newer_ref = (older_ref, newer_ref) if random.choice([True, False]) else (newer_ref, older_ref)
-                recursively_put_in_graph(older_ref, newer_ref)
-
-            except InputError:
-                pass
-            except TypeError as e:
-                print("TypeError")
-                print(link.refs)
-            except IndexError:
+                self.add_link(link["refs"])
+            except (InputError, IndexError, AssertionError):
                 pass
-            except AssertionError:
-                pass
-            except ValueError:
-                print("ValueError")
-                print(link.refs)
-                pass
-            current_link += 1
+            except (TypeError, ValueError) as e:
+                print("{}: {}".format(e.__class__.__name__, link.get("refs")))
+
+    def save(self, path):
+        cat_nodes, cats = [], []
+        for nid, node_cats in self.ref_cats.items():
+            for cat in node_cats:
+                if cat is not None:
+                    cat_nodes.append(nid)
+                    cats.append(cat)
+        # Written through a file object, as numpy.savez adds ".npz" to a path that lacks it
+        with open(path, "wb") as f:
+            numpy.savez(f,
+                        nodes=_pack_strings(self.nodes),
+                        src=numpy.array(self.src, dtype=numpy.int_),
+                        dst=numpy.array(self.dst, dtype=numpy.int_),
+                        weight=numpy.array(self.weight, dtype=numpy.float64),
+                        cat_nodes=numpy.array(cat_nodes, dtype=numpy.int_),
+                        cats=_pack_strings(cats))
+
+
+def _build_pagerank_graph_shard(shard):
+    min_id, max_id, path = shard
+    builder = PagerankGraphBuilder()
+    builder.add_links(iter_raw_links(min_id, max_id))
+    builder.save(path)
+    return path
+
+
+def build_pagerank_graph(path, workers=None, num_shards=None):
+    """
+    Reads every link and writes the link graph, as numpy arrays of node ids and weights, in .npz format to exactly `path`.
+    The links are split into shards by _id, which are read by `workers` processes (default: one per cpu).
+    Load the result with `load_pagerank_graph`.  The `links_signature()` of the links read is stored with it.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+
+    signature = links_signature()
+    workers = workers or os.cpu_count() or 1
+    num_shards = num_shards or workers * 4
+    boundaries = link_id_boundaries(num_shards)
+    tmp_dir = tempfile.mkdtemp(prefix="pagerank_graph_")
+    try:
+        shards = [(boundaries[i], boundaries[i + 1], os.path.join(tmp_dir, "shard_{}.npz".format(i))) for i in range(len(boundaries) - 1)]
+        if workers == 1:
+            shard_paths = [_build_pagerank_graph_shard(shard) for shard in shards]
+        else:
+            # forked workers inherit the library, but MongoClient is not fork-safe: each opens its own
+            with multiprocessing.get_context("fork").Pool(workers, initializer=reconnect) as pool:
+                shard_paths = pool.map(_build_pagerank_graph_shard, shards, chunksize=1)
+        _merge_pagerank_graph_shards(shard_paths, path, signature)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _merge_pagerank_graph_shards(shard_paths, path, signature=""):
+    nodes, node_ids = [], {}
+    src, dst, weight, cat_nodes, cats = [], [], [], [], []
+    for shard_path in shard_paths:
+        shard = numpy.load(shard_path)
+        shard_nodes = _unpack_strings(shard["nodes"])
+        global_ids = numpy.empty(len(shard_nodes), dtype=numpy.int_)
+        for i, tref in enumerate(shard_nodes):
+            nid = node_ids.get(tref)
+            if nid is None:
+                nid = node_ids[tref] = len(nodes)
+                nodes.append(tref)
+            global_ids[i] = nid
+        src.append(global_ids[shard["src"]])
+        dst.append(global_ids[shard["dst"]])
+        weight.append(shard["weight"])
+        cat_nodes.append(global_ids[shard["cat_nodes"]])
+        cats += _unpack_strings(shard["cats"])
+    with open(path, "wb") as f:
+        numpy.savez(f,
+                    nodes=_pack_strings(nodes),
+                    src=numpy.concatenate(src) if src else numpy.zeros(0, dtype=numpy.int_),
+                    dst=numpy.concatenate(dst) if dst else numpy.zeros(0, dtype=numpy.int_),
+                    weight=numpy.concatenate(weight) if weight else numpy.zeros(0),
+                    cat_nodes=numpy.concatenate(cat_nodes) if cat_nodes else numpy.zeros(0, dtype=numpy.int_),
+                    cats=_pack_strings(cats),
+                    signature=signature)
+
+
+def pagerank_graph_signature(path):
+    """
+    :return: The `links_signature()` of the links the graph at `path` was built from, or None for a graph saved without one
+    """
+    graph = numpy.load(path)
+    return str(graph["signature"]) if "signature" in graph.files else None
 
-        page += 1
-        all_links = LinkSet(limit=link_limit, page=page)
 
-    for ref in all_ref_cat_counts:
-        if ref not in graph:
-            graph[ref] = {}
+def load_pagerank_graph(path):
+    """
+    :return: (nodes, src, dst, weight, ref_cat_counts) as written by `build_pagerank_graph`.
+    nodes is the list of trefs, named by their position.  ref_cat_counts is a dict of tref to the set of categories linked to it.
+    """
+    graph = numpy.load(path)
+    nodes = _unpack_strings(graph["nodes"])
+    ref_cat_counts = defaultdict(set)
+    for nid, cat in zip(graph["cat_nodes"].tolist(), _unpack_strings(graph["cats"])):
+        ref_cat_counts[nodes[nid]].add(cat)
+    return nodes, graph["src"], graph["dst"], graph["weight"], ref_cat_counts
+
 
+def init_pagerank_graph(workers=None):
+    """
+    :return: graph which is a double dict. the keys of both dicts are refs. the values are the number of incoming links
+    between outer key and inner key
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "pagerank_graph.npz")
+        build_pagerank_graph(path, workers)
+        nodes, src, dst, weight, all_ref_cat_counts = load_pagerank_graph(path)
+
+    graph = OrderedDict((tref, {}) for tref in nodes)
+    for s, d, w in zip(src.tolist(), dst.tolist(), weight.tolist()):
+        older = graph[nodes[d]]
+        older[nodes[s]] = older.get(nodes[s], 0) + w
     return graph, all_ref_cat_counts
 
-def calculate_pagerank():
-    graph, all_ref_cat_counts = init_pagerank_graph()
-    #json.dump(graph.items(), open("{}pagerank_graph3.json".format(STATICFILES_DIRS[0]), "wb"))
-    ranked = pagerank(list(graph.items()), 0.85, verbose=True, tolerance=0.00005)
+def get_previous_pagerank():
+    """
+    :return: dict of tref to the raw pagerank stored by the last run of `update_pagesheetrank`
+    """
+    return {d["ref"]: d["pagerank"] for d in db.ref_data.find({"pagerank": {"$exists": True}}, {"ref": 1, "pagerank": 1, "_id": 0})}
+
+
+def calculate_pagerank(warm_start=True, checkpoint_path=None, graph_path=None, workers=None):
+    """
+    :param graph_path: path of a graph file written by `build_pagerank_graph`.  It is reused if it was built from the
+        links as they are now, by `links_signature()`.  Otherwise, the graph is built and saved there.
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = graph_path or os.path.join(tmp_dir, "pagerank_graph.npz")
+        if not os.path.exists(path) or pagerank_graph_signature(path) != links_signature():
+            build_pagerank_graph(path, workers)
+        nodes, src, dst, weight, all_ref_cat_counts = load_pagerank_graph(path)
+    previous = get_previous_pagerank() if warm_start else None
+    ranked = rank_web(web(len(nodes), src, dst, weight), nodes, 0.85, verbose=True, tolerance=0.00005, warm_start=previous, checkpoint_path=checkpoint_path)
     sorted_ranking = sorted(list(dict(ranked).items()), key=lambda x: x[1])
     count = 0
     smallest_pr = sorted_ranking[0][1]
@@ -230,8 +446,8 @@ def calculate_pagerank():
     pagerank_dict = {tref: pr for tref, pr in sorted_ranking}
     return pagerank_dict
 
-def update_pagesheetrank():
-    pagerank = calculate_pagerank()
+def update_pagesheetrank(warm_start=True, checkpoint_path=None, graph_path=None, workers=None):
+    pagerank = calculate_pagerank(warm_start, checkpoint_path, graph_path, workers)
     sheetrank = calculate_sheetrank()
     pagesheetrank = {}
     all_trefs = set(list(pagerank.keys()) + list(sheetrank.keys()))
@@ -241,7 +457,8 @@ def update_pagesheetrank():
         pagesheetrank[tref] = temp_pagerank_scaled * temp_sheetrank_scaled
     from pymongo import UpdateOne
     result = db.ref_data.bulk_write([
-        UpdateOne({"ref": tref}, {"$set": {"pagesheetrank": psr}}, upsert=True) for tref, psr in list(pagesheetrank.items())
+        UpdateOne({"ref": tref}, {"$set": dict({"pagesheetrank": psr}, **({"pagerank": pagerank[tref]} if tref in pagerank else {}))}, upsert=True)
+        for tref, psr in list(pagesheetrank.items())
     ])
 
 def cat_bonus(num_cats):
@@ -266,7 +483,7 @@ def test_pagerank(a,b):
         },
         "c": {}
     }
-    ranked = pagerank(g, a, verbose=True, tolerance=b)
+    ranked = pagerank(list(g.items()), a, verbose=True, tolerance=b)
     print(ranked)
 
 
@@ -17,8 +17,10 @@ os.environ['DJANGO_SETTINGS_MODULE'] = "settings"
 import logging
 import json
 import math
+import multiprocessing
+import tempfile
 from logging import NullHandler
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import time as pytime
 logger = logging.getLogger(__name__)
 
@@ -29,10 +31,14 @@ from elasticsearch.exceptions import NotFoundError
 from sefaria.model import *
 from sefaria.model.text import AbstractIndex
 from sefaria.model.user_profile import user_link, public_user_data
-from sefaria.system.database import db
+from sefaria.system.database import db, reconnect
 from sefaria.system.exceptions import InputError
 from sefaria.utils.util import strip_tags
 from .settings import SEARCH_ADMIN, SEARCH_INDEX_NAME_TEXT, SEARCH_INDEX_NAME_SHEET, SEARCH_INDEX_NAME_MERGED, STATICFILES_DIRS
+try:
+    from .settings import SEARCH_INDEX_WORKERS
+except ImportError:
+    SEARCH_INDEX_WORKERS = 1
 from sefaria.site.site_settings import SITE_SETTINGS
 from sefaria.utils.hebrew import hebrew_term
 from sefaria.utils.hebrew import strip_cantillation
@@ -390,6 +396,8 @@ def put_sheet_mapping(index_name):
 
 
 class TextIndexer(object):
+    bulk_chunk_size = 1000  # number of documents sent to ES in each bulk request
+    worker_max_titles = 100  # number of texts a worker process indexes before it is replaced, to keep memory flat
 
     @classmethod
     def clear_cache(cls):
@@ -398,6 +406,8 @@ class TextIndexer(object):
         cls.trefs_seen = None
         cls._bulk_actions = None
         cls.best_time_period = None
+        cls._pagesheetranks = None
+        cls._node_title_variants = {}
 
 
     @classmethod
@@ -470,45 +480,145 @@ class TextIndexer(object):
                 raise e
 
     @classmethod
-    def index_all(cls, index_name, merged=False, debug=False, for_es=True, action=None):
+    def get_version_work_list(cls):
+        """
+        Reads the metadata, but not the content, of every version in the version priority map.
+        :return: list of (index title, [(lang, [version titles, in priority order]), ...])
+        """
+        versions = [v for v in db.texts.find({}, {"title": 1, "versionTitle": 1, "language": 1, "_id": 0}).sort([("priority", -1), ("_id", 1)])
+                    if (v.get("title"), v.get("versionTitle"), v.get("language")) in cls.version_priority_map]
+        versions.sort(key=lambda v: cls.version_priority_map[(v["title"], v["versionTitle"], v["language"])][0])
+        by_title = OrderedDict()
+        for v in versions:
+            by_title.setdefault(v["title"], OrderedDict()).setdefault(v["language"], []).append(v["versionTitle"])
+        return [(title, list(langs.items())) for title, langs in by_title.items()]
+
+    @staticmethod
+    def load_version(title, lang, version_title, tries=0):
+        try:
+            return Version().load({"title": title, "language": lang, "versionTitle": version_title})
+        except pymongo.errors.AutoReconnect as e:
+            if tries < 200:
+                pytime.sleep(5)
+                return TextIndexer.load_version(title, lang, version_title, tries+1)
+            else:
+                print("load_version -- Tried: {} times. Failed :(".format(tries))
+                raise e
+
+    @staticmethod
+    def read_checkpoint(checkpoint_path):
+        """
+        :return: set of the titles recorded as indexed in the checkpoint file
+        """
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return set()
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    @staticmethod
+    def write_checkpoint(checkpoint_path, title):
+        if not checkpoint_path:
+            return
+        with open(checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(title + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def index_all(cls, index_name, merged=False, debug=False, for_es=True, action=None, workers=None, checkpoint_path=None):
+        """
+        Indexes every version in the version priority map, one text at a time.
+        :param workers: number of processes indexing texts in parallel.  Default: SEARCH_INDEX_WORKERS.
+            Only used when indexing to ES with the default action.
+        :param checkpoint_path: file in which each indexed text is recorded.  Texts already recorded there are skipped,
+            so that an interrupted run can be resumed.
+        """
         cls.index_name = index_name
         cls.merged = merged
+        cls.for_es = for_es
         cls.create_version_priority_map()
         cls.create_terms_dict()
         Ref.clear_cache()  # try to clear Ref cache to save RAM
 
-        versions = sorted([x for x in cls.get_all_versions() if (x.title, x.versionTitle, x.language) in cls.version_priority_map], key=lambda x: cls.version_priority_map[(x.title, x.versionTitle, x.language)][0])
-        versions_by_index = {}
-        # organizing by index for the merged case
-        for v in versions:
-            key = (v.title, v.language)
-            if key in versions_by_index:
-                versions_by_index[key] += [v]
-            else:
-                versions_by_index[key] = [v]
-        print("Beginning index of {} versions.".format(len(versions)))
-        vcount = 0
-        total_versions = len(versions)
-        versions = None  # release RAM
-        for title, vlist in list(versions_by_index.items()):
+        work = cls.get_version_work_list()
+        done = cls.read_checkpoint(checkpoint_path)
+        if done:
+            print("Resuming. Skipping {} texts already indexed.".format(len(done)))
+            work = [w for w in work if w[0] not in done]
+        total_titles = len(work)
+        print("Beginning index of {} versions of {} texts.".format(sum(len(vtitles) for _, vlists in work for _, vtitles in vlists), total_titles))
+
+        workers = workers or SEARCH_INDEX_WORKERS
+        if workers > 1 and for_es and action is None:
+            with multiprocessing.get_context("fork").Pool(workers, initializer=_init_text_indexer_worker, maxtasksperchild=cls.worker_max_titles) as pool:
+                for i, title in enumerate(pool.imap_unordered(_index_title_worker, work)):
+                    cls.write_checkpoint(checkpoint_path, title)
+                    print("Indexed {} ({}/{})".format(title, i + 1, total_titles))
+        else:
+            for i, (title, version_lists) in enumerate(work):
+                cls.index_title(title, version_lists, action=action)
+                cls.write_checkpoint(checkpoint_path, title)
+                print("Indexed {} ({}/{})".format(title, i + 1, total_titles))
+
+    @classmethod
+    def index_title(cls, title, version_lists, action=None):
+        """
+        Indexes the versions of one text, loading them one at a time.
+        :param version_lists: list of (lang, [version titles, in priority order])
+        """
+        cls.curr_index = library.get_index(title)
+        cls._node_title_variants = {}
+        if cls.for_es:
+            cls._bulk_actions = []
+            try:
+                cls.best_time_period = cls.curr_index.best_time_period()
+            except ValueError:
+                cls.best_time_period = None
+            cls.prefetch_pagesheetranks(title)
+        for lang, version_titles in version_lists:
             cls.trefs_seen = set()
-            cls.curr_index = vlist[0].get_index() if len(vlist) > 0 else None
-            if for_es:
-                cls._bulk_actions = []
-                try:
-                    cls.best_time_period = cls.curr_index.best_time_period()
-                except ValueError:
-                    cls.best_time_period = None
-            for v in vlist:
-                if v.versionTitle == "Yehoyesh's Yiddish Tanakh Translation [yi]":
+            for version_title in version_titles:
+                if version_title == "Yehoyesh's Yiddish Tanakh Translation [yi]":
                     print("skipping yiddish. we don't like yiddish")
                     continue
-
+                v = cls.load_version(title, lang, version_title)
+                if v is None:
+                    continue
                 cls.index_version(v, action=action)
-                print("Indexed Version {}/{}".format(vcount, total_versions))
-                vcount += 1
-            if for_es:
-                bulk(es_client, cls._bulk_actions, stats_only=True, raise_on_error=False)
+        if cls.for_es:
+            cls.flush_bulk_actions()
+        cls._pagesheetranks = None
+        Ref.clear_cache()
+
+    @classmethod
+    def prefetch_pagesheetranks(cls, title):
+        """
+        Loads the pagesheetrank of every ref in text `title` (and of some refs of texts whose titles begin with it) in one query.
+        """
+        cls._pagesheetranks = {
+            d["ref"]: d["pagesheetrank"] for d in db.ref_data.find({"ref": {"$regex": "^" + re.escape(title)}}, {"ref": 1, "pagesheetrank": 1, "_id": 0})
+        }
+
+    @classmethod
+    def flush_bulk_actions(cls):
+        if cls._bulk_actions:
+            bulk(es_client, cls._bulk_actions, stats_only=True, raise_on_error=False)
+        cls._bulk_actions = []
+
+    @classmethod
+    def get_title_variants(cls, oref):
+        """
+        :return: the English titles of the schema node of oref, as in TextFamily.contents()["titleVariants"].  Memoized per node.
+        """
+        if oref.has_default_child():
+            oref = oref.default_child_ref()
+        node = oref.index_node
+        if getattr(cls, "_node_title_variants", None) is None:
+            cls._node_title_variants = {}
+        variants = cls._node_title_variants.get(id(node))
+        if variants is None:
+            variants = cls._node_title_variants[id(node)] = node.all_tree_titles("en")
+        return variants
 
     @classmethod
     def index_version(cls, version, tries=0, action=None):
@@ -534,6 +644,7 @@ class TextIndexer(object):
         cls.merged = merged
         cls.index_name = index_name
         cls.curr_index = oref.index
+        cls._node_title_variants = {}
         try:
             cls.best_time_period = cls.curr_index.best_time_period()
         except ValueError:
@@ -579,6 +690,8 @@ class TextIndexer(object):
                         "_source": doc
                     }
                 ]
+                if len(cls._bulk_actions) >= cls.bulk_chunk_size:
+                    cls.flush_bulk_actions()
             except Exception as e:
                 logger.error("ERROR indexing {} / {} / {} : {}".format(tref, vtitle, vlang, e))
 
@@ -588,7 +701,6 @@ class TextIndexer(object):
         Create a document for indexing from the text specified by ref/version/lang
         """
         oref = Ref(tref)
-        text = TextFamily(oref, context=0, commentary=False, version=version, lang=lang).contents()
 
         if not content:
             # Don't bother indexing if there's no content
@@ -600,8 +712,9 @@ class TextIndexer(object):
         if len(content_wo_cant) == 0:
             return False
 
-        if getattr(cls.curr_index, "dependence", None) == 'Commentary' and "Commentary" in text["categories"]:  # uch, special casing
-            temp_categories = text["categories"][:]
+        index_categories = oref.index.categories
+        if getattr(cls.curr_index, "dependence", None) == 'Commentary' and "Commentary" in index_categories:  # uch, special casing
+            temp_categories = index_categories[:]
             temp_categories.remove('Commentary')
             temp_categories[0] += " Commentaries"  # this will create an additional bucket for each top level category's commentary
         else:
@@ -615,8 +728,11 @@ class TextIndexer(object):
 
         # section_ref = tref[:tref.rfind(u":")] if u":" in tref else (tref[:re.search(ur" \d+$", tref).start()] if re.search(ur" \d+$", tref) is not None else tref)
 
-        ref_data = RefData().load({"ref": tref})
-        pagesheetrank = ref_data.pagesheetrank if ref_data is not None else RefData.DEFAULT_PAGERANK * RefData.DEFAULT_SHEETRANK
+        if getattr(cls, "_pagesheetranks", None) is not None:
+            pagesheetrank = cls._pagesheetranks.get(tref, RefData.DEFAULT_PAGERANK * RefData.DEFAULT_SHEETRANK)
+        else:
+            ref_data = RefData().load({"ref": tref})
+            pagesheetrank = ref_data.pagesheetrank if ref_data is not None else RefData.DEFAULT_PAGERANK * RefData.DEFAULT_SHEETRANK
 
         return {
             "ref": tref,
@@ -624,7 +740,7 @@ class TextIndexer(object):
             "version": version,
             "lang": lang,
             "version_priority": version_priority if version_priority is not None else 1000,
-            "titleVariants": text["titleVariants"],
+            "titleVariants": cls.get_title_variants(oref),
             "categories": temp_categories,
             "order": oref.order_id(),
             "path": "/".join(temp_categories + [cls.curr_index.title]),
@@ -637,6 +753,19 @@ class TextIndexer(object):
         }
 
 
+def _init_text_indexer_worker():
+    # connections to ES and Mongo shouldn't be shared with the parent process
+    global es_client
+    es_client = Elasticsearch(SEARCH_ADMIN)
+    reconnect()
+
+
+def _index_title_worker(work_item):
+    title, version_lists = work_item
+    TextIndexer.index_title(title, version_lists)
+    return title
+
+
 def index_sheets_by_timestamp(timestamp):
     """
     :param timestamp str: index all sheets modified after `timestamp` (in isoformat)
@@ -768,20 +897,21 @@ def get_new_and_current_index_names(type, debug=False):
     return {"new": new_index_name, "current": old_index_name, "alias": alias_name}
 
 
-def index_all(skip=0, merged=False, debug=False):
+def index_all(skip=0, merged=False, debug=False, workers=None):
     """
     Fully create the search index from scratch.
+    Pass skip=1 to resume a text index that was interrupted, rather than starting a new one.
     """
     start = datetime.now()
     if merged:
-        index_all_of_type('merged', skip=skip, merged=merged, debug=debug)
+        index_all_of_type('merged', skip=skip, merged=merged, debug=debug, workers=workers)
     else:
-        index_all_of_type('text', skip=skip, merged=merged, debug=debug)
+        index_all_of_type('text', skip=skip, merged=merged, debug=debug, workers=workers)
         index_all_of_type('sheet', skip=skip, merged=merged, debug=debug)
     end = datetime.now()
     print("Elapsed time: %s" % str(end-start))
 
-def index_all_of_type(type, skip=0, merged=False, debug=False):
+def index_all_of_type(type, skip=0, merged=False, debug=False, workers=None):
     index_names_dict = get_new_and_current_index_names(type=type, debug=debug)
     print('CREATING / DELETING {}'.format(index_names_dict['new']))
     print('CURRENT {}'.format(index_names_dict['current']))
@@ -789,11 +919,16 @@ def index_all_of_type(type, skip=0, merged=False, debug=False):
         print('STARTING IN T-MINUS {}'.format(10 - i))
         pytime.sleep(1)
 
+    checkpoint_path = os.path.join(tempfile.gettempdir(), "sefaria-search-{}.checkpoint".format(index_names_dict['new']))
     if skip == 0:
         create_index(index_names_dict['new'], type)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
     if type == 'text' or type == 'merged':
         TextIndexer.clear_cache()
-        TextIndexer.index_all(index_names_dict['new'], merged=merged, debug=debug)
+        TextIndexer.index_all(index_names_dict['new'], merged=merged, debug=debug, workers=workers, checkpoint_path=checkpoint_path)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
     elif type == 'sheet':
         index_public_sheets(index_names_dict['new'])
 
@@ -17,7 +17,7 @@ from sefaria.system.database import db
 from sefaria.model.notification import Notification, NotificationSet
 from sefaria.model.following import FollowersSet
 from sefaria.model.user_profile import UserProfile, annotate_user_list, public_user_data, user_link
-from sefaria.model.group import Group
+from sefaria.model.group import Group, GroupSet
 from sefaria.model.story import UserStory, UserStorySet
 from sefaria.utils.util import strip_tags, string_overlap, titlecase
 from sefaria.system.exceptions import InputError
@@ -25,6 +25,10 @@ from pymongo.errors import DuplicateKeyError
 from sefaria.system.cache import django_cache
 from .history import record_sheet_publication, delete_sheet_publication
 from .settings import SEARCH_INDEX_ON_SAVE
+try:
+	from .settings import USE_SHEET_INTERVALS
+except ImportError:
+	USE_SHEET_INTERVALS = False
 from . import search
 import sys
 import hashlib
@@ -420,6 +424,7 @@ def save_sheet(sheet, user_id, search_override=False, rebuild_nodes=False):
 							}).delete()
 
 	sheet["includedRefs"] = refs_in_sources(sheet.get("sources", []))
+	sheet["includedRefIntervals"] = ref_intervals(sheet["includedRefs"])
 
 	if rebuild_nodes:
 		sheet = rebuild_sheet_nodes(sheet)
@@ -546,6 +551,20 @@ def refs_in_sources(sources, refine_refs=False):
 	return refs
 
 
+def ref_intervals(refs):
+	"""
+	Returns the intervals of `refs`, as returned by Ref.order_interval(), for lookup with Ref.interval_query().
+	Refs that don't parse are skipped.
+	"""
+	intervals = []
+	for ref in refs:
+		try:
+			intervals.append(model.Ref(ref).order_interval())
+		except (InputError, KeyError, IndexError):
+			continue
+	return intervals
+
+
 def refine_ref_by_text(ref, text):
 	"""
 	Returns a ref (string) which refines 'ref' (string) by comparing 'text' (string),
@@ -603,7 +622,7 @@ def update_included_refs(query=None, hours=None, refine_refs=False):
 	for sheet in sheets:
 		sources = sheet.get("sources", [])
 		refs = refs_in_sources(sources, refine_refs=refine_refs)
-		db.sheets.update({"_id": sheet["_id"]}, {"$set": {"includedRefs": refs}})
+		db.sheets.update({"_id": sheet["_id"]}, {"$set": {"includedRefs": refs, "includedRefIntervals": ref_intervals(refs)}})
 
 
 def get_top_sheets(limit=3):
@@ -622,10 +641,23 @@ def get_sheets_for_ref(tref, uid=None, in_group=None):
 	If `uid` is present return user sheets, otherwise return public sheets.
 	If `in_group` (list) is present, only return sheets in one of the listed groups.
 	"""
-	oref = model.Ref(tref)
+	return get_sheets_for_refs([tref], uid=uid, in_group=in_group)[tref]
+
+
+def get_sheets_for_refs(trefs, uid=None, in_group=None):
+	"""
+	Returns a dictionary mapping each of `trefs` to its list of sheets, as returned by `get_sheets_for_ref`.
+	Finds the sheets of all `trefs` with a single query, and their owners and groups with one query each.
+	"""
+	if not trefs:
+		return {}
+	orefs = {tref: model.Ref(tref) for tref in trefs}
 	# perform initial search with context to catch ranges that include a segment ref
-	regex_list = oref.context_ref().regex(as_list=True)
-	ref_clauses = [{"includedRefs": {"$regex": r}} for r in regex_list]
+	regex_lists = {tref: oref.context_ref().regex(as_list=True) for tref, oref in orefs.items()}
+	if USE_SHEET_INTERVALS:
+		ref_clauses = [oref.context_ref().interval_query(field="includedRefIntervals") for oref in orefs.values()]
+	else:
+		ref_clauses = [{"includedRefs": {"$regex": r}} for regex_list in regex_lists.values() for r in regex_list]
 	query = {"$or": ref_clauses }
 	if uid:
 		query["owner"] = uid
@@ -644,7 +676,16 @@ def get_sheets_for_ref(tref, uid=None, in_group=None):
 	for profile in user_profiles:
 		user_profiles[profile]["slug"] = mongo_user_profiles[profile]["slug"]
 		user_profiles[profile]["profile_pic_url_small"] = mongo_user_profiles[profile].get("profile_pic_url_small", '')
+	group_names = list(set([s["group"] for s in sheets if "group" in s]))
+	groups = {group.name: group for group in GroupSet({"name": {"$in": group_names}})} if group_names else {}
+
+	return {tref: _sheets_for_ref(oref, regex_lists[tref], sheets, user_profiles, groups) for tref, oref in orefs.items()}
 
+
+def _sheets_for_ref(oref, regex_list, sheets, user_profiles, groups):
+	"""
+	Returns the sheets among `sheets` that include `oref`, in client format.
+	"""
 	ref_re = "("+'|'.join(regex_list)+")"
 	results = []
 	for sheet in sheets:
@@ -672,7 +713,7 @@ def get_sheets_for_ref(tref, uid=None, in_group=None):
 				sheet["viaOwnerProfileUrl"] = viaOwnerData["profileUrl"]
 
 			if "group" in sheet:
-				group = Group().load({"name": sheet["group"]})
+				group = groups.get(sheet["group"])
 				sheet["groupLogo"]       = getattr(group, "imageUrl", None)
 				sheet["groupTOC"]        = getattr(group, "toc", None)
 
@@ -898,6 +939,7 @@ class Sheet(abstract.AbstractMongoRecord):
 		"generatedBy",  # this had been required, but it's not always there.
 		"is_featured",  # boolean - show this sheet, unsolicited.
 		"includedRefs",
+		"includedRefIntervals",  # list of dicts corresponding to `includedRefs`, each of the form returned by Ref.order_interval()
 		"views",
 		"nextNode",
 		"tags",
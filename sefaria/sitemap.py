@@ -2,21 +2,135 @@
 sitemap.py - generate sitemaps of all available texts for search engines.
 
 Outputs sitemaps and sitemapindex to the first entry of STATICFILES_DIRS by default, a custom directory can be supplied.
+Sitemaps are gzipped XML files of at most 40,000 URLs each.  URLs are streamed from the database into them, so memory
+use doesn't grow with the number of URLs.  A file is only rewritten when its content has changed since the last run,
+as recorded in sitemap_manifest.json, so that unchanged files keep their modification dates.
 """
 import os, errno
+import gzip
+import hashlib
+import json
+import tempfile
 from datetime import datetime
+from functools import reduce
+from xml.sax.saxutils import escape
 
 from sefaria.model import *
+from sefaria.datatype.jagged_array import JaggedArray
 from sefaria.system.database import db
+from sefaria.system.exceptions import BookNameError
 from .settings import STATICFILES_DIRS, STATIC_URL
 
+import logging
+logger = logging.getLogger(__name__)
 
-def chunks(l, n):
+
+def available_sections(counts, depth):
+    """
+    Yields the 0 based indexes of each section (array one level above the segments) of a VersionState availableTexts
+    array `counts` that has any text, in order.  Matches :meth:`JaggedArray.non_empty_sections`.
+    :param depth: depth of `counts`
+    """
+    if depth <= 1:
+        if _has_text(counts):
+            yield []
+        return
+    for i, sub in enumerate(counts):
+        if isinstance(sub, list):
+            for rest in available_sections(sub, depth - 1):
+                yield [i] + rest
+
+
+def _has_text(counts):
+    if isinstance(counts, list):
+        return any(_has_text(c) for c in counts)
+    return bool(counts)
+
+
+def section_url(snode, sections):
+    """
+    :param sections: 1 based sections
+    :return: the same as Ref.url() of `sections` in `snode`, without making the Ref
+    """
+    url = snode.full_title("en")
+    if not sections:
+        return url.replace(" ", "_").replace(":", ".")
+    url = (url + " " + ":".join(snode.address_class(i).toStr("en", n) for i, n in enumerate(sections))).replace(" ", "_").replace(":", ".")
+    last = url.rfind("_")
+    return url[:last] + "." + url[last + 1:]
+
+
+class SitemapWriter(object):
     """
-    Yield successive n-sized chunks from l.
+    Writes URLs to gzipped XML sitemap files of at most `max_urls` URLs each, named `name` + number + ".xml.gz".
+    Each file is written to a temporary file while hashing its content, and replaces the existing file only if the hash
+    differs from the one in `manifest`, which maps file names to {"hash", "lastmod"}, and is updated in place.
     """
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+    header = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    footer = '</urlset>\n'
+
+    def __init__(self, directory, name, manifest, max_urls=40000):
+        self.directory = directory
+        self.name = name
+        self.manifest = manifest
+        self.max_urls = max_urls
+        self.filenames = []  # every file of this sitemap, changed or not
+        self.changed = []
+        self._file = None
+
+    def add(self, url, lastmod=None):
+        """
+        :param lastmod: W3C date (YYYY-MM-DD) of the last change to the page
+        """
+        if self._file is None:
+            self._open()
+        entry = "<url><loc>{}</loc>{}</url>\n".format(escape(url), "<lastmod>{}</lastmod>".format(lastmod) if lastmod else "")
+        self._write(entry)
+        self._count += 1
+        if self._count >= self.max_urls:
+            self._finish()
+
+    def close(self):
+        """
+        :return: names of every file of this sitemap
+        """
+        if self._file is not None or not self.filenames:
+            if self._file is None:
+                self._open()  # an empty sitemap, so that the index doesn't point at a missing file
+            self._finish()
+        return self.filenames
+
+    def _open(self):
+        self._raw = tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False)
+        # mtime=0 makes the output depend only on the content
+        self._file = gzip.GzipFile(filename="", mode="wb", fileobj=self._raw, mtime=0)
+        self._hash = hashlib.md5()
+        self._count = 0
+        self._write(self.header)
+
+    def _write(self, s):
+        data = s.encode("utf-8")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def _finish(self):
+        self._write(self.footer)
+        self._file.close()
+        self._raw.close()
+        self._file = None
+
+        filename = "{}{}.xml.gz".format(self.name, len(self.filenames))
+        path = os.path.join(self.directory, filename)
+        digest = self._hash.hexdigest()
+        old = self.manifest.get(filename)
+        if old and old["hash"] == digest and os.path.exists(path):
+            os.remove(self._raw.name)
+        else:
+            os.chmod(self._raw.name, 0o644)
+            os.replace(self._raw.name, path)
+            self.manifest[filename] = {"hash": digest, "lastmod": datetime.now().strftime("%Y-%m-%d")}
+            self.changed.append(filename)
+        self.filenames.append(filename)
 
 
 class SefariaSiteMapGenerator(object):
@@ -61,26 +175,67 @@ class SefariaSiteMapGenerator(object):
             self._interfaceLang = SefariaSiteMapGenerator.hostnames.get(hostSuffix).get("interfaceLang")
             self._hostname = SefariaSiteMapGenerator.hostnames.get(hostSuffix).get("hostname")
             self.output_directory = output_directory
-            path = self.output_directory + "sitemaps/" + self._interfaceLang
-            if not os.path.exists(path):
-                os.makedirs(path)
+            self._path = self.output_directory + "sitemaps/" + self._interfaceLang
+            if not os.path.exists(self._path):
+                os.makedirs(self._path)
+            self._manifest = self._load_manifest()
         else:
             raise KeyError("Illegal hostname for SiteMapGenerator")
 
-    def generate_texts_sitemaps(self):
+    def _manifest_path(self):
+        return self._path + "/sitemap_manifest.json"
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_manifest(self, filenames):
         """
-        Create sitemap for each text section for which content is available.
-        Returns the number of files written (each sitemap can have only 50k URLs)
+        Keeps only `filenames` in the manifest, and removes the files of earlier runs that are no longer written.
         """
-        refs = library.ref_list()
-        urls = [self._hostname + "/" + oref.url() for oref in refs]
-
-        maps = list(chunks(urls, 40000))
+        for filename in set(self._manifest) - set(filenames):
+            try:
+                os.remove(os.path.join(self._path, filename))
+            except OSError:
+                pass
+        self._manifest = {filename: self._manifest[filename] for filename in filenames}
+        with open(self._manifest_path(), "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2, sort_keys=True)
 
-        for n in range(len(maps)):
-            self.write_urls(maps[n], "texts-sitemap%d.txt" % n)
+    def text_section_urls(self):
+        """
+        Yields (url, lastmod) for each text section for which content is available, in order of book title.
+        Walks the availability in the VersionState documents one at a time, rather than making Refs.
+        lastmod is the date of the latest change to any version of the book.
+        """
+        lastmods = {d["_id"]: d["lastModified"][:10] for d in
+                    db.texts.aggregate([{"$group": {"_id": "$title", "lastModified": {"$max": "$lastModified"}}}])
+                    if d.get("lastModified")}
+        for vstate in db.vstate.find({}, {"title": 1, "content": 1}).sort("title", 1).batch_size(20):
+            try:
+                index = library.get_index(vstate["title"])
+            except BookNameError:
+                continue
+            lastmod = lastmods.get(index.title)
+            for snode in index.nodes.get_leaf_nodes():
+                if snode.is_virtual:
+                    continue
+                try:
+                    counts = reduce(lambda d, k: d[k], snode.version_address(), vstate["content"])["_all"]["availableTexts"]
+                    for indxs in available_sections(counts, JaggedArray(counts).get_depth()):
+                        yield self._hostname + "/" + section_url(snode, [a + 1 for a in indxs]), lastmod
+                except Exception as e:
+                    logger.warning("Failed to generate sitemap URLs for {}. {}".format(snode.full_title("en"), e))
 
-        return len(maps)
+    def generate_texts_sitemaps(self):
+        """
+        Create sitemaps of each text section for which content is available.
+        Returns the names of the files (each sitemap can have only 50k URLs)
+        """
+        return self.write_urls(self.text_section_urls(), "texts-sitemap")
 
     def generate_texts_toc_sitemap(self):
         """
@@ -88,7 +243,7 @@ class SefariaSiteMapGenerator(object):
         """
         titles = library.get_toc_tree().flatten()
         urls = [self._hostname + "/" + Ref(title).url() for title in titles]
-        self.write_urls(urls, "text-toc-sitemap.txt")
+        return self.write_urls(urls, "text-toc-sitemap")
 
     def generate_categories_sitemap(self):
         """
@@ -110,42 +265,44 @@ class SefariaSiteMapGenerator(object):
             return paths
         paths = cat_paths(toc)
         urls = [self._hostname + "/texts/" + p for p in paths]
-        self.write_urls(urls, "categories-sitemap.txt")
+        return self.write_urls(urls, "categories-sitemap")
 
     def generate_sheets_sitemap(self):
         """
-        Creates a sitemap for each public source sheet.
+        Creates sitemaps of each public source sheet, streamed in order of id, with its modification date.
         """
-        query = {"status": "public"}
-        public = db.sheets.find(query).distinct("id")
-        urls = [self._hostname + "/sheets/" + str(id) for id in public]
-
-        self.write_urls(urls, "sheets-sitemap.txt")
+        sheets = db.sheets.find({"status": "public"}, {"id": 1, "dateModified": 1, "_id": 0}).sort("id", 1)
+        urls = ((self._hostname + "/sheets/" + str(s["id"]), (s.get("dateModified") or "")[:10] or None) for s in sheets)
+        return self.write_urls(urls, "sheets-sitemap")
 
     def generate_people_sitemap(self):
         urls = [self._hostname + "/person/{}".format(p.key.replace(" ", "%20")) for p in PersonSet()]
-        self.write_urls(urls, "person-sitemap.txt")
+        return self.write_urls(urls, "person-sitemap")
 
     def generate_static_sitemap(self):
         """
         Creates a sitemap of static content listed above.
         """
-        self.write_urls([self._hostname + "/" + url for url in self.static_urls], "static-sitemap.txt")
+        return self.write_urls([self._hostname + "/" + url for url in self.static_urls], "static-sitemap")
 
 
-    def write_urls(self, urls, filename):
+    def write_urls(self, urls, name):
         """
-        Writes the list URLS, one per line, to filename.
+        Writes `urls`, an iterable of URLs or of (URL, lastmod) tuples, to the sitemap files `name`0.xml.gz, `name`1.xml.gz...
+        Returns the names of the files.
         """
-        out = self.output_directory + "sitemaps/" + self._interfaceLang + "/" + filename
-        f = open(out, 'w')
+        writer = SitemapWriter(self._path, name, self._manifest)
         for url in urls:
-            f.write(url.encode('utf-8') + "\n")
-        f.close()
+            if isinstance(url, tuple):
+                writer.add(*url)
+            else:
+                writer.add(url)
+        filenames = writer.close()
+        logger.info("{}: {} files, {} changed".format(name, len(filenames), len(writer.changed)))
+        return filenames
 
 
     def generate_sitemap_index(self, sitemaps):
-        now = datetime.now().strftime("%Y-%m-%d")
         xml = ""
         for m in sitemaps:
             xml += """
@@ -153,7 +310,7 @@ class SefariaSiteMapGenerator(object):
                   <loc>%s%ssitemaps/%s/%s</loc>
                   <lastmod>%s</lastmod>
                </sitemap>
-               """ % (self._hostname, STATIC_URL, self._interfaceLang, m, now)
+               """ % (self._hostname, STATIC_URL, self._interfaceLang, m, self._manifest[m]["lastmod"])
 
         sitemapindex = """<?xml version="1.0" encoding="UTF-8"?>
             <sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
@@ -171,14 +328,12 @@ class SefariaSiteMapGenerator(object):
         """
         Creates all sitemap files then creates and index file for all.
         """
-        self.generate_static_sitemap()
-        self.generate_sheets_sitemap()
-        self.generate_texts_toc_sitemap()
-        self.generate_categories_sitemap()
-        self.generate_people_sitemap()
-        n = self.generate_texts_sitemaps()
-
-        maps = ["static-sitemap.txt", "categories-sitemap.txt", "text-toc-sitemap.txt", "person-sitemap.txt", "sheets-sitemap.txt"]
-        maps += ["texts-sitemap%d.txt" % i for i in range(n)]
+        maps = self.generate_static_sitemap()
+        maps += self.generate_categories_sitemap()
+        maps += self.generate_texts_toc_sitemap()
+        maps += self.generate_people_sitemap()
+        maps += self.generate_sheets_sitemap()
+        maps += self.generate_texts_sitemaps()
 
+        self._save_manifest(maps)
         self.generate_sitemap_index(maps)
\ No newline at end of file
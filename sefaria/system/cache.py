@@ -1,6 +1,7 @@
 
 import hashlib
 import sys
+from collections import OrderedDict
 from functools import wraps
 from django.http import HttpRequest
 
@@ -120,3 +121,159 @@ def get_template_cache(fragment_name='', *args):
 
 def delete_template_cache(fragment_name='', *args):
     delete_cache_elem('template.cache.%s.%s' % (fragment_name, hashlib.md5(':'.join([arg for arg in args]).encode('utf-8')).hexdigest()))
+
+
+class LRUCache(object):
+    """
+    In-process mapping that holds at most `max_entries` items, evicting the least recently used.
+    `max_entries` of None means unbounded.
+    `on_evict`, if given, is called with (key, value) for every item evicted to make room.
+    """
+
+    def __init__(self, max_entries=None, on_evict=None):
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """
+        Returns the value at `key`, marking it as recently used.
+        """
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._touch(key)
+        return value
+
+    def peek(self, key, default=None):
+        """
+        Returns the value at `key` without touching its recency or the counters.
+        """
+        return self._items.get(key, default)
+
+    def set(self, key, value):
+        self._items[key] = value
+        self._touch(key)
+        self._evict()
+
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+
+    def items(self):
+        return list(self._items.items())
+
+    def values(self):
+        return list(self._items.values())
+
+    def clear(self):
+        self._items = OrderedDict()
+
+    def resize(self, max_entries):
+        self.max_entries = max_entries
+        self._evict()
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _touch(self, key):
+        self._items.move_to_end(key)
+
+    def _evict(self):
+        if self.max_entries is None:
+            return
+        while len(self) > self.max_entries:
+            key, value = self._pop_oldest()
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(key, value)
+
+    def _pop_oldest(self):
+        return self._items.popitem(last=False)
+
+
+class SegmentedLRUCache(LRUCache):
+    """
+    LRU with a probationary and a protected segment.
+    New items enter probation.  Items hit while in probation are promoted to the protected segment,
+    which holds at most `protected_ratio` of the entries.  Eviction takes from probation first,
+    so a burst of one-off keys (e.g. a full scan of a book) can't flush out the hot items.
+    """
+
+    def __init__(self, max_entries=None, on_evict=None, protected_ratio=0.8):
+        self.protected_ratio = protected_ratio
+        self._protected = OrderedDict()
+        super(SegmentedLRUCache, self).__init__(max_entries, on_evict)
+
+    def __len__(self):
+        return len(self._items) + len(self._protected)
+
+    def __contains__(self, key):
+        return key in self._items or key in self._protected
+
+    def get(self, key, default=None):
+        if key in self._protected:
+            self.hits += 1
+            self._protected.move_to_end(key)
+            return self._protected[key]
+        return super(SegmentedLRUCache, self).get(key, default)
+
+    def peek(self, key, default=None):
+        if key in self._protected:
+            return self._protected[key]
+        return self._items.get(key, default)
+
+    def set(self, key, value):
+        if key in self._protected:
+            self._protected[key] = value
+            self._protected.move_to_end(key)
+        else:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self._evict()
+
+    def pop(self, key, default=None):
+        if key in self._protected:
+            return self._protected.pop(key)
+        return self._items.pop(key, default)
+
+    def items(self):
+        return list(self._items.items()) + list(self._protected.items())
+
+    def values(self):
+        return list(self._items.values()) + list(self._protected.values())
+
+    def clear(self):
+        self._items = OrderedDict()
+        self._protected = OrderedDict()
+
+    def _touch(self, key):
+        # Called on a probationary hit: promote, and demote the oldest protected item if the segment is full
+        self._protected[key] = self._items.pop(key)
+        if self.max_entries is not None:
+            max_protected = int(self.max_entries * self.protected_ratio)
+            while len(self._protected) > max_protected:
+                old_key, old_value = self._protected.popitem(last=False)
+                self._items[old_key] = old_value
+
+    def _pop_oldest(self):
+        if self._items:
+            return self._items.popitem(last=False)
+        return self._protected.popitem(last=False)
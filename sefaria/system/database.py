@@ -28,6 +28,23 @@ else:
             db.authenticate(SEFARIA_DB_USER, SEFARIA_DB_PASSWORD)
 
 
+def reconnect():
+    """
+    Opens a new client, and rebinds `db`, here and in every module that imported it, to a database of that client.
+    MongoClient is not fork-safe: a process forked after `client` was created calls this before using the db,
+    e.g. as the `initializer` of a fork Pool.
+    """
+    global client, db
+    old_db = db
+    client = pymongo.MongoClient(MONGO_HOST, MONGO_PORT)
+    db = client[old_db.name]
+    if SEFARIA_DB_USER and SEFARIA_DB_PASSWORD:
+        db.authenticate(SEFARIA_DB_USER, SEFARIA_DB_PASSWORD)
+    for module in list(sys.modules.values()):
+        if getattr(module, "__dict__", {}).get("db") is old_db:
+            module.db = db
+
+
 def get_test_db():
     return client[TEST_DB]
 
@@ -54,6 +71,7 @@ def ensure_indices(active_db=None):
         ('history', ["revision"],{}),
         ('history', ["method"],{}),
         ('history', [[("ref", pymongo.ASCENDING), ("version", pymongo.ASCENDING), ("language", pymongo.ASCENDING)]],{}),
+        ('history', [[("ref", pymongo.ASCENDING), ("version", pymongo.ASCENDING), ("language", pymongo.ASCENDING), ("date", pymongo.ASCENDING)]],{}),
         ('history', ["date"],{}),
         ('history', ["ref"],{}),
         ('history', ["user"],{}),
@@ -71,6 +89,7 @@ def ensure_indices(active_db=None):
         ('links', ["refs.1"],{}),
         ('links', ["expandedRefs0"],{}),
         ('links', ["expandedRefs1"],{}),
+        ('links', [[("refIntervals.book", pymongo.ASCENDING), ("refIntervals.start", pymongo.ASCENDING), ("refIntervals.end", pymongo.ASCENDING)]],{}),
         ('links', ["source_text_oid"],{}),
         ('links', ["is_first_comment"],{}),
         ('metrics', ["timestamp"], {'unique': True}),
@@ -87,12 +106,15 @@ def ensure_indices(active_db=None):
         ('sheets', ["dateModified"],{}),
         ('sheets', ["sources.ref"],{}),
         ('sheets', ["includedRefs"],{}),
+        ('sheets', [[("includedRefIntervals.book", pymongo.ASCENDING), ("includedRefIntervals.start", pymongo.ASCENDING), ("includedRefIntervals.end", pymongo.ASCENDING)]],{}),
         ('sheets', ["tags"],{}),
         ('sheets', ["owner"],{}),
         ('sheets', ["assignment_id"],{}),
         ('sheets', ["is_featured"],{}),
         ('sheets', [[("views", pymongo.DESCENDING)]],{}),
         ('texts', ["title"],{}),
+        ('ref_data', ["ref"], {}),
+        ('merged_texts', [[("title", pymongo.ASCENDING), ("language", pymongo.ASCENDING)]], {"unique": True}),
         ('texts', [[("priority", pymongo.DESCENDING), ("_id", pymongo.ASCENDING)]],{}),
         ('texts', [[("versionTitle", pymongo.ASCENDING), ("langauge", pymongo.ASCENDING)]],{}),
         ('word_form', ["form"],{}),
@@ -110,7 +132,9 @@ def ensure_indices(active_db=None):
         ('user_history', [[("uid", pymongo.ASCENDING), ("book", pymongo.ASCENDING), ("last_place", pymongo.ASCENDING)]], {}),
         ('trend', ["name"],{}),
         ('trend', ["uid"],{}),
-        ('webpages', ["refs"],{})
+        ('vstate', ["title"],{}),
+        ('webpages', ["refs"],{}),
+        ('webpages', ["url"],{}),
     ]
 
     for col, args, kwargs in indices:
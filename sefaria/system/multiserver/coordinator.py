@@ -91,6 +91,7 @@ class ServerCoordinator(MessagingNode):
         import sefaria.system.cache as scache
         import sefaria.model.text as text
         import sefaria.model.topic as topic
+        import sefaria.model.version_state as version_state
 
         import socket
         import os
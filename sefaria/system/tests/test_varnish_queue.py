@@ -0,0 +1,145 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from sefaria.system.varnish.invalidation_queue import InvalidationQueue
+
+
+class FakeVarnish(object):
+    """
+    Records PURGE requests, failing the first `failures` of them with a 503.
+    """
+    def __init__(self, failures=0):
+        fake = self
+        self.purged = []
+        self.failures = failures
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_PURGE(self):
+                if fake.failures:
+                    fake.failures -= 1
+                    self.send_response(503)
+                else:
+                    fake.purged.append(self.headers["Host"] + self.path)
+                    self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def varnish():
+    v = FakeVarnish()
+    yield v
+    v.close()
+
+
+def make_queue(varnish, bans, **kwargs):
+    kwargs.setdefault("asynchronous", False)
+    return InvalidationQueue("127.0.0.1", varnish.port, bans.append, backoff=0.01, **kwargs)
+
+
+def test_purges_deduplicated(varnish):
+    bans = []
+    q = make_queue(varnish, bans)
+    for _ in range(3):
+        q.add_purge("http://sefaria.org/api/texts/Genesis.1")
+    q.add_purge("http://sefaria.org/api/texts/Genesis.1?commentary=0")
+    q.done()
+    assert varnish.purged == ["sefaria.org/api/texts/Genesis.1", "sefaria.org/api/texts/Genesis.1?commentary=0"]
+    stats = q.stats()
+    assert stats["added"] == 4
+    assert stats["sent"] == 2
+    assert stats["coalescing_ratio"] == 2
+    assert stats["queue_depth"] == 0
+
+
+def test_section_bans_merged(varnish):
+    bans = []
+    q = make_queue(varnish, bans, batch_size=2)
+    q.add_section_ban("Genesis", "Genesis(\\\\.1$|\\\\.1\\\\.)", "Genesis($|\\\\.)")
+    q.add_section_ban("Genesis", "Genesis(\\\\.2$|\\\\.2\\\\.)", "Genesis($|\\\\.)")
+    q.add_section_ban("Genesis", "Genesis(\\\\.1$|\\\\.1\\\\.)", "Genesis($|\\\\.)")
+    q.add_section_ban("Exodus", "Exodus(\\\\.3$|\\\\.3\\\\.)", "Exodus($|\\\\.)")
+    q.add_ban('obj.http.url ~ "/api/index/Genesis"')
+    q.done()
+    assert bans == [
+        'obj.http.url ~ "/api/(texts|links|related)/(Genesis(\\\\.1$|\\\\.1\\\\.)|Genesis(\\\\.2$|\\\\.2\\\\.))"',
+        'obj.http.url ~ "/api/(texts|links|related)/(Exodus(\\\\.3$|\\\\.3\\\\.))"',
+        'obj.http.url ~ "/api/index/Genesis"',
+    ]
+
+
+def test_book_ban_past_threshold(varnish):
+    bans = []
+    q = make_queue(varnish, bans, book_ban_threshold=3)
+    for i in range(1, 6):
+        q.add_section_ban("Genesis", "Genesis(\\\\.{0}$|\\\\.{0}\\\\.)".format(i), "Genesis($|\\\\.)")
+    q.done()
+    assert bans == ['obj.http.url ~ "/api/(texts|links|related)/(Genesis($|\\\\.))"']
+
+
+def test_retry():
+    varnish = FakeVarnish(failures=2)
+    try:
+        q = make_queue(varnish, [])
+        q.add_purge("http://sefaria.org/api/texts/Genesis.1")
+        q.done()
+        assert varnish.purged == ["sefaria.org/api/texts/Genesis.1"]
+        assert q.stats()["retries"] == 2
+        assert q.stats()["failed"] == 0
+    finally:
+        varnish.close()
+
+
+def test_failure_dropped():
+    bans = []
+
+    def failing_ban(expression):
+        bans.append(expression)
+        raise IOError("Varnish is down")
+
+    q = InvalidationQueue("127.0.0.1", 1, failing_ban, asynchronous=False, max_retries=2, backoff=0.01)
+    q.add_ban('obj.http.url ~ "/api/index/Genesis"')
+    q.done()
+    assert len(bans) == 3
+    assert q.stats()["failed"] == 1
+    assert q.stats()["queue_depth"] == 0
+
+
+def test_background_thread(varnish):
+    bans = []
+    q = make_queue(varnish, bans, asynchronous=True, flush_interval=0.05)
+    q.add_purge("http://sefaria.org/api/texts/Genesis.1", urgent=True)
+    q.add_ban('obj.http.url ~ "/api/index/Genesis"')
+    q.flush(timeout=5)
+    assert varnish.purged == ["sefaria.org/api/texts/Genesis.1"]
+    assert bans == ['obj.http.url ~ "/api/index/Genesis"']
+    assert q.stats()["queue_depth"] == 0
+
+
+def test_urgent_purges_sent_by_done(varnish):
+    bans = []
+    q = make_queue(varnish, bans, asynchronous=True, flush_interval=60)
+    q.add_purge("http://sefaria.org/api/texts/Genesis.1", urgent=True)
+    q.add_purge("http://sefaria.org/api/texts/Genesis.2")
+    q.add_ban('obj.http.url ~ "/api/index/Genesis"')
+    q.done()
+    # Sent in the calling thread, before done() returns.  The rest waits for the background thread.
+    assert varnish.purged == ["sefaria.org/api/texts/Genesis.1"]
+    assert bans == []
+    assert q.stats()["queue_depth"] == 2
+    q.flush(timeout=5)
+    assert varnish.purged == ["sefaria.org/api/texts/Genesis.1", "sefaria.org/api/texts/Genesis.2"]
+    assert bans == ['obj.http.url ~ "/api/index/Genesis"']
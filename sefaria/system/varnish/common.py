@@ -4,6 +4,12 @@ from http.client import HTTPConnection
 from sefaria.local_settings import VARNISH_ADM_ADDR, VARNISH_HOST, VARNISH_FRNT_PORT, VARNISH_SECRET, FRONT_END_URL
 
 from sefaria.utils.util import graceful_exception
+from .invalidation_queue import InvalidationQueue
+try:
+    from sefaria.settings import VARNISH_ASYNC_INVALIDATION, VARNISH_BOOK_BAN_THRESHOLD
+except ImportError:
+    VARNISH_ASYNC_INVALIDATION = True
+    VARNISH_BOOK_BAN_THRESHOLD = 20
 
 import logging
 logger = logging.getLogger(__name__)
@@ -13,6 +19,11 @@ with open (VARNISH_SECRET, "r") as sfile:
     secret=sfile.read().replace('\n', '')
 manager = VarnishManager((VARNISH_ADM_ADDR,), secret)
 
+invalidation_queue = InvalidationQueue(VARNISH_HOST, VARNISH_FRNT_PORT,
+                                       ban=lambda expression: manager.run("ban", expression, secret=secret),
+                                       asynchronous=VARNISH_ASYNC_INVALIDATION,
+                                       book_ban_threshold=VARNISH_BOOK_BAN_THRESHOLD)
+
 
 # PyPi version of python-varnish has broken purge function.  We use this instead.
 # Derived from https://github.com/justquick/python-varnish/blob/master/varnish.py
@@ -0,0 +1,255 @@
+"""
+invalidation_queue.py: collects Varnish purges and bans, merges them, and sends them in batches from a background thread
+
+Does not depend on core code or on the Varnish settings, so that it can be run against any server.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlparse
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class InvalidationQueue(object):
+    """
+    Holds three kinds of invalidation:
+        * purges - exact URLs, each sent as an HTTP PURGE request to the Varnish front end
+        * bans - Varnish ban expressions, each sent as is
+        * section bans - URL regexes of the sections of a book, as made by `wrapper.url_regex()`.
+          Each bans the /api/texts, /api/links and /api/related URLs under the section.  Up to `batch_size` of them are
+          sent as a single ban of their alternation.  Once more than `book_ban_threshold` sections of one book are waiting,
+          they are replaced with a ban of the whole book.
+    Duplicates are dropped while waiting.
+
+    When `asynchronous`, a background thread sends what has collected every `flush_interval` seconds, except for
+    urgent purges, which `done()` sends in the calling thread.  Otherwise, the caller sends everything with `done()`.
+    Failed requests are retried `max_retries` times, waiting `backoff` seconds, doubled on each retry.
+    """
+    SECTION_BAN = 'obj.http.url ~ "/api/(texts|links|related)/({})"'
+
+    def __init__(self, host, port, ban, asynchronous=True, batch_size=50, flush_interval=0.5, book_ban_threshold=20,
+                 max_retries=3, backoff=0.5, timeout=10):
+        """
+        :param host: Host of the Varnish front end, for purges
+        :param port: Port of the Varnish front end
+        :param ban: function that sends one ban expression to Varnish, raising an exception on failure
+        """
+        self.host = host
+        self.port = port
+        self._ban = ban
+        self.asynchronous = asynchronous
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.book_ban_threshold = book_ban_threshold
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._lock = threading.Condition()
+        self._urgent_purges = OrderedDict()
+        self._purges = OrderedDict()
+        self._bans = OrderedDict()
+        self._section_bans = OrderedDict()  # book -> OrderedDict of section regexes
+        self._book_bans = OrderedDict()     # book -> regex of the whole book
+        self._in_flight = 0                 # Number of invalidations taken from the queue and not yet sent
+        self._thread = None
+        self._pid = os.getpid()
+
+        self.added = 0    # Number of invalidations added
+        self.sent = 0     # Number of requests sent
+        self.retries = 0
+        self.failed = 0   # Number of requests dropped after all retries failed
+
+    def add_purge(self, url, urgent=False):
+        """
+        :param urgent: Send with the next `done()`, in the calling thread, rather than from the background thread.
+            For pages that the user who made the change is about to load.
+        """
+        with self._locked():
+            self.added += 1
+            if urgent:
+                self._purges.pop(url, None)
+                self._urgent_purges[url] = True
+            elif url not in self._urgent_purges:
+                self._purges[url] = True
+            self._lock.notify()
+
+    def add_ban(self, expression):
+        with self._locked():
+            self.added += 1
+            self._bans[expression] = True
+            self._lock.notify()
+
+    def add_section_ban(self, book, section_regex, book_regex):
+        """
+        :param book: Key that groups sections to be replaced by a ban of the whole book
+        :param section_regex: URL regex of the section
+        :param book_regex: URL regex of the whole book
+        """
+        with self._locked():
+            self.added += 1
+            if book not in self._book_bans:
+                sections = self._section_bans.setdefault(book, OrderedDict())
+                sections[section_regex] = True
+                if len(sections) > self.book_ban_threshold:
+                    del self._section_bans[book]
+                    self._book_bans[book] = book_regex
+            self._lock.notify()
+
+    def done(self):
+        """
+        Marks the end of a group of invalidations.  Sends the urgent purges, so that they have reached Varnish before
+        the response to the change has.  Without a background thread, sends everything.
+        """
+        if not self.asynchronous:
+            self.flush()
+            return
+        with self._locked():
+            if not self._urgent_purges:
+                return
+            batch = (list(self._urgent_purges), [], [])
+            self._urgent_purges = OrderedDict()
+            self._in_flight += self._batch_size(batch)
+        try:
+            self._send(batch)
+        finally:
+            with self._lock:
+                self._in_flight -= self._batch_size(batch)
+                self._lock.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Sends everything waiting in the calling thread, and waits up to `timeout` seconds for what the background thread is sending.
+        """
+        with self._locked(start_worker=False):
+            batch = self._take()
+        self._send(batch)
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            self._in_flight -= self._batch_size(batch)
+            while self._in_flight > 0:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+
+    def stats(self):
+        with self._lock:
+            depth = self._pending() + self._in_flight
+            return {
+                "queue_depth": depth,
+                "added": self.added,
+                "sent": self.sent,
+                "coalescing_ratio": round((self.added - depth) / float(self.sent), 2) if self.sent else None,
+                "retries": self.retries,
+                "failed": self.failed,
+            }
+
+    def _locked(self, start_worker=True):
+        if self._pid != os.getpid():
+            # Forked.  What is waiting will be sent by the parent.
+            self._reset()
+        if start_worker and self.asynchronous and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run, name="varnish-invalidation")
+            self._thread.daemon = True
+            self._thread.start()
+        return self._lock
+
+    def _pending(self, urgent=True):
+        return (len(self._urgent_purges) if urgent else 0) + len(self._purges) + len(self._bans) + len(self._book_bans) + sum(len(s) for s in self._section_bans.values())
+
+    def _take(self, urgent=True):
+        """
+        Removes everything waiting from the queue, but for the urgent purges if not `urgent`.  Call with the lock held.
+        :return: (purges, bans, section regexes)
+        """
+        regexes = list(self._book_bans.values())
+        for sections in self._section_bans.values():
+            regexes += list(sections)
+        batch = ((list(self._urgent_purges) if urgent else []) + list(self._purges), list(self._bans), regexes)
+        if urgent:
+            self._urgent_purges = OrderedDict()
+        self._purges = OrderedDict()
+        self._bans = OrderedDict()
+        self._section_bans = OrderedDict()
+        self._book_bans = OrderedDict()
+        self._in_flight += self._batch_size(batch)
+        return batch
+
+    @staticmethod
+    def _batch_size(batch):
+        return sum(len(b) for b in batch)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending(urgent=False):
+                    self._lock.wait()
+                deadline = time.time() + self.flush_interval
+                while time.time() < deadline:
+                    self._lock.wait(deadline - time.time())
+                batch = self._take(urgent=False)  # Left for done()
+            try:
+                self._send(batch)
+            except Exception:
+                logger.exception("Failed to send Varnish invalidations")
+            with self._lock:
+                self._in_flight -= self._batch_size(batch)
+                self._lock.notify_all()
+
+    def _send(self, batch):
+        purges, bans, regexes = batch
+        for i in range(0, len(purges), self.batch_size):
+            self._with_retries(self._send_purges, purges[i:i + self.batch_size])
+        for i in range(0, len(regexes), self.batch_size):
+            self._with_retries(self._ban, self.SECTION_BAN.format("|".join(regexes[i:i + self.batch_size])))
+        for expression in bans:
+            self._with_retries(self._ban, expression)
+
+    def _with_retries(self, f, arg):
+        for attempt in range(self.max_retries + 1):
+            try:
+                f(arg)
+                with self._lock:
+                    self.sent += len(arg) if isinstance(arg, list) else 1
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self.failed += 1
+                    logger.error("Varnish invalidation failed after {} attempts: {}".format(attempt + 1, e))
+                    return False
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _send_purges(self, urls):
+        """
+        Purges each of `urls` over one connection to the Varnish front end.  Raises on a connection error or a server error.
+        """
+        connection = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            for url in urls:
+                url = urlparse(url)
+                path = url.path or '/'
+                connection.request('PURGE', '%s?%s' % (path, url.query) if url.query else path, '', {'Host': url.hostname})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    raise HTTPException("Purge of {} failed with status: {}".format(url.geturl(), response.status))
+                if response.status != 200:
+                    logger.error('Purge of {}{} on host {} failed with status: {}'.format(path,
+                                                                                          "?" + url.query if url.query else '',
+                                                                                          url.hostname,
+                                                                                          response.status))
+        finally:
+            connection.close()
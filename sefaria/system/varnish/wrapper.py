@@ -4,7 +4,7 @@
 import re
 import urllib.request, urllib.parse, urllib.error
 
-from .common import manager, secret, purge_url, FRONT_END_URL
+from .common import invalidation_queue, FRONT_END_URL
 from sefaria.model import *
 from sefaria.system.exceptions import InputError
 from sefaria.utils.util import graceful_exception
@@ -20,6 +20,7 @@ def invalidate_ref(oref, lang=None, version=None, purge=False):
     Called when 'ref' is changed.
     We aim to PURGE the main page, so that the results of any save will be immediately visible to the person editing.
     All other implications are handled with a blanket BAN.
+    Purges and bans are sent through `invalidation_queue`, which merges and batches them.
 
     todo: Tune this so as not to ban when the version changed is not a displayed version
     """
@@ -33,33 +34,32 @@ def invalidate_ref(oref, lang=None, version=None, purge=False):
         version = urllib.parse.quote(version.replace(" ", "_").encode("utf-8"))
     if purge:
         # Purge this section level ref, so that immediate responses will return good results
-        purge_url("{}/api/texts/{}".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.add_purge("{}/api/texts/{}".format(FRONT_END_URL, oref.url()), urgent=True)
         if version and lang:
             try:
-                purge_url("{}/api/texts/{}/{}/{}".format(FRONT_END_URL, oref.url(), lang, version))
+                invalidation_queue.add_purge("{}/api/texts/{}/{}/{}".format(FRONT_END_URL, oref.url(), lang, version), urgent=True)
             except Exception as e:
                 logger.exception(e)
         # Hacky to add these
-        purge_url("{}/api/texts/{}?commentary=1&sheets=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/texts/{}?sheets=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/texts/{}?commentary=0".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/texts/{}?commentary=0&pad=0".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.add_purge("{}/api/texts/{}?commentary=1&sheets=1".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/texts/{}?sheets=1".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/texts/{}?commentary=0".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/texts/{}?commentary=0&pad=0".format(FRONT_END_URL, oref.url()), urgent=True)
         if version and lang:
             try:
-                purge_url("{}/api/texts/{}/{}/{}?commentary=0".format(FRONT_END_URL, oref.url(), lang, version))
+                invalidation_queue.add_purge("{}/api/texts/{}/{}/{}?commentary=0".format(FRONT_END_URL, oref.url(), lang, version), urgent=True)
             except Exception as e:
                 logger.exception(e)
-        purge_url("{}/api/links/{}".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/links/{}?with_text=0".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/links/{}?with_text=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/related/{}".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/related/{}?with_sheet_links=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/related/{}?with_sheet_links=0".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.add_purge("{}/api/links/{}".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/links/{}?with_text=0".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/links/{}?with_text=1".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/related/{}".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/related/{}?with_sheet_links=1".format(FRONT_END_URL, oref.url()), urgent=True)
+        invalidation_queue.add_purge("{}/api/related/{}?with_sheet_links=0".format(FRONT_END_URL, oref.url()), urgent=True)
 
-    # Ban anything underneath this section
-    manager.run("ban", 'obj.http.url ~ "/api/texts/{}"'.format(url_regex(oref)), secret=secret)
-    manager.run("ban", 'obj.http.url ~ "/api/links/{}"'.format(url_regex(oref)), secret=secret)
-    manager.run("ban", 'obj.http.url ~ "/api/related/{}"'.format(url_regex(oref)), secret=secret)
+    # Ban anything underneath this section, or, once many sections of this book are waiting, underneath the book
+    invalidation_queue.add_section_ban(oref.index.title, url_regex(oref), url_regex(Ref(oref.index.title)))
+    invalidation_queue.done()
 
 
 
@@ -82,9 +82,10 @@ def invalidate_counts(indx):
         logger.warn("Could not parse index '{}' to purge counts from Varnish.".format(indx))
         return
 
-    purge_url("{}/api/preview/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/counts/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
+    invalidation_queue.add_purge("{}/api/preview/{}".format(FRONT_END_URL, url))
+    invalidation_queue.add_purge("{}/api/counts/{}".format(FRONT_END_URL, url))
+    invalidation_queue.add_purge("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
+    invalidation_queue.done()
 
     # Assume this is unnecesary, given that the specific URLs will have been purged/banned by the save action
     # oref = Ref(indx.title)
@@ -106,10 +107,11 @@ def invalidate_index(indx):
         logger.warn("Could not parse index '{}' to purge from Varnish.".format(indx))
         return
 
-    purge_url("{}/api/index/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/raw/index/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/index/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
+    invalidation_queue.add_purge("{}/api/index/{}".format(FRONT_END_URL, url))
+    invalidation_queue.add_purge("{}/api/v2/raw/index/{}".format(FRONT_END_URL, url))
+    invalidation_queue.add_purge("{}/api/v2/index/{}".format(FRONT_END_URL, url))
+    invalidation_queue.add_purge("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
+    invalidation_queue.done()
 
 
 @graceful_exception(logger=logger, return_value=None)
@@ -117,8 +119,9 @@ def invalidate_title(title):
     title = title.replace(" ", "_").replace(":", ".")
     invalidate_index(title)
     invalidate_counts(title)
-    manager.run("ban", 'obj.http.url ~ "/api/texts/{}"'.format(title), secret=secret)
-    manager.run("ban", 'obj.http.url ~ "/api/links/{}"'.format(title), secret=secret)
+    invalidation_queue.add_ban('obj.http.url ~ "/api/texts/{}"'.format(title))
+    invalidation_queue.add_ban('obj.http.url ~ "/api/links/{}"'.format(title))
+    invalidation_queue.done()
 
 
 
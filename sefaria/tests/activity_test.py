@@ -47,4 +47,36 @@ class Test_collapse_activity():
 
 	def test_no_collapse(self):
 		collapsed = history.collapse_activity([activity_a, activity_d])
-		assert len(collapsed) == 2
\ No newline at end of file
+		assert len(collapsed) == 2
+
+def test_checkpoint_due(monkeypatch):
+	import sefaria.model.history as model_history
+	monkeypatch.setattr(model_history, "HISTORY_CHECKPOINT_INTERVAL", 10)
+	monkeypatch.setattr(model_history, "HISTORY_CHECKPOINT_PATCH_BYTES", 1000)
+	monkeypatch.setattr(model_history, "HISTORY_CHECKPOINT_MAX_OVERHEAD", 1.0)
+	assert not model_history.checkpoint_due(9, 500, 100)
+	assert model_history.checkpoint_due(10, 500, 100)
+	assert model_history.checkpoint_due(1, 1000, 100)
+	assert not model_history.checkpoint_due(10, 500, 600)  # larger than the patches since the last checkpoint
+	monkeypatch.setattr(model_history, "HISTORY_CHECKPOINT_INTERVAL", 0)
+	assert not model_history.checkpoint_due(10, 1000, 100)
+
+
+def test_changed_segments():
+	from sefaria.model.history import _changed_segments
+	old = [["a", "b"], ["c"]]
+	new = [["a", "B"], ["c", "d"], ["e"]]
+	assert _changed_segments(old, new) == [((3, 1), "", "e"), ((2, 2), "", "d"), ((1, 2), "b", "B")]
+	assert _changed_segments(old, old) == []
+	assert _changed_segments("x", "y") == [((), "x", "y")]
+
+
+def test_complete_text_log():
+	from sefaria.model.history import complete_text_log, text_log_diffs
+	from diff_match_patch import diff_match_patch
+	dmp = diff_match_patch()
+	log = complete_text_log({"old_text": "In the beginning", "new_text": "At the beginning"})
+	assert log["diff_html"] == text_log_diffs("In the beginning", "At the beginning")[0]
+	assert dmp.patch_apply(dmp.patch_fromText(log["revert_patch"]), "At the beginning")[0] == "In the beginning"
+	filled = {"revert_patch": "x", "diff_html": "y"}
+	assert complete_text_log(filled) == {"revert_patch": "x", "diff_html": "y"}
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+import random
+
+from sefaria.datatype.jagged_array import JaggedIntArray
+from sefaria.model import library, Ref
+from sefaria.sitemap import available_sections, section_url, SitemapWriter
+
+
+def random_counts(rand, depth):
+    if depth == 0:
+        return rand.choice([0, 0, 1, 2])
+    return [random_counts(rand, depth - 1) for _ in range(rand.randint(0, 4))]
+
+
+def test_available_sections():
+    rand = random.Random(18)
+    for _ in range(200):
+        counts = random_counts(rand, rand.randint(1, 4))
+        ja = JaggedIntArray(counts)
+        assert list(available_sections(counts, ja.get_depth())) == ja.non_empty_sections()
+
+
+def test_section_url():
+    assert section_url(library.get_index("Shabbat").nodes, [5, 2]) == Ref("Shabbat 3a:2").url()
+    assert section_url(library.get_index("Genesis").nodes, [12]) == Ref("Genesis 12").url()
+    assert section_url(library.get_index("Genesis").nodes, []) == Ref("Genesis").url()
+
+
+def test_writer_rewrites_only_changed(tmpdir):
+    directory = str(tmpdir)
+    manifest = {}
+
+    def write(urls):
+        writer = SitemapWriter(directory, "test-sitemap", manifest, max_urls=2)
+        for url in urls:
+            writer.add(url, "2020-01-01")
+        return writer.close(), writer.changed
+
+    filenames, changed = write(["https://a/1", "https://a/2", "https://a/3"])
+    assert filenames == changed == ["test-sitemap0.xml.gz", "test-sitemap1.xml.gz"]
+    with gzip.open(os.path.join(directory, "test-sitemap1.xml.gz"), "rt") as f:
+        assert "<url><loc>https://a/3</loc><lastmod>2020-01-01</lastmod></url>" in f.read()
+
+    filenames, changed = write(["https://a/1", "https://a/2", "https://a/4"])
+    assert changed == ["test-sitemap1.xml.gz"]
+    assert not [f for f in os.listdir(directory) if f.endswith(".tmp")]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import io
+import zipfile
+
+from sefaria.utils.zipstream import stream_zip
+
+
+def test_stream_zip():
+    files = [
+        ("Genesis - en - Version.txt", "In the beginning " * 10000),
+        ("בראשית - he - Version.json", lambda: "בראשית ברא".encode("utf-8")),
+        ("empty.txt", b""),
+    ]
+    chunks = list(stream_zip(files, chunk_size=4096))
+    assert len(chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == [name for name, _ in files]
+        assert zfile.read("Genesis - en - Version.txt") == ("In the beginning " * 10000).encode("utf-8")
+        assert zfile.read("בראשית - he - Version.json").decode("utf-8") == "בראשית ברא"
+        assert zfile.read("empty.txt") == b""
+
+
+def test_files_read_lazily():
+    read = []
+
+    def content(name):
+        def read_file():
+            read.append(name)
+            return name * 100
+        return read_file
+
+    stream = stream_zip([(name, content(name)) for name in ("a", "b")])
+    next(stream)
+    assert read == ["a"]
+    list(stream)
+    assert read == ["a", "b"]
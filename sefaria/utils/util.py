@@ -455,6 +455,11 @@ def get_size(obj, seen=None):
                 if inspect.isgetsetdescriptor(d) or inspect.ismemberdescriptor(d):
                     size += get_size(obj.__dict__, seen)
                 break
+    for cls in obj.__class__.__mro__:
+        slots = getattr(cls, '__slots__', ())
+        for slot in ([slots] if isinstance(slots, str) else slots):
+            if hasattr(obj, slot):
+                size += get_size(getattr(obj, slot), seen)
     if isinstance(obj, dict):
         size += sum((get_size(v, seen) for v in list(obj.values())))
         size += sum((get_size(k, seen) for k in list(obj.keys())))
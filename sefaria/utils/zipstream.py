@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+zipstream.py - writes zip archives as a stream of chunks, for archives too large to build in memory.
+"""
+import io
+import zipfile
+
+
+class _ChunkWriter(io.RawIOBase):
+    """
+    An unseekable file that holds what is written to it until it is taken.
+    Since it can't seek, zipfile follows each entry with a data descriptor rather than going back to fill in its header.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files, compression=zipfile.ZIP_DEFLATED, chunk_size=1024 * 1024):
+    """
+    Yields the bytes of a zip archive of `files`.  Each file is read only once the previous one has been yielded,
+    so at most one file is held in memory.
+    :param files: iterable of (name, content), where content is bytes, a str (written as utf-8),
+        or a function of no arguments that returns either
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, "w", compression) as zfile:
+        for name, content in files:
+            if callable(content):
+                content = content()
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            with zfile.open(name, "w", force_zip64=len(content) >= zipfile.ZIP64_LIMIT) as entry:
+                for i in range(0, len(content), chunk_size):
+                    entry.write(content[i:i + chunk_size])
+                    data = writer.take()
+                    if data:
+                        yield data
+            content = None
+    yield writer.take()
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 import io
 import os
+import glob
+import hashlib
+import threading
 import zipfile
+from functools import partial
 import json
 import re
 import bleach
@@ -13,7 +17,7 @@ from webpack_loader import utils as webpack_utils
 
 from django.utils.translation import ugettext as _
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseRedirect, Http404, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
@@ -49,6 +53,7 @@ from sefaria.system.database import db
 from sefaria.system.decorators import catch_error_as_http
 from sefaria.utils.hebrew import is_hebrew, strip_nikkud
 from sefaria.utils.util import strip_tags
+from sefaria.utils.zipstream import stream_zip
 from sefaria.helper.text import make_versions_csv, get_library_stats, get_core_link_stats, dual_text_diff
 from sefaria.clean import remove_old_counts
 from sefaria.search import index_sheets_by_timestamp as search_index_sheets_by_timestamp
@@ -61,6 +66,12 @@ if USE_VARNISH:
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+    from sefaria.settings import BULK_DOWNLOAD_MAX_CONCURRENT, BULK_DOWNLOAD_CACHE_DIR
+except ImportError:
+    BULK_DOWNLOAD_MAX_CONCURRENT = 2
+    BULK_DOWNLOAD_CACHE_DIR = None
+
 
 def process_register_form(request, auth_method='session'):
     form = NewUserForm(request.POST) if auth_method == 'session' else NewUserFormAPI(request.POST)
@@ -259,9 +270,20 @@ def bulktext_api(request, refs):
         useTextFamily = request.GET.get("useTextFamily", None)
         refs = set(refs.split("|"))
         res = {}
+        orefs = {}
         for tref in refs:
             try:
-                oref = model.Ref(tref)
+                orefs[tref] = model.Ref(tref)
+            except (InputError, ValueError, AttributeError, KeyError) as e:
+                # referer = request.META.get("HTTP_REFERER", "unknown page")
+                # This chatter fills up the logs.  todo: put in it's own file
+                # logger.warning(u"Linker failed to parse {} from {} : {}".format(tref, referer, e))
+                res[tref] = {"error": 1}
+        if not useTextFamily:
+            # A ref whose text can't be loaded is reported by batch.text(), below, without failing the rest
+            batch = model.TextChunkBatch(list(orefs.values()), ["he", "en"])
+        for tref, oref in orefs.items():
+            try:
                 lang = "he" if is_hebrew(tref) else "en"
                 if useTextFamily:
                     text_fam = model.TextFamily(oref, commentary=0, context=0, pad=False)
@@ -277,8 +299,8 @@ def bulktext_api(request, refs):
                         'url': oref.url()
                     }
                 else:
-                    he = model.TextChunk(oref, "he").text
-                    en = model.TextChunk(oref, "en").text
+                    he = batch.text(oref, "he")
+                    en = batch.text(oref, "en")
                     res[tref] = {
                         'he': he if isinstance(he, str) else JaggedTextArray(he).flatten_to_string(),  # these could be flattened on the client, if need be.
                         'en': en if isinstance(en, str) else JaggedTextArray(en).flatten_to_string(),
@@ -287,10 +309,7 @@ def bulktext_api(request, refs):
                         'heRef': oref.he_normal(),
                         'url': oref.url()
                     }
-            except (InputError, ValueError, AttributeError, KeyError) as e:
-                # referer = request.META.get("HTTP_REFERER", "unknown page")
-                # This chatter fills up the logs.  todo: put in it's own file
-                # logger.warning(u"Linker failed to parse {} from {} : {}".format(tref, referer, e))
+            except (InputError, ValueError, AttributeError, KeyError, IndexError) as e:
                 res[tref] = {"error": 1}
         resp = jsonResponse(res, cb)
         return resp
@@ -327,18 +346,20 @@ def passages_api(request, refs):
         cb = request.GET.get("callback", None)
         refs = set(refs.split("|"))
 
-        # todo: Use PassageSet, so that it can be packaged as one query
+        normals = {}
         for tref in refs:
             try:
-                oref = Ref(tref)
-                p = Passage().load({"ref_list": oref.normal()})
-                if p:
-                    response[tref] = p.full_ref
-                else:
-                    response[tref] = oref.normal()
+                normals[tref] = Ref(tref).normal()
             except InputError:
                 response[tref] = tref  # is this the best thing to do?  It passes junk along...
 
+        full_refs = {}
+        for p in PassageSet({"ref_list": {"$in": list(set(normals.values()))}}, proj={"ref_list": 1, "full_ref": 1}):
+            for r in p.ref_list:
+                full_refs.setdefault(r, p.full_ref)
+        for tref, normal in normals.items():
+            response[tref] = full_refs.get(normal, normal)
+
         resp = jsonResponse(response, cb)
         return resp
 
@@ -445,7 +466,7 @@ def reset_counts(request, title=None):
         except:
             return HttpResponseRedirect("/dashboard?m=Unknown-Book")
         vs = model.VersionState(index=i)
-        vs.refresh()
+        vs.refresh(force=True)
 
         return HttpResponseRedirect("/%s?m=Counts-Rebuilt" % model.Ref(i.title).url())
     else:
@@ -584,6 +605,11 @@ def cache_stats(request):
     # from sefaria.sheets import last_updated
     resp = {
         'ref_cache_size': model.Ref.cache_size(),
+        'ref_cache_stats': model.Ref.cache_stats(),
+        'text_chunk_cache_stats': model.text.text_chunk_cache.stats(),
+        'webpage_hit_buffer_stats': model.webpage.webpage_hit_buffer.stats(),
+        'text_history_queue_stats': model.history.text_history_queue.stats(),
+        'offset_table_cache_stats': model.version_state.offset_tables.stats(),
         # 'ref_cache_bytes': model.Ref.cache_size_bytes(), # This pretty expensive, not sure if it should run on prod.
         'public_user_data_size': len(public_user_data_cache),
         'public_user_data_bytes': get_size(public_user_data_cache),
@@ -591,6 +617,9 @@ def cache_stats(request):
         # 'sheets_last_updated_bytes': get_size(last_updated),
         'memory usage': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
     }
+    if USE_VARNISH:
+        from sefaria.system.varnish.common import invalidation_queue
+        resp['varnish_invalidation_queue_stats'] = invalidation_queue.stats()
     return jsonResponse(resp)
 
 
@@ -861,27 +890,73 @@ def bulk_download_versions_api(request):
     if language:
         query["language"] = language
 
-    vs = VersionSet(query)
+    vs = VersionSet(query, proj={"title": 1, "language": 1, "versionTitle": 1, "license": 1, "lastModified": 1})
 
     if len(vs) == 0:
         return jsonResponse({"error": "No versions found to match query"})
-
-    file_like_object = io.BytesIO()
-    with zipfile.ZipFile(file_like_object, "a", zipfile.ZIP_DEFLATED) as zfile:
-        for version in vs:
-            filebytes = _get_text_version_file(format, version.title, version.language, version.versionTitle)
-            name = '{} - {} - {}.{}'.format(version.title, version.language, version.versionTitle, format).encode('utf-8')
-            if isinstance(filebytes, str):
-                filebytes = filebytes.encode('utf-8')
-            zfile.writestr(name, filebytes)
-
-    content = file_like_object.getvalue()
-    response = HttpResponse(content, content_type="application/zip")
+    if any(version.is_copyrighted() for version in vs):
+        return jsonResponse({"error": "Cowardly refusing to export copyrighted text."})
+    if not _bulk_download_slots.acquire(blocking=False):
+        return jsonResponse({"error": "Too many bulk downloads in progress. Please try again later."})
+
+    stream = _bulk_download_stream(format, vs)
+    next(stream)  # enter the stream, so that it releases its slot even if it is closed before it is read
+    response = StreamingHttpResponse(stream, content_type="application/zip")
     filename = "{}-{}-{}-{}.zip".format(list(filter(str.isalnum, str(title_pattern))), list(filter(str.isalnum, str(version_title_pattern))), language, format).encode('utf-8')
     response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
     return response
 
 
+_bulk_download_slots = threading.BoundedSemaphore(BULK_DOWNLOAD_MAX_CONCURRENT)
+
+
+def _bulk_download_stream(format, versions):
+    """
+    Yields a zip of the files of `versions` in `format`, rendering one version at a time.  Holds a bulk download slot until closed.
+    """
+    try:
+        yield b""
+        files = (('{} - {} - {}.{}'.format(version.title, version.language, version.versionTitle, format),
+                  partial(_cached_text_version_file, format, version)) for version in versions)
+        for chunk in stream_zip(files):
+            yield chunk
+    finally:
+        _bulk_download_slots.release()
+
+
+def _cached_text_version_file(format, version):
+    """
+    Returns the file of `version` in `format`, from BULK_DOWNLOAD_CACHE_DIR if it holds one made since the version was last modified.
+    Versions saved before they began to record `lastModified` are not cached.
+    """
+    stamp = getattr(version, "lastModified", None)
+    if not BULK_DOWNLOAD_CACHE_DIR or not stamp:
+        return _get_text_version_file(format, version.title, version.language, version.versionTitle)
+
+    key = hashlib.md5("{}|{}|{}|{}".format(version.title, version.language, version.versionTitle, format).encode("utf-8")).hexdigest()
+    path = os.path.join(BULK_DOWNLOAD_CACHE_DIR, "{}-{}".format(key, hashlib.md5(str(stamp).encode("utf-8")).hexdigest()))
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except IOError:
+        pass
+
+    content = _get_text_version_file(format, version.title, version.language, version.versionTitle)
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    try:
+        os.makedirs(BULK_DOWNLOAD_CACHE_DIR, exist_ok=True)
+        for stale in glob.glob(os.path.join(BULK_DOWNLOAD_CACHE_DIR, key + "-*")):
+            os.remove(stale)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except (IOError, OSError) as e:
+        logger.warning("Failed to cache {} file of {}: {}".format(format, version, e))
+    return content
+
+
 def _get_text_version_file(format, title, lang, versionTitle):
     from sefaria.export import text_is_copyright, make_json, make_text, prepare_merged_text_for_export, prepare_text_for_export, export_merged_csv, export_version_csv
 